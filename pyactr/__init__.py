@@ -3,3 +3,5 @@ __version__ = "0.3.2"
 from pyactr.model import ACTRModel
 from pyactr.environment import Environment
 from pyactr.chunks import chunktype, makechunk, chunkstring
+from pyactr.batch import run_batch
+from pyactr.recorder import EventRecorder
@@ -0,0 +1,119 @@
+"""
+Batch (Monte-Carlo) simulations of ACT-R models.
+"""
+
+import collections
+import collections.abc
+import concurrent.futures
+import inspect
+import itertools
+
+import numpy as np
+
+from pyactr import model, utilities
+
+OUTPUTS = ("events", "retrievals", "rts")
+
+BatchResult = collections.namedtuple('BatchResult', 'index params seed events retrievals rts')
+
+def param_grid(grid):
+    """
+    Expand a grid of parameters into a list of dicts, one dict per combination.
+
+    grid is a dict mapping parameter names to iterables of values, e.g., {"decay": [0.3, 0.5], "instantaneous_noise": [0.1, 0.2]}.
+    """
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+def run_batch(model_factory, params=None, seeds=None, outputs=("events",), max_time=1, workers=None, seed=None):
+    """
+    Run many simulations of a model and yield their results as they finish.
+
+    model_factory: a callable that is called with the parameters of one run as keyword arguments and returns an ACTRModel or a Simulation. If an ACTRModel is returned, its simulation is created with trace=False and gui=False. When workers are used, model_factory must be picklable (e.g., a function defined at the module level).
+    params: a dict of parameters (expanded as a grid by param_grid) or an iterable of dicts; if None, the factory is called without arguments.
+    seeds: None (one run per parameter setting), the number of runs per parameter setting, or an iterable of seeds used for runs of each parameter setting.
+    outputs: which results should be collected; any of "events" (all events, as (time, proc, action) tuples), "retrievals" (results of retrievals, as (time, buffer, retrieved chunk)) and "rts" (times of key presses, as (time, key)). Outputs that are not collected are None.
+    max_time: the simulated time for which each run is carried out.
+    workers: the number of processes; None uses as many processes as there are CPUs, 0 runs everything in the current process.
+    seed: the seed from which the seeds of individual runs are derived if seeds are not given explicitly.
+
+    Every run has its own random generator, numpy.random.default_rng(seed) with the seed of the run. If model_factory has the parameter rng, the generator is passed to it (this is needed if model_factory returns a Simulation, and it is the generator that the factory should use for any random choices of its own); otherwise, the generator is assigned to the returned model (see ACTRModel.rng). A run thus gives the same result no matter which process carries it out and in which order runs finish. Each run is carried out by Simulation.run with max_time, so events at max_time or later are not collected. Results are instances of BatchResult; use their index to put them in order.
+    """
+    outputs = tuple(outputs)
+    for each in outputs:
+        if each not in OUTPUTS:
+            raise utilities.ACTRError(f"'{each}' is not a known output of batch runs; the outputs must be some of {OUTPUTS}")
+
+    if params is None:
+        params = [{}]
+    elif isinstance(params, collections.abc.Mapping):
+        params = param_grid(params)
+    else:
+        params = [dict(x) for x in params]
+
+    if seeds is None or isinstance(seeds, int):
+        count = 1 if seeds is None else seeds
+        states = np.random.SeedSequence(seed).spawn(count*len(params))
+        run_seeds = [int(x.generate_state(1)[0]) for x in states]
+    else:
+        seeds = [int(x) for x in seeds]
+        run_seeds = seeds*len(params)
+        count = len(seeds)
+
+    runs = [(idx, param, run_seeds[idx]) for idx, param in enumerate(x for x in params for _ in range(count))]
+
+    if workers == 0:
+        for run in runs:
+            yield _run_single(model_factory, run, outputs, max_time)
+    else:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+        try:
+            futures = [executor.submit(_run_single, model_factory, run, outputs, max_time) for run in runs]
+            for future in concurrent.futures.as_completed(futures):
+                yield future.result()
+        finally:
+            executor.shutdown(cancel_futures=True) #if iteration stops early (the generator is closed), runs that have not started are dropped instead of being waited for
+
+def _run_single(model_factory, run, outputs, max_time):
+    """
+    Carry out one run of a batch and collect its outputs. Only plain data (no chunks) are returned so that the result can be passed between processes.
+    """
+    idx, param, seed = run
+    rng = np.random.default_rng(seed)
+    if "rng" in inspect.signature(model_factory).parameters:
+        sim = model_factory(rng=rng, **param)
+    else:
+        sim = model_factory(**param)
+        if isinstance(sim, model.ACTRModel):
+            sim.rng = rng
+    if isinstance(sim, model.ACTRModel):
+        sim = sim.simulation(trace=False, gui=False)
+
+    events = []
+    def collect(event):
+        events.append(event) #actions are rendered as strings below only if they are collected
+        return False
+    sim.run(max_time, until=collect)
+
+    collected = {"events": None, "retrievals": None, "rts": None}
+    if "events" in outputs:
+        collected["events"] = [(time, proc, str(action)) for time, proc, action in events]
+    if "retrievals" in outputs:
+        collected["retrievals"] = [(time, proc, _result(action, "RETRIEVED: ")) for time, proc, action in events if utilities.action_code(action).startswith("RETRIEVED: ")]
+    if "rts" in outputs:
+        collected["rts"] = [(time, _result(action, "KEY PRESSED: ")) for time, proc, action in events if utilities.action_code(action).startswith("KEY PRESSED: ")]
+    return BatchResult(idx, param, seed, **collected)
+
+def _result(action, prefix):
+    """
+    Strip prefix from the action; failed retrievals are returned as None.
+    """
+    if isinstance(action, utilities.Action) and len(action.objects) == 1:
+        result = action.objects[0]
+        if result is None:
+            return None
+        return str(result)
+    result = str(action)[len(prefix):]
+    if result == "None":
+        return None
+    return result
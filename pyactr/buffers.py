@@ -17,6 +17,8 @@ class Buffer(collections.abc.MutableSet):
 
     def __init__(self, dm=None, data=None):
         self.dm = dm
+        self.__rng = None
+        self._own_rng = False #True if the generator was set by the user; the model then leaves it alone
         self.state = self._FREE #set here but state of buffer instances controlled in productions
         if data == None:
             self._data = set([])
@@ -38,6 +40,25 @@ class Buffer(collections.abc.MutableSet):
         else:
             raise ValueError('The attempted dm value cannot be set; it is not a possible declarative memory')
 
+    @property
+    def rng(self):
+        """
+        Random generator from which the buffer draws noise. Unless it is set explicitly, the buffer uses the generator of the model, assigned whenever a simulation is created (see use_model_rng).
+        """
+        return self.__rng
+
+    @rng.setter
+    def rng(self, value):
+        self.__rng = value
+        self._own_rng = value is not None
+
+    def use_model_rng(self, rng):
+        """
+        Use rng, the generator of the model, unless the buffer has its own generator.
+        """
+        if not self._own_rng:
+            self.__rng = rng
+
     def __contains__(self, elem):
         return elem in self._data
 
@@ -64,6 +85,19 @@ class Buffer(collections.abc.MutableSet):
         else:
             raise TypeError("Only chunks can be added to Buffer")
 
+    def get_state(self):
+        """
+        Return the state of the buffer (its content and state), used in model snapshots.
+        """
+        return {"_data": self._data.copy(), "state": self.state}
+
+    def set_state(self, state):
+        """
+        Set the state of the buffer to state (see get_state).
+        """
+        self._data = state["_data"].copy()
+        self.state = state["state"]
+
     def discard(self, elem):
         """
         Discard an element without clearing it into a memory.
@@ -3,9 +3,12 @@ Chunks
 """
 
 import collections
+import collections.abc
 from collections.abc import Sequence
+import functools
 import re
 import warnings
+import weakref
 
 from pyactr import utilities
 from pyactr.utilities import ACTRError
@@ -51,6 +54,30 @@ def chunktype(cls_name, field_names, defaults=None, include=None):
     except TypeError:
         Chunk._chunktypes.update({cls_name:collections.namedtuple(cls_name, field_names)}) #chunktypes are not returned; they are stored as Chunk class attribute
 
+def _slotnames(actrchunktype):
+    """
+    Return slot names (without the added _) of the chunk type actrchunktype (a namedtuple class). They are stored on the class, so they are shared by all chunks of the type and go away with the type.
+    """
+    try:
+        return actrchunktype._slotnames
+    except AttributeError:
+        actrchunktype._slotnames = tuple(re.sub("_$", "", x) for x in actrchunktype._fields) #fields of namedtuples cannot start with _, so the attribute does not clash with slots
+        return actrchunktype._slotnames
+
+@functools.lru_cache(maxsize=2**12)
+def _shared(varval):
+    """
+    Return the shared copy of varval (values of slots without chunks), so that identical values of recently created chunks are stored only once. The table is bounded and keeps the least recently shared values out; such a value may still be used by chunks, and the next chunk with an identical value then gets a new copy.
+    """
+    return varval
+
+@functools.lru_cache(maxsize=2**12)
+def _groundvarval(value):
+    """
+    Return the shared varval of the plain string value; used by Chunk.from_values.
+    """
+    return _shared(utilities.VarvalClass(values=value, variables=None, negvalues=(), negvariables=()))
+
 class Chunk(Sequence):
     """
     ACT-R chunks. Based on namedtuple (tuple with dictionary-like properties).
@@ -80,9 +107,12 @@ class Chunk(Sequence):
         def __repr__(self):
             return repr(self.value)
 
+    __slots__ = ("typename", "__boundvars", "actrchunk", "__unused", "__hash", "__hashvars", "__grounditems", "__constraints", "__positions", "__weakref__") #chunks carry no instance dictionary; they are kept in large numbers in declarative memory
+
     _chunktypes = {}
     _undefinedchunktypecounter = 0
     _chunks = {}
+    _interned = weakref.WeakValueDictionary() #chunks without variables, interned by their hash; chunks are compared on every lookup, since different chunks can have the same hash
 
     __emptyvalue = EmptyValue()
 
@@ -90,12 +120,18 @@ class Chunk(Sequence):
 
     def __init__(self, typename, **dictionary):
         self.typename = typename
-        self.boundvars = {} #dict of bound variables
+        self.__boundvars = None #dict of bound variables; created only when needed
 
         kwargs = {}
         for key in dictionary:
             #change values (and values in a tuple) into string, when possible (when the value is not another chunk)
-            if isinstance(dictionary[key], Chunk):
+            if isinstance(dictionary[key], str):
+                try:
+                    dictionary[key] = utilities.varvalsplitting(dictionary[key])
+                except utilities.ACTRError as e:
+                    raise utilities.ACTRError(f"The chunk {dictionary[key]} is not defined correctly; {e}")
+
+            elif isinstance(dictionary[key], Chunk):
                 dictionary[key] = utilities.VarvalClass(variables=None, values=dictionary[key], negvariables=(), negvalues=())
 
             elif isinstance(dictionary[key], utilities.VarvalClass):
@@ -112,20 +148,12 @@ class Chunk(Sequence):
             else:
                 #create namedtuple varval and split dictionary[key] into variables, values, negvariables, negvalues
                 try:
-                    temp_dict = utilities.stringsplitting(str(dictionary[key]))
+                    dictionary[key] = utilities.varvalsplitting(str(dictionary[key]))
                 except utilities.ACTRError as e:
                     raise utilities.ACTRError(f"The chunk {dictionary[key]} is not defined correctly; {e}")
-                loop_dict = temp_dict.copy()
-                for x in loop_dict:
-                    if x == "negvariables" or x == "negvalues":
-                        val = tuple(temp_dict[x])
-                    else:
-                        try:
-                            val = temp_dict[x].pop()
-                        except KeyError:
-                            val = None
-                    temp_dict[x] = val
-                dictionary[key] = utilities.VarvalClass(**temp_dict)
+
+            if isinstance(dictionary[key], utilities.VarvalClass):
+                dictionary[key] = self.__intern(dictionary[key])
 
             #adding _ to minimize/avoid name clashes
             kwargs[key+"_"] = dictionary[key]
@@ -150,9 +178,103 @@ class Chunk(Sequence):
         finally:
             self.actrchunk = self._chunktypes[typename](**kwargs)
 
-        self.__empty = None #this will store what the chunk looks like without empty values (the values will be stored on the first call of the relevant function)
         self.__unused = None #this will store what the chunk looks like without unused values
-        self.__hash = None, self.boundvars.copy() #this will store the hash along with variables (hash changes if some variables are resolved)
+        self.__hashvars = None #this will store variables used to calculate the hash (hash changes if some variables are resolved)
+        grounditems = frozenset(self.__hashitems(ground=True))
+        if any(True for _ in self.__hashitems(ground=False)):
+            self.__grounditems = grounditems #the hash of chunks with variables is calculated from these items and the items of variables
+            self.__hash = None
+        else:
+            self.__grounditems = None #chunks without variables have a fixed hash
+            self.__hash = hash(grounditems)
+        self.__constraints = None #this will store the chunk compiled into constraints, used when the chunk is matched against other chunks (compiled on the first call of match)
+        self.__positions = None #positions of slots of constraints in chunk types of other chunks
+
+    @classmethod
+    def from_values(cls, typename, values):
+        """
+        Create a chunk of the type typename from plain values, without parsing them.
+
+        values is either a dict mapping slots to values or a sequence of values in the order of slots of the chunk type (slots are sorted alphabetically). Values must be strings (other values, e.g., numbers, are turned into strings), chunks or None (empty slot). Strings are used as they are; they are not checked for variables or negations, so this is meant for plain values, e.g., when large lexicons are loaded into declarative memory. Chunk types given with dicts are created if they do not exist yet; chunk types given with sequences must exist.
+
+        For example:
+        >>> chunktype('chunktype_example1', 'value')
+        >>> Chunk.from_values('chunktype_example1', ('one',))
+        chunktype_example1(value= one)
+        """
+        try:
+            actrchunktype = cls._chunktypes[typename]
+        except KeyError:
+            if not isinstance(values, collections.abc.Mapping):
+                raise ACTRError(f"The chunk type '{typename}' is not defined; chunks can be created from sequences of values only for existing chunk types")
+            chunktype(typename, list(values))
+            actrchunktype = cls._chunktypes[typename]
+        fields = actrchunktype._fields
+        if isinstance(values, collections.abc.Mapping):
+            if len(values) > len(fields) or any(slot + "_" not in fields for slot in values):
+                return cls(typename, **values) #the chunk type has to be extended; leave that to the full constructor
+            values = [values.get(slot[:-1]) for slot in fields]
+        elif len(values) != len(fields):
+            raise ACTRError(f"The chunk type '{typename}' has {len(fields)} slots but {len(values)} values were given")
+
+        slotnames = _slotnames(actrchunktype)
+
+        varvals = []
+        hashitems = []
+        for slot, value in zip(slotnames, values):
+            if value is None:
+                varvals.append(cls.__emptyvalue)
+                continue
+            if isinstance(value, Chunk):
+                if value.__grounditems is not None:
+                    return cls(typename, **dict(zip(slotnames, values))) #chunks with variables as values make the hash variable; leave them to the full constructor
+                varval = utilities.VarvalClass(values=value, variables=None, negvalues=(), negvariables=())
+            else:
+                value = str(value)
+                varval = _groundvarval(value)
+            varvals.append(varval)
+            if value != cls.__emptyvalue:
+                hashitems.append((slot, ("values", hash(value))))
+
+        chunk = cls.__new__(cls)
+        chunk.typename = typename
+        chunk.__boundvars = None
+        chunk.actrchunk = actrchunktype._make(varvals)
+        chunk.__unused = None
+        chunk.__hashvars = None
+        chunk.__grounditems = None
+        chunk.__hash = hash(frozenset(hashitems))
+        chunk.__constraints = None
+        chunk.__positions = None
+        return chunk
+
+    @classmethod
+    def __intern(cls, varval):
+        """
+        Return the shared copy of varval if varval consists only of strings, so that identical slot values are stored only once.
+        """
+        if all(isinstance(x, str) or x is None for x in (varval.values, varval.variables)) and all(isinstance(x, str) for x in varval.negvalues + varval.negvariables):
+            return _shared(varval)
+        return varval
+
+    @property
+    def boundvars(self):
+        """
+        Dict of bound variables.
+        """
+        if self.__boundvars is None:
+            self.__boundvars = {}
+        return self.__boundvars
+
+    @boundvars.setter
+    def boundvars(self, value):
+        self.__boundvars = value
+
+    def __slotnames(self):
+        """
+        Return slot names of the chunk, without the added _.
+        """
+        return _slotnames(type(self.actrchunk))
 
     def _asdict(self):
         """
@@ -163,7 +285,7 @@ class Chunk(Sequence):
         return dictionary
 
     def __eq__(self, otherchunk):
-        if hash(self) == hash(otherchunk):
+        if self is otherchunk or hash(self) == hash(otherchunk):
             return True
         else:
             return False
@@ -175,43 +297,70 @@ class Chunk(Sequence):
             raise AttributeError("Chunk has no such attribute")
 
     def __getitem__(self, pos):
-        return re.sub("_$", "", self.actrchunk._fields[pos]), self.actrchunk[pos]
+        return self.__slotnames()[pos], self.actrchunk[pos]
 
     def __hash__(self):
-        if self.__hash[0] and self.boundvars == self.__hash[1]:
-            return self.__hash[0]
-        def hash_func():
-            for x in self.removeempty():
-                varval = utilities.splitting(x[1])
-                temp_varval = {"values": set(), "negvalues": set()}
-                for key in ["variables", "negvariables"]:
-                    if getattr(varval, key):
-                        for value in getattr(varval, key):
-                            try:
-                                temp_varval[re.sub("variables", "values", key)].add(self.boundvars[utilities.ACTRVARIABLE + value]) #add (neg)value based on the (neg)variable
-                            except KeyError:
-                                if x[0]:
-                                    yield tuple([x[0], tuple([key, hash(value)])]) #get hash of variable if it is not bound
-                                else:
-                                    yield tuple([key, hash(value)])
-                for key in ["values", "negvalues"]:
-                    if key == "values" and getattr(varval, key) != self.__emptyvalue:
-                        temp_varval[key].update(set([getattr(varval, key)]))
-                    elif key == "negvalues":
-                        temp_varval[key].update(set(getattr(varval, key)))
-                    if temp_varval[key]:
-                        for value in temp_varval[key]:
-                            if x[0]:
-                                yield tuple([x[0], tuple([key, hash(value)])]) #values get their hash directly
-                            else:
-                                yield tuple([key, hash(value)])
-
-        self.__hash = hash(tuple(hash_func())), self.boundvars.copy() #store the hash along with the vars used to calculate it, so it doesnt need to be recalculated
-        return self.__hash[0]
+        if self.__grounditems is None:
+            return self.__hash
+        if self.__hash is not None and (self.__boundvars or None) == self.__hashvars:
+            return self.__hash
+        self.__hash = hash(self.__grounditems.union(self.__hashitems(ground=False))) #store the hash along with the vars used to calculate it, so it doesnt need to be recalculated
+        self.__hashvars = self.__boundvars.copy() if self.__boundvars else None
+        return self.__hash
+
+    def __hashitems(self, ground):
+        """
+        Yield items from which the hash is calculated. If ground is True, only values and negvalues are used; otherwise, only variables and negvariables are used (bound variables give the hash of their values), along with values that are chunks with variables (their hash can change).
+        """
+        for x in self.removeempty():
+            varval = utilities.splitting(x[1])
+            items = []
+            variable_value = isinstance(varval.values, Chunk) and varval.values.__grounditems is not None
+            if ground:
+                if varval.values != self.__emptyvalue and not variable_value:
+                    items.append(("values", hash(varval.values))) #values get their hash directly
+                for value in varval.negvalues:
+                    items.append(("negvalues", hash(value)))
+            else:
+                boundvars = self.__boundvars or {}
+                if variable_value:
+                    items.append(("values", hash(varval.values)))
+                if varval.variables:
+                    try:
+                        items.append(("values", hash(boundvars[utilities.ACTRVARIABLE + varval.variables]))) #add value based on the variable
+                    except KeyError:
+                        items.append(("variables", hash(varval.variables))) #get hash of variable if it is not bound
+                for var in varval.negvariables:
+                    try:
+                        items.append(("negvalues", hash(boundvars[utilities.ACTRVARIABLE + var])))
+                    except KeyError:
+                        items.append(("negvariables", hash(var)))
+            for item in items:
+                if x[0]:
+                    yield x[0], item
+                else:
+                    yield item
+
+    def intern(self):
+        """
+        Return the interned chunk equal to this one. Only chunks without variables are interned; if no equal chunk of the same type was interned yet, this chunk becomes the interned one.
+        """
+        if self.__grounditems is not None:
+            return self
+        interned = self._interned.setdefault(self.__hash, self)
+        if interned is not self and not self.__same(interned):
+            return self #chunks of different types, or different chunks that share the hash, are not merged
+        return interned
+
+    def __same(self, otherchunk):
+        """
+        Check whether otherchunk has the same type and the same slot values as this chunk. Unlike ==, this does not rely on hashes.
+        """
+        return self.typename == otherchunk.typename and self.actrchunk._fields == otherchunk.actrchunk._fields and tuple(self.actrchunk) == tuple(otherchunk.actrchunk)
 
     def __iter__(self):
-        for x, y in zip(self.actrchunk._fields, self.actrchunk):
-            yield re.sub("_$", "", x), y
+        for x, y in zip(self.__slotnames(), self.actrchunk):
+            yield x, y
 
     def __len__(self):
         return len(self.actrchunk)
@@ -243,6 +392,44 @@ class Chunk(Sequence):
         """
         return self == otherchunk or self.match(otherchunk, partialmatching=False) #actually, the second disjunct should be enough -- TODO: check why it fails in some cases; this might be important for partial matching
 
+    _VARIABLE, _NEGVARIABLE, _VALUE, _NEGVALUE = range(4) #kinds of constraints in compiled chunks
+
+    def __compile(self):
+        """
+        Compile the chunk into a flat tuple of constraints (slot, kind, value), in the order in which they are checked in match.
+
+        The constraints do not depend on boundvars, so they are compiled only once.
+        """
+        constraints = []
+        for x in self:
+            slot = x[0] + "_"
+            varval = utilities.splitting(x[1])
+            if varval.variables:
+                constraints.append((slot, self._VARIABLE, varval.variables))
+            if varval.negvariables:
+                for var in varval.negvariables:
+                    constraints.append((slot, self._NEGVARIABLE, var))
+            if varval.values:
+                val = varval.values
+                if val != None: #None is the missing value of the attribute
+                    constraints.append((slot, self._VALUE, val))
+            if varval.negvalues:
+                for negval in varval.negvalues:
+                    constraints.append((slot, self._NEGVALUE, (negval, negval in {self.__emptyvalue, 'None'})))
+        return tuple(constraints)
+
+    def __find_positions(self, chunktype):
+        """
+        Find positions of slots of constraints in chunktype (a namedtuple); None if the slot is missing.
+        """
+        positions = []
+        for slot, _, _ in self.__constraints:
+            try:
+                positions.append(chunktype._fields.index(slot))
+            except ValueError:
+                positions.append(None)
+        return tuple(positions)
+
     def match(self, otherchunk, partialmatching, mismatch_penalty=1):
         """
         Check partial match (given bound variables in boundvars).
@@ -251,67 +438,77 @@ class Chunk(Sequence):
         if self == otherchunk:
             return similarity
         #below starts the check that self is proper part of otherchunk. __emptyvalue is ignored. 4 cases have to be checked separately, =x, ~=x, !1, ~!1. Also, variables and their values have to be saved in boundvars. When self is not part of otherchunk the loop adds to (dis)similarity.
-        for x in self:
-
+        if self.__constraints is None:
+            self.__constraints = self.__compile()
+        try:
+            othervalues = otherchunk.actrchunk
+        except AttributeError:
+            othervalues = None
+            positions = (None,) * len(self.__constraints)
+        else:
+            if self.__positions is None:
+                self.__positions = {}
             try:
-                matching_val = getattr(otherchunk.actrchunk, x[0] + "_") #get the value of attr
-            except AttributeError:
-                matching_val = None #if it is missing, it must be None
+                positions = self.__positions[type(othervalues)]
+            except KeyError:
+                positions = self.__positions.setdefault(type(othervalues), self.__find_positions(type(othervalues)))
 
-            if isinstance(matching_val, utilities.VarvalClass):
-                matching_val = matching_val.values #the value might be written using _variablesvalues namedtuple; in that case, get it out
-            varval = utilities.splitting(x[1])
+        for (_, kind, val), position in zip(self.__constraints, positions):
+
+            if position is None:
+                matching_val = None #if it is missing, it must be None
+            else:
+                matching_val = othervalues[position] #get the value of attr
+                if isinstance(matching_val, utilities.VarvalClass):
+                    matching_val = matching_val.values #the value might be written using _variablesvalues namedtuple; in that case, get it out
 
             #checking variables, e.g., =x
-            if varval.variables:
+            if kind == self._VARIABLE:
                 #if matching_val == self.__emptyvalue:
                 #    similarity -= 1 #these two lines would require that variables are matched only to existing values; uncomment if you want that
-                    var = varval.variables
-                    for each in self.boundvars.get("~=" + var, set()):
-                        if each == matching_val:
-                            if partialmatching:
-                                similarity += utilities.get_similarity(self._similarities, each, matching_val, mismatch_penalty) #False if otherchunk's value among the values of ~=x
-                            else:
-                                return False
-                    try:
-                        if self.boundvars["=" + var] != matching_val:
-                            if partialmatching:
-                                similarity += utilities.get_similarity(self._similarities, self.boundvars["=" + var], matching_val, mismatch_penalty) #False if =x does not match otherchunks' value
-                            else:
-                                return False
-                    except KeyError:
-                        self.boundvars.update({"=" + var: matching_val}) #if boundvars lack =x, update and proceed
+                for each in self.boundvars.get("~=" + val, set()):
+                    if each == matching_val:
+                        if partialmatching:
+                            similarity += utilities.get_similarity(self._similarities, each, matching_val, mismatch_penalty) #False if otherchunk's value among the values of ~=x
+                        else:
+                            return False
+                try:
+                    if self.boundvars["=" + val] != matching_val:
+                        if partialmatching:
+                            similarity += utilities.get_similarity(self._similarities, self.boundvars["=" + val], matching_val, mismatch_penalty) #False if =x does not match otherchunks' value
+                        else:
+                            return False
+                except KeyError:
+                    self.boundvars.update({"=" + val: matching_val}) #if boundvars lack =x, update and proceed
 
             #checking negvariables, e.g., ~=x
-            if varval.negvariables:
-                for var in varval.negvariables:
-                    try:
-                        if self.boundvars["=" + var] == matching_val:
-                            if partialmatching:
-                                similarity += utilities.get_similarity(self._similarities, self.boundvars["=" + var], matching_val, mismatch_penalty) #False if =x does not match otherchunks' value
-                            else:
-                                return False
-                    except KeyError:
-                        pass
-                    self.boundvars.setdefault("~=" + var, set([])).add(matching_val)
+            elif kind == self._NEGVARIABLE:
+                try:
+                    if self.boundvars["=" + val] == matching_val:
+                        if partialmatching:
+                            similarity += utilities.get_similarity(self._similarities, self.boundvars["=" + val], matching_val, mismatch_penalty) #False if =x does not match otherchunks' value
+                        else:
+                            return False
+                except KeyError:
+                    pass
+                self.boundvars.setdefault("~=" + val, set([])).add(matching_val)
 
             #checking values, e.g., 10 or !10
-
-            if varval.values:
-                val = varval.values
-                if val != None and val != matching_val: #None is the missing value of the attribute
+            elif kind == self._VALUE:
+                if val != matching_val:
                     if partialmatching:
-                        similarity += utilities.get_similarity(self._similarities, val, matching_val, mismatch_penalty) 
+                        similarity += utilities.get_similarity(self._similarities, val, matching_val, mismatch_penalty)
                     else:
                         return False
+
             #checking negvalues, e.g., ~!10
-            if varval.negvalues:
-                for negval in varval.negvalues:
-                    if negval == matching_val or (negval in {self.__emptyvalue, 'None'} and matching_val == self.__emptyvalue):
-                        if partialmatching:
-                            similarity += utilities.get_similarity(self._similarities, negval, matching_val, mismatch_penalty)
-                        else:
-                            return False
+            else:
+                negval, empty_negval = val
+                if negval == matching_val or (empty_negval and matching_val == self.__emptyvalue):
+                    if partialmatching:
+                        similarity += utilities.get_similarity(self._similarities, negval, matching_val, mismatch_penalty)
+                    else:
+                        return False
         if partialmatching:
             return similarity
         else:
@@ -335,9 +532,7 @@ class Chunk(Sequence):
                             yield x
                     except AttributeError:
                         pass
-        if not self.__empty:
-            self.__empty = tuple(emptying_func())
-        return self.__empty
+        return tuple(emptying_func())
 
     def removeunused(self):
         """
@@ -456,20 +651,9 @@ def makechunk(nameofchunk="", typename="", **dictionary):
             pass
         else:
             try:
-                temp_dict = utilities.stringsplitting(str(dictionary[key]))
+                dictionary[key] = utilities.varvalsplitting(str(dictionary[key]))
             except utilities.ACTRError as e:
                 raise utilities.ACTRError(f"The chunk value {dictionary[key]} is not defined correctly; {e}")
-            loop_dict = temp_dict.copy()
-            for x in loop_dict:
-                if x == "negvariables" or x == "negvalues":
-                    val = tuple(temp_dict[x])
-                else:
-                    try:
-                        val = temp_dict[x].pop()
-                    except KeyError:
-                        val = None
-                temp_dict[x] = val
-            dictionary[key] = utilities.VarvalClass(**temp_dict)
 
     created_chunk = Chunk(typename, **dictionary)
     created_chunk._chunks[nameofchunk] = created_chunk
@@ -483,8 +667,7 @@ def chunkstring(name='', string=''):
     >>> chunkstring(name="example0", string='isa chunktype_example0 value one')
     chunktype_example0(value= one)
     """
-    chunk_reader = utilities.getchunk()
-    chunk = chunk_reader.parse_string(string, parse_all=True)
+    chunk = utilities.parse_chunkstring(string)
     try:
         type_chunk, chunk_dict = createchunkdict(chunk)
     except utilities.ACTRError as e:
@@ -4,21 +4,41 @@ Declarative memory. Consists of the actual declarative memory, and its associate
 
 import collections
 import collections.abc
+import itertools
+import json
 import math
+import weakref
 
 import numpy as np
 
-from pyactr import buffers, chunks, utilities
+from pyactr import buffers, chunks, storage, utilities
+from pyactr.storage import PresentationTimes, RowIndex, StoredRows, _STRINGVALUE, _CHUNKVALUE, _VARVALVALUE
+
+_UNBUILT = object() #chunks of compact rows, which are kept only as values in columns (see DecMem)
 
 class DecMem(collections.abc.MutableMapping):
     """
     Declarative memory module.
     """
 
-    def __init__(self, data=None):
-        self._data = {}
-        self.restricted_number_chunks = collections.Counter() #counter for pairs of slot - value, used to store strength association
-        self.unrestricted_number_chunks = collections.Counter() # counter for chunks, used to store strength association
+    def __init__(self, data=None, use_index=True):
+        self._rows = {} #position of chunks in the order in which they were added; used to return indexed chunks in the same order as the full scan; the keys are the chunks kept as objects (chunks of compact rows are not kept)
+        self._chunks = [] #chunks by their rows; None for removed chunks, _UNBUILT for compact rows
+        self._stored = None #rows loaded from a file (see DecMem.load); they come first, before rows of chunks added later
+        self._unbuilt = 0 #number of compact rows; their chunks are created from the columns when needed and are not kept, so plain facts take only a few bytes per slot
+        self._built = weakref.WeakValueDictionary() #chunks created for compact rows, by rows, while they are used elsewhere
+        self._builtrows = weakref.WeakKeyDictionary() #rows of these chunks
+        self._removed = collections.Counter() #(slot, value) pairs of removed stored rows; the stored index still has them, so they are subtracted from fan
+        self._index = RowIndex() #index of slot-value pairs of rows added after loading; fan is the size of postings
+        self._hashes = RowIndex() #compact rows added after loading by the hashes of their chunks (under the slot None); equal chunks have equal hashes, so chunks are looked up by their hashes as in a dict
+        self.use_index = use_index #if False, retrieval scans all chunks (useful to check the index against the full scan)
+        self._times = PresentationTimes() #presentation times of all chunks in one ragged array, indexed by rows; used to calculate base-level activations in one pass
+        self._valueids = {None: 0} #values of slots interned to integer ids; 0 stands for empty or missing values; ids of stored values come first (see StoredRows)
+        self._values = [None] #values of slots by their ids, shifted by the number of stored values
+        self._columns = {} #maps slots to arrays of value ids, indexed by rows (shifted by the number of stored rows); used to calculate partial matching of all chunks in one pass and to create chunks of compact rows
+        self._types = np.zeros(0, dtype=np.int32) #chunk types of compact rows (shifted by the number of stored rows), as positions in self._typenames
+        self._typenames = [] #chunk types and their slots
+        self._typeids = {} #positions of chunk types in self._typenames
         self.activations  = {}
         if data is not None:
             try:
@@ -27,44 +47,487 @@ class DecMem(collections.abc.MutableMapping):
                 self.update({x:0 for x in data})
 
     def __contains__(self, elem):
-        return elem in self._data
+        return self.row(elem) is not None
     
     def __delitem__(self, key):
-        del self._data[key]
+        row = self.row(key)
+        if row is None:
+            raise KeyError(key)
+        key = self.__chunk(row)
+        compact = self._chunks[row] is _UNBUILT
+        if compact:
+            self._unbuilt -= 1
+            del self._built[row]
+            del self._builtrows[key]
+        else:
+            del self._rows[key]
+        self._chunks[row] = None
+        storedrows = self.__storedrows()
+        if row < storedrows:
+            self._stored.positions[key] = row #the chunk can still be a value of other stored chunks
+            self._removed.update(self.__slotvalues(key)) #stored postings are never changed; removed rows are subtracted from them
+        else:
+            position = row - storedrows
+            for slot, column in self._columns.items():
+                if position < len(column) and column[position]:
+                    self._index.remove(row, slot, int(column[position]))
+            if compact:
+                self._hashes.remove(row, None, hash(key))
+        del self._times[row]
 
     def __iter__(self):
-        for elem in self._data:
-            yield elem
+        for row in range(len(self._chunks)):
+            elem = self.__chunk(row)
+            if elem is not None:
+                yield elem
 
     def __getitem__(self, key):
-        return self._data[key]
+        row = self.row(key)
+        if row is None:
+            raise KeyError(key)
+        return self._times[row]
 
     def __len__(self):
-        return len(self._data)
+        return len(self._rows) + self._unbuilt
 
     def __repr__(self):
-        return repr(self._data)
+        return repr({elem: self[elem] for elem in self})
 
     def __setitem__(self, key, time):
-        if self.unrestricted_number_chunks and key not in self:
-            for x in key:
-                if utilities.splitting(x[1]).values and utilities.splitting(x[1]).values in self.unrestricted_number_chunks:
-                    self.unrestricted_number_chunks.update([utilities.splitting(x[1]).values])
-        if self.restricted_number_chunks and key not in self:
-            for x in key:
-                if utilities.splitting(x[1]).values and (x[0], utilities.splitting(x[1]).values) in self.restricted_number_chunks:
-                    self.restricted_number_chunks.update([(x[0], utilities.splitting(x[1]).values)])
         if isinstance(key, chunks.Chunk):
-            if isinstance(time, np.ndarray):
-                self._data[key] = time
-            else:
+            row = self.row(key)
+            if row is None:
+                row = self.__insert(key)
+            if not isinstance(time, np.ndarray):
                 try:
-                    self._data[key] = np.array([round(float(time), 4)])
+                    time = np.array([round(float(time), 4)])
                 except TypeError:
-                    self._data[key] = np.array(time)
+                    time = np.array(time)
+            self._times[row] = time
         else:
             raise utilities.ACTRError(f"Only chunks can be added as attributes to Declarative Memory; '{key}' is not a chunk")
     
+    def __insert(self, key):
+        """
+        Give a new chunk its row and add it to the index. Return the row.
+
+        Chunks carrying only plain strings (plain facts) are stored as compact rows: their chunk types and value ids are kept in arrays, and the chunks themselves are dropped. Other chunks (e.g., chunks carrying chunks, variables or negations) are kept as they are.
+        """
+        key = key.intern() #equal chunks added later are then found by identity
+        row = len(self._chunks)
+        position = row - self.__storedrows()
+        items = tuple(key)
+        pairs = []
+        plain = True
+        for slot, value in items:
+            varval = utilities.splitting(value)
+            plain = plain and self.__plain(varval)
+            value = varval.values
+            if not value or value == utilities.EMPTYVALUE or value == str(utilities.EMPTYVALUE):
+                continue #empty values are not indexed (see __slotvalues)
+            column = self._columns.get(slot)
+            if column is None or position >= len(column):
+                column = self._columns[slot] = self.__grow(column, position)
+            valueid = self.__valueid(value)
+            if valueid is None:
+                valueid = self._valueids[value] = self.__storedvalues() + len(self._values)
+                self._values.append(value)
+            column[position] = valueid
+            pairs.append((slot, valueid))
+        self._index.add(row, pairs)
+        if pairs and plain:
+            if position >= len(self._types):
+                self._types = self.__grow(self._types, position)
+            chunktype = (key.typename, tuple(name for name, _ in items))
+            typeid = self._typeids.get(chunktype)
+            if typeid is None:
+                typeid = self._typeids[chunktype] = len(self._typenames)
+                self._typenames.append(chunktype)
+            self._types[position] = typeid
+            self._chunks.append(_UNBUILT) #key is not registered in self._built; if it is still used when the row is needed, interning returns it
+            self._unbuilt += 1
+            self._hashes.add(row, ((None, hash(key)),))
+        else:
+            self._rows[key] = row
+            self._chunks.append(key)
+        return row
+
+    @staticmethod
+    def __grow(column, row):
+        """
+        Return column (an array of value ids, or None) extended so that it has a place for row. Capacity doubles, so growing is amortized.
+        """
+        grown = np.zeros(max(2*row, 16), dtype=np.int32)
+        if column is not None:
+            grown[:len(column)] = column
+        return grown
+
+    @staticmethod
+    def __slotvalues(chunk):
+        """
+        Yield (slot, value) pairs of chunk that are used in the index. Empty values are not indexed.
+        """
+        for x in chunk:
+            val = utilities.splitting(x[1]).values
+            if val and val != utilities.EMPTYVALUE and val != str(utilities.EMPTYVALUE):
+                yield x[0], val
+
+    @staticmethod
+    def __plain(value):
+        """
+        Check whether value is empty or a plain string that is used in the index (chunks carrying only such values are stored as compact rows, see DecMem.__insert).
+        """
+        varval = utilities.splitting(value)
+        if varval.variables or varval.negvalues or varval.negvariables:
+            return False
+        return varval.values is None or varval.values == utilities.EMPTYVALUE or (isinstance(varval.values, str) and varval.values != "")
+
+    def find_candidates(self, otherchunk):
+        """
+        Find chunks that could match otherchunk, using the index of slot-value pairs.
+
+        Only the values fixed in otherchunk are used; the found chunks still have to be checked by matching. Chunks are returned in the order in which they were added to the memory, i.e., in the same order as the full scan.
+        """
+        pairs = []
+        for slot, value in self.__slotvalues(otherchunk):
+            valueid = self.__valueid(value)
+            if valueid is None:
+                return [] #no chunk carries the value, so nothing can match
+            pairs.append((slot, valueid))
+        if not pairs:
+            return list(self)
+        found = []
+        for row in self.__intersect(pairs).tolist():
+            elem = self.__chunk(row)
+            if elem is not None: #removed stored rows are still in the stored index
+                found.append(elem)
+        return found
+
+    def __intersect(self, pairs):
+        """
+        Return the rows carrying all (slot, value id) pairs (a sorted array). The shortest posting is checked against the columns of the other pairs.
+        """
+        counts = [self.__count(slot, valueid) for slot, valueid in pairs]
+        shortest = counts.index(min(counts))
+        rows = self.__posting(*pairs[shortest])
+        for number, (slot, valueid) in enumerate(pairs):
+            if number != shortest and len(rows):
+                rows = rows[self.value_ids(rows, slot) == valueid]
+        return rows
+
+    def __count(self, slot, valueid):
+        """
+        Return the number of rows carrying the value with the id valueid in slot, including removed stored rows.
+        """
+        count = self._index.count(slot, valueid)
+        if self._stored is not None and valueid <= self._stored.values:
+            count += len(self._stored.posting(slot, valueid))
+        return count
+
+    def __posting(self, slot, valueid):
+        """
+        Return the rows carrying the value with the id valueid in slot (a sorted array), including removed stored rows.
+        """
+        posting = self._index.posting(slot, valueid)
+        if self._stored is not None and valueid <= self._stored.values:
+            stored = self._stored.posting(slot, valueid)
+            if not len(posting):
+                return stored
+            return np.concatenate((stored, posting))
+        return posting
+
+    def row(self, chunk):
+        """
+        Return the row of chunk, i.e., its position in the order in which chunks were added to the memory. It serves as the id of the chunk. None is returned if chunk is not in the memory.
+        """
+        row = self._rows.get(chunk)
+        if row is None and self._unbuilt:
+            try:
+                row = self._builtrows.get(chunk)
+            except TypeError: #not a chunk
+                return None
+            if row is None:
+                row = self.__find_compact(chunk)
+        return row
+
+    def value(self, valueid):
+        """
+        Return the value with the id valueid (see value_ids).
+        """
+        storedvalues = self.__storedvalues()
+        if valueid > storedvalues:
+            return self._values[valueid - storedvalues]
+        if valueid:
+            return self.__stored_value(valueid)
+        return None #empty or missing values
+
+    def __storedrows(self):
+        """
+        Return the number of stored rows (rows loaded from a file).
+        """
+        if self._stored is None:
+            return 0
+        return self._stored.rows
+
+    def __storedvalues(self):
+        """
+        Return the number of stored values (values loaded from a file).
+        """
+        if self._stored is None:
+            return 0
+        return self._stored.values
+
+    def __valueid(self, value):
+        """
+        Return the id of value (see value_ids); None if no chunk in the memory carries value.
+        """
+        valueid = self._valueids.get(value)
+        if valueid is None and self._stored is not None:
+            valueid = self.__stored_valueid(value)
+        return valueid
+
+    def __stored_valueid(self, value):
+        """
+        Return the id of value among stored values; None if it is not stored.
+        """
+        if isinstance(value, chunks.Chunk):
+            row = self.row(value)
+            if row is None or row >= self._stored.rows:
+                row = self._stored.positions.get(value) #chunks that are only values of slots, or removed rows
+            if row is None:
+                return None
+            return self._stored.valueid(str(row), _CHUNKVALUE)
+        if not isinstance(value, str):
+            return None
+        return self._stored.valueid(value, _STRINGVALUE)
+
+    def __stored_value(self, valueid):
+        """
+        Return the stored value with the id valueid. Chunks are created when needed.
+        """
+        kind, text = self._stored.value(valueid)
+        if kind == _STRINGVALUE:
+            return text
+        if kind == _CHUNKVALUE:
+            position = int(text)
+            if position < self._stored.rows and self._chunks[position] is not None:
+                return self.__chunk(position) #the value is a chunk in the memory
+            return self.__build(position)
+        values, variables, negvalues, negvariables = json.loads(text)
+        return utilities.VarvalClass(values=values, variables=variables, negvalues=tuple(negvalues), negvariables=tuple(negvariables))
+
+    def __chunk(self, row):
+        """
+        Return the chunk in row (None if it was removed). Chunks of compact rows are created from the columns; the same chunk is returned as long as it is used elsewhere.
+        """
+        elem = self._chunks[row]
+        if elem is _UNBUILT:
+            elem = self._built.get(row)
+            if elem is None:
+                elem = self.__build(row) if row < self.__storedrows() else self.__build_row(row)
+                self._built[row] = elem
+                self._builtrows[elem] = row
+        return elem
+
+    def __keep(self, row):
+        """
+        Keep the chunk in row as an object instead of creating it from the columns when needed. Return the chunk.
+        """
+        elem = self.__chunk(row)
+        if self._chunks[row] is _UNBUILT:
+            self._chunks[row] = elem
+            self._rows[elem] = row
+            self._unbuilt -= 1
+            del self._built[row]
+            del self._builtrows[elem]
+        return elem
+
+    def __build(self, position):
+        """
+        Create the chunk at position in the stored table of chunks. Stored rows come first in the table, so the position of a stored row is the row itself.
+        """
+        try:
+            return self._stored.chunks[position]
+        except KeyError:
+            pass
+        typename, slotnames, ids = self._stored.chunk(position)
+        values = {slot: self.__stored_value(idx) for slot, idx in zip(slotnames, ids) if idx}
+        if any(isinstance(value, utilities.VarvalClass) for value in values.values()):
+            elem = chunks.Chunk(typename, **values)
+        else:
+            elem = chunks.Chunk.from_values(typename, values)
+        elem = elem.intern()
+        if position >= self._stored.rows:
+            self._stored.chunks[position] = elem
+            self._stored.positions[elem] = position
+        return elem
+
+    def __build_row(self, row):
+        """
+        Create the chunk of a compact row added after loading from its chunk type and columns.
+        """
+        position = row - self.__storedrows()
+        typename, slotnames = self._typenames[self._types[position]]
+        values = {}
+        for slot in slotnames:
+            column = self._columns.get(slot)
+            if column is not None and position < len(column):
+                valueid = int(column[position])
+                if valueid:
+                    values[slot] = self.value(valueid)
+        return chunks.Chunk.from_values(typename, values).intern()
+
+    def __find_compact(self, chunk):
+        """
+        Find the compact row whose chunk equals chunk. None is returned if there is no such row.
+        """
+        if not isinstance(chunk, chunks.Chunk):
+            return None
+        for row in self._hashes.posting(None, hash(chunk)).tolist():
+            if self._chunks[row] is _UNBUILT:
+                return row
+        if self._stored is not None:
+            return self.__find_stored(chunk)
+        return None
+
+    def __find_stored(self, chunk):
+        """
+        Find the compact stored row whose chunk equals chunk. None is returned if there is no such row.
+
+        Chunks are equal if they carry the same values in the same slots (see Chunk.__hash__). Files do not store hashes, but only chunks with plain string values are stored as compact rows, so chunk is looked up by its values in the index.
+        """
+        pairs = []
+        for slot, value in chunk:
+            varval = utilities.splitting(value)
+            if varval.negvalues or varval.negvariables:
+                return None
+            found = varval.values
+            if varval.variables:
+                try:
+                    bound = chunk.boundvars[utilities.ACTRVARIABLE + varval.variables]
+                except KeyError:
+                    return None
+                if found is not None and found != bound:
+                    return None
+                found = bound
+            if found is None or found == str(utilities.EMPTYVALUE):
+                continue
+            if not isinstance(found, str) or not found:
+                return None
+            valueid = self._stored.valueid(found, _STRINGVALUE)
+            if valueid is None:
+                return None
+            pairs.append((slot, valueid))
+        if not pairs:
+            return None
+        for row in self.__intersect(pairs).tolist():
+            if row < self._stored.rows and self._chunks[row] is _UNBUILT and self._stored.filled(row) == len(pairs):
+                return row
+        return None
+
+    def partial_matching(self, elements, otherchunk, mismatch_penalty=1, similarities=None):
+        """
+        Calculate partial matching of elements (chunks in the memory) to otherchunk in one vectorized pass. Return an array with the partial matching component of activation for each element, or None if otherchunk has variables or negations (these have to be matched chunk by chunk, see Chunk.match).
+
+        Each slot value of otherchunk adds 0 if the element carries the same value, otherwise the similarity of the two values (see ACTRModel.set_similarities), or -mismatch_penalty if no similarity is set. similarities default to the similarities set in the model (Chunk._similarities).
+        """
+        if similarities is None:
+            similarities = chunks.Chunk._similarities
+        requested = []
+        for slot, value in otherchunk:
+            varval = utilities.splitting(value)
+            if varval.variables or varval.negvalues or varval.negvariables:
+                return None
+            if varval.values and varval.values != None:
+                if varval.values == "None":
+                    return None #'None' matches empty values but not missing slots; leave it to Chunk.match
+                requested.append((slot, varval.values))
+
+        rows = np.fromiter((self.row(x) for x in elements), dtype=np.int64, count=len(elements))
+        total = np.zeros(len(rows))
+        for slot, value in requested:
+            ids = self.value_ids(rows, slot)
+            penalties = np.full(self.__storedvalues() + len(self._values), -float(mismatch_penalty))
+            for (othervalue, similarvalue), similarity in similarities.items():
+                if similarvalue == value:
+                    valueid = self.__valueid(othervalue)
+                    if valueid is not None:
+                        penalties[valueid] = similarity
+            valueid = self.__valueid(value)
+            if valueid is not None: #otherwise, no chunk carries the value
+                penalties[valueid] = 0
+            total += penalties[ids]
+        return total
+
+    def value_ids(self, rows, slot):
+        """
+        Return the ids of values that chunks in rows (an array of rows) carry in slot; 0 for empty or missing values. The values themselves are given by DecMem.value.
+        """
+        ids = np.zeros(len(rows), dtype=np.int64)
+        storedrows = self.__storedrows()
+        if storedrows:
+            stored = rows < storedrows
+            column = self._stored.columns.get(slot)
+            if column is not None:
+                ids[stored] = column[rows[stored]]
+            rows = rows - storedrows
+        column = self._columns.get(slot, ())
+        inside = (rows >= 0) & (rows < len(column))
+        if len(column):
+            ids[inside] = column[rows[inside]]
+        return ids
+
+    def fan(self, value, slot=None):
+        """
+        Find the number of slots in the memory that carry value. If slot is specified, only that slot is considered.
+        """
+        valueid = self.__valueid(value)
+        if valueid is None:
+            return 0
+        if slot:
+            slots = (slot,)
+        else:
+            slots = set(self._columns).union(self._stored.columns if self._stored is not None else ())
+        fan = sum(self.__count(x, valueid) for x in slots)
+        if self._removed:
+            fan -= sum(self._removed[x, value] for x in slots)
+        return fan
+
+    def baselevel_activations(self, elements, current_time, bll, decay, optimized_learning=False):
+        """
+        Calculate base-level activations of elements (chunks in the memory) in one vectorized pass.
+
+        Return an array of activations and a boolean array that says for which elements the activation is defined (see utilities.baselevel_learning_vectorized).
+        """
+        rows = [self.row(x) for x in elements]
+        times, lengths = self._times.gather(rows)
+        older, firsts = self._times.summaries(rows)
+        return utilities.baselevel_learning_vectorized(current_time, times, lengths, bll, decay, [self.activations.get(x) for x in elements], optimized_learning=optimized_learning, older=older, firsts=firsts)
+
+    def creation_time(self, chunk):
+        """
+        Return the time at which chunk was first presented, also if its older presentations are summarized (see recent_traces).
+        """
+        row = self.row(chunk)
+        if self._times.older[row]:
+            return self._times.firsts[row]
+        return self._times[row][0]
+
+    @property
+    def recent_traces(self):
+        """
+        How many most recent presentations are kept per chunk (None keeps all of them; this is the default).
+
+        Older presentations are summarized by their number and the time of the first presentation, so memory does not grow with the number of presentations. Base-level activation then uses the hybrid approximation of Petrov (2006) (see utilities.baselevel_learning_vectorized). Only the kept presentations are returned by self[chunk]. The value is usually set from the model parameter baselevel_traces when a simulation is created.
+        """
+        return self._times.limit
+
+    @recent_traces.setter
+    def recent_traces(self, value):
+        if value is not None and (int(value) != value or value < 1):
+            raise utilities.ACTRError(f"The number of recent traces must be a positive integer or None, not '{value}'")
+        self._times.bound(None if value is None else int(value))
+
     def add_activation(self, element, activation):
         """
         Add activation of an element.
@@ -83,32 +546,252 @@ class DecMem(collections.abc.MutableMapping):
         element can be either one chunk, or an iterable of chunks.
         """
         if isinstance(time, collections.abc.Iterable):
-            try:
-                new = np.concatenate((self.setdefault(element, np.array([])), np.array(time)))
-                self[element] = new
-            except TypeError:
-                for x in element:
-                    new = np.concatenate((self.setdefault(x, np.array([])), np.array(time)))
-                    self[x] = new
+            time = np.array(time)
         else:
-            try:
-                new = np.append(self.setdefault(element, np.array([])), round(float(time), 4))
-                self[element] = new
-            except TypeError:
-                for x in element:
-                    new = np.append(self.setdefault(x, np.array([])), round(float(time), 4))
-                    self[x] = new
+            time = np.array([round(float(time), 4)])
+        try:
+            self.__present(element, time)
+        except TypeError:
+            for x in element:
+                self.__present(x, time)
+
+    def __present(self, element, times):
+        """
+        Add times (an array) to the presentation times of element; a new element is added to the memory. Times are appended in place (see PresentationTimes.append).
+        """
+        row = self.row(element)
+        if row is None and isinstance(element, chunks.Chunk):
+            self._times[self.__insert(element)] = times
+        elif row is None:
+            self[element] = times
+        else:
+            self._times.append(row, times)
+
+    def load_rows(self, typename, rows, time=0):
+        """
+        Add many chunks of the type typename, created from plain values by Chunk.from_values (values are not parsed; see there). This is much faster than creating the chunks by makechunk or chunkstring.
+
+        rows is an iterable of dicts (slots mapped to values) or of sequences of values in the order of slots of the chunk type. time is the time of presentation, shared by all chunks, or an iterable with one time per row.
+        """
+        if isinstance(time, collections.abc.Iterable):
+            times = ([round(float(x), 4)] for x in time)
+        else:
+            times = itertools.repeat([round(float(time), 4)])
+        for values, presentation in zip(rows, times):
+            chunk = chunks.Chunk.from_values(typename, values)
+            row = self.row(chunk)
+            if row is None:
+                self._times[self.__insert(chunk)] = presentation
+            else:
+                self._times.append(row, np.array(presentation))
 
     def copy(self):
         """
         Copy declarative memory.
+
+        The index, the columns and the presentation times are copied, not rebuilt, so copying is much cheaper than adding all chunks again. Arrays of the index are shared; they are never modified in place. Stored rows (see DecMem.load) are shared as well.
         """
-        dm = DecMem(self._data.copy())
-        dm.activations = self.activations.copy()
-        dm.restricted_number_chunks = self.restricted_number_chunks.copy()
-        dm.unrestricted_number_chunks = self.unrestricted_number_chunks.copy()
+        dm = DecMem(use_index=self.use_index)
+        self.__copy_into(dm)
         return dm
 
+    def restore(self, other):
+        """
+        Replace the contents of this memory by a copy of the memory other (e.g., a memory stored in a model snapshot). The memory stays the same object, so buffers that use it do not have to be updated.
+        """
+        self.use_index = other.use_index
+        other.__copy_into(self)
+
+    def save(self, file):
+        """
+        Save declarative memory into a binary file (file is a path). No pickling is used.
+
+        The file stores chunk types, a table of slot values (each distinct value once, sorted, so that values can be looked up without reading the whole table), a table of chunks (chunk type and slot values of every chunk, including chunks that appear only as values of slots; chunks in the memory come first, in their order), columns of value ids and the index of slot-value pairs of chunks in the memory, presentation times in one ragged array, summaries of older presentations (see recent_traces) and activations. Arrays are aligned in the file, so that DecMem.load can memory-map them.
+        """
+        live = [row for row, elem in enumerate(self._chunks) if elem is not None]
+        rows = [self.__chunk(row) for row in live]
+        table = {chunk: position for position, chunk in enumerate(rows)} #positions of chunks in the table of chunks
+        contents = [None]*len(rows) #chunk types and (temporary) value ids of chunks in the table
+        types = {}
+        values = {}
+        columns = {}
+        built = [] #rows that cannot be looked up by their values; they are created on loading
+
+        def add_chunk(chunk):
+            position = table.setdefault(chunk, len(table))
+            if position == len(contents):
+                contents.append(None)
+            if contents[position] is None:
+                slotnames = tuple(name for name, _ in chunk)
+                ids = [add_value(value) for _, value in chunk]
+                contents[position] = (types.setdefault((chunk.typename, slotnames), len(types)), ids)
+            return position
+
+        def add_value(value):
+            varval = utilities.splitting(value)
+            if varval.variables is None and not varval.negvalues and not varval.negvariables:
+                if varval.values is None or varval.values == utilities.EMPTYVALUE:
+                    return 0
+                if isinstance(varval.values, chunks.Chunk):
+                    key = (_CHUNKVALUE, str(add_chunk(varval.values)))
+                else:
+                    key = (_STRINGVALUE, varval.values)
+            else:
+                if any(isinstance(x, chunks.Chunk) for x in (varval.values, varval.variables) + tuple(varval.negvalues) + tuple(varval.negvariables)):
+                    raise utilities.ACTRError(f"The value '{varval}' cannot be saved; chunks used as values of slots cannot be combined with variables or negations")
+                key = (_VARVALVALUE, json.dumps([varval.values, varval.variables, list(varval.negvalues), list(varval.negvariables)]))
+            return values.setdefault(key, len(values) + 1)
+
+        def add_indexed(value):
+            if isinstance(value, chunks.Chunk):
+                return values.setdefault((_CHUNKVALUE, str(add_chunk(value))), len(values) + 1)
+            return values.setdefault((_STRINGVALUE, value), len(values) + 1)
+
+        for row, chunk in enumerate(rows):
+            add_chunk(chunk)
+            indexed = 0
+            for slot, value in self.__slotvalues(chunk):
+                column = columns.get(slot)
+                if column is None:
+                    column = columns[slot] = np.zeros(len(rows), dtype=np.int64)
+                column[row] = add_indexed(value)
+                indexed += 1
+            if not indexed or not all(self.__plain(value) for _, value in chunk):
+                built.append(row)
+
+        keys = list(values)
+        encoded = [x[1].encode("utf-8") for x in keys]
+        order = sorted(range(len(keys)), key=lambda x: (keys[x][0], encoded[x]))
+        renumbered = np.zeros(len(keys) + 1, dtype=np.int64) #temporary ids mapped to ids of the sorted table; 0 stays for empty values
+        renumbered[np.array(order, dtype=np.int64) + 1] = np.arange(1, len(keys) + 1)
+
+        times, lengths = self._times.gather(live)
+        older, firsts = self._times.summaries(live)
+        arrays = {"chunk_types": np.array([x[0] for x in contents], dtype=np.int32),
+                  "chunk_offsets": np.cumsum([0] + [len(x[1]) for x in contents], dtype=np.int64),
+                  "slot_values": renumbered[np.array([idx for x in contents for idx in x[1]], dtype=np.int64)].astype(np.int32),
+                  "value_kinds": np.array([keys[x][0] for x in order], dtype=np.int8),
+                  "value_offsets": np.cumsum([0] + [len(encoded[x]) for x in order], dtype=np.int64),
+                  "value_bytes": np.frombuffer(b"".join(encoded[x] for x in order), dtype=np.uint8),
+                  "built_rows": np.array(built, dtype=np.int64),
+                  "time_offsets": np.concatenate(([0], np.cumsum(lengths, dtype=np.int64))),
+                  "time_lengths": np.asarray(lengths, dtype=np.int64),
+                  "times": np.asarray(times, dtype=np.float64),
+                  "activations": np.array([self.activations.get(chunk, math.nan) for chunk in rows], dtype=np.float64),
+                  "older_counts": np.asarray(older, dtype=np.int64),
+                  "first_times": np.asarray(firsts, dtype=np.float64)}
+        for number, column in enumerate(columns.values()):
+            column = renumbered[column].astype(np.int32)
+            posted = np.flatnonzero(column)
+            posted = posted[np.argsort(column[posted], kind="stable")] #rows grouped by values, in their order within each group
+            posted_values, starts = np.unique(column[posted], return_index=True)
+            arrays[f"column_{number}"] = column
+            arrays[f"posting_values_{number}"] = posted_values.astype(np.int32)
+            arrays[f"posting_offsets_{number}"] = np.append(starts, len(posted)).astype(np.int64)
+            arrays[f"postings_{number}"] = posted.astype(np.int64)
+
+        storage.write(file, {"version": storage._FORMAT_VERSION, "use_index": self.use_index, "recent_traces": self.recent_traces,
+                             "types": [[typename, list(slotnames)] for typename, slotnames in types],
+                             "slots": list(columns), "rows": len(rows)}, arrays)
+
+    @classmethod
+    def load(cls, file, mmap=True):
+        """
+        Load declarative memory saved by DecMem.save.
+
+        Chunks are not created on loading. The rows of the file (chunk types, columns of value ids, the index of slot-value pairs, the table of values and presentation times) are used as they are, and the chunk of a row is created only when it is needed (e.g., when it is retrieved or when the memory is iterated over); as for chunks added to the memory, such chunks are not kept (see DecMem.__insert). Loading thus takes about the same time for any size of the memory. Rows that cannot be looked up by their values (chunks that carry other chunks, variables, negations or empty strings, or no values at all) and rows with activations are created right away.
+
+        If mmap is True, the arrays are memory-mapped from the file rather than read into memory, so processes loading the same file (e.g., workers of run_batch whose model factory loads the memory) share them. Arrays of values per row that change with presentations (offsets and lengths of times, summaries) are mapped copy-on-write, so only pages of rows that change become private; the other arrays are read-only. The stored rows and their presentation times form the base of the memory; chunks added or presented after loading are kept in a small private overlay, and the file is never modified. Copies of the memory (DecMem.copy, model snapshots) share the base as well.
+        """
+        header, arrays = storage.read(file, mmap)
+        if header["version"] not in (1, storage._FORMAT_VERSION):
+            raise utilities.ACTRError(f"The file '{file}' uses the version {header['version']} of the format of declarative memory; only the versions 1 and {storage._FORMAT_VERSION} can be loaded")
+
+        for typename, slotnames in header["types"]:
+            if typename not in chunks.Chunk._chunktypes:
+                chunks.chunktype(typename, slotnames)
+
+        if header["version"] == 1:
+            return cls.__load_version1(header, arrays)
+
+        dm = cls(use_index=header["use_index"])
+        dm._stored = StoredRows(header, arrays)
+        dm._chunks = [_UNBUILT]*dm._stored.rows
+        dm._unbuilt = dm._stored.rows
+        dm._times = PresentationTimes.from_arrays(arrays["times"], arrays["time_lengths"], arrays["time_offsets"][:-1], arrays["older_counts"], arrays["first_times"])
+        dm._times.limit = header["recent_traces"]
+        for row in arrays["built_rows"].tolist():
+            dm.__keep(row)
+        activations = arrays["activations"]
+        for row in np.flatnonzero(~np.isnan(activations)).tolist():
+            dm.activations[dm.__keep(row)] = float(activations[row])
+        return dm
+
+    @classmethod
+    def __load_version1(cls, header, arrays):
+        """
+        Create declarative memory from the arrays of a file in the version 1 of the format. These files store chunks in a table of slot value ids (-1 for empty values), without the index, so all chunks are created on loading. Save the memory again to get a file that loads without creating chunks.
+        """
+        value_offsets = arrays["value_offsets"].tolist()
+        value_bytes = arrays["value_bytes"].tobytes()
+        decoded = [value_bytes[value_offsets[i]:value_offsets[i+1]].decode("utf-8") for i in range(len(value_offsets)-1)]
+        kinds = arrays["value_kinds"].tolist()
+
+        table = [] #chunks in the order of the file; chunks used as values precede chunks using them
+        def make_value(idx):
+            if kinds[idx] == _STRINGVALUE:
+                return decoded[idx]
+            if kinds[idx] == _CHUNKVALUE:
+                return table[int(decoded[idx])]
+            values, variables, negvalues, negvariables = json.loads(decoded[idx])
+            return utilities.VarvalClass(values=values, variables=variables, negvalues=tuple(negvalues), negvariables=tuple(negvariables))
+
+        slot_values = arrays["slot_values"].tolist()
+        position = 0
+        for typeidx in arrays["chunk_types"].tolist():
+            typename, slotnames = header["types"][typeidx]
+            ids = slot_values[position:position+len(slotnames)]
+            position += len(slotnames)
+            values = {slot: make_value(idx) for slot, idx in zip(slotnames, ids) if idx != -1}
+            if any(kinds[idx] == _VARVALVALUE for idx in ids if idx != -1):
+                table.append(chunks.Chunk(typename, **values))
+            else:
+                table.append(chunks.Chunk.from_values(typename, values))
+
+        dm = cls(use_index=header["use_index"])
+        for idx, activation in zip(arrays["dm_chunks"].tolist(), arrays["activations"].tolist()):
+            dm.__insert(table[idx])
+            if not math.isnan(activation):
+                dm.activations[table[idx]] = activation
+        offsets = arrays["time_offsets"]
+        dm._times = PresentationTimes.from_arrays(arrays["times"], np.diff(offsets), offsets[:-1], arrays.get("older_counts"), arrays.get("first_times")) #summaries are missing in files saved before they were introduced
+        dm._times.limit = header.get("recent_traces")
+        return dm
+
+    def __copy_into(self, dm):
+        """
+        Copy all contents of this memory into dm.
+        """
+        dm._rows = self._rows.copy()
+        dm._chunks = list(self._chunks)
+        dm._stored = self._stored
+        dm._unbuilt = self._unbuilt
+        dm._built = weakref.WeakValueDictionary()
+        dm._builtrows = weakref.WeakKeyDictionary()
+        dm._removed = self._removed.copy()
+        dm._index = self._index.copy()
+        dm._hashes = self._hashes.copy()
+        dm._valueids = self._valueids.copy()
+        dm._values = list(self._values)
+        dm._columns = {slot: column.copy() for slot, column in self._columns.items()}
+        dm._types = self._types.copy()
+        dm._typenames = list(self._typenames)
+        dm._typeids = self._typeids.copy()
+        dm._times = self._times.copy()
+        dm.activations = self.activations.copy()
+
+RetrievalProbabilities = collections.namedtuple('RetrievalProbabilities', 'chunks probabilities failure latency')
+
 class DecMemBuffer(buffers.Buffer):
     """
     Declarative memory buffer.
@@ -165,6 +848,23 @@ class DecMemBuffer(buffers.Buffer):
         if self._data:
             self.dm.add(self._data.pop(), time)
 
+    def get_state(self):
+        """
+        Return the state of the buffer (its content, state, recently retrieved chunks and the last activation), used in model snapshots.
+        """
+        state = super().get_state()
+        state["recent"] = self.recent.copy()
+        state["activation"] = self.activation
+        return state
+
+    def set_state(self, state):
+        """
+        Set the state of the buffer to state (see get_state).
+        """
+        super().set_state(state)
+        self.recent = state["recent"].copy()
+        self.activation = state["activation"]
+
     def copy(self, dm=None):
         """
         Copy buffer, along with its declarative memory, unless dm is specified. You need to specify new dm if 2 buffers share the same dm - only one of them should copy dm then.
@@ -187,66 +887,48 @@ class DecMemBuffer(buffers.Buffer):
         model_parameters = model_parameters.copy()
         model_parameters.update(self.model_parameters)
 
-        if actrvariables == None:
-            actrvariables = {}
-        try:
-            mod_attr_val = {x[0]: utilities.check_bound_vars(actrvariables, x[1], negative_impossible=False) for x in otherchunk.removeunused()}
-        except utilities.ACTRError as arg:
-            raise utilities.ACTRError(f"Retrieving the chunk '{otherchunk}' is impossible; {arg}")
-        chunk_tobe_matched = chunks.Chunk(otherchunk.typename, **mod_attr_val)
+        chunk_tobe_matched = self._request(otherchunk, actrvariables)
 
         max_A = float("-inf")
 
         retrieved = None
-        for chunk in self.dm:
-            try:
-                if extra_tests["recently_retrieved"] == False or extra_tests["recently_retrieved"] == 'False':
-                    if self.__finst and chunk in self.recent:
-                        continue
-
-                else:
-                    if self.__finst and chunk not in self.recent:
-                        continue
-            except KeyError:
-                pass
-
+        matching = [] #subsymbolic: (partially) matching chunks
+        for chunk in self._candidates(chunk_tobe_matched, extra_tests, model_parameters):
             if model_parameters["subsymbolic"]: #if subsymbolic, check activation
-                A_pm = 0
-                if model_parameters["partial_matching"]:
-                    A_pm = chunk_tobe_matched.match(chunk, partialmatching=True, mismatch_penalty=model_parameters["mismatch_penalty"])
-                else:
-                    if not chunk_tobe_matched <= chunk:
-                        continue
-
-                try:
-                    A_bll = utilities.baselevel_learning(time, self.dm[chunk], model_parameters["baselevel_learning"], model_parameters["decay"], self.dm.activations.get(chunk), optimized_learning=model_parameters["optimized_learning"]) #bll
-                except UnboundLocalError:
-                    continue
-                if math.isnan(A_bll):
-                    raise utilities.ACTRError(f"The following chunk cannot receive base activation: {chunk}. The reason is that one of its traces did not appear in a past moment.")
-                A_sa = utilities.spreading_activation(chunk, buffers, self.dm, model_parameters["buffer_spreading_activation"], model_parameters["strength_of_association"], model_parameters["spreading_activation_restricted"], model_parameters["association_only_from_chunks"])
-                inst_noise = utilities.calculate_instantaneous_noise(model_parameters["instantaneous_noise"])
-                A = A_bll + A_sa + A_pm + inst_noise #chunk.activation is the manually specified activation, potentially used by the modeller
-
-                if utilities.retrieval_success(A, model_parameters["retrieval_threshold"]) and max_A < A:
-                    max_A = A
-                    self.activation = max_A
-                    retrieved = chunk
-                    extra_time = utilities.retrieval_latency(A, model_parameters["latency_factor"],  model_parameters["latency_exponent"])
-
-                    if model_parameters["activation_trace"]:
-                        print("(Partially) matching chunk:", chunk)
-                        print("Base level learning:", A_bll)
-                        print("Spreading activation", A_sa)
-                        print("Partial matching", A_pm)
-                        print("Noise:", inst_noise)
-                        print("Total activation", A)
-                        print("Time to retrieve", extra_time)
+                matching.append(chunk)
             else: #otherwise, retrieval is instantaneous
-                if chunk_tobe_matched <= chunk and self.dm[chunk][0] != time: #the second condition ensures that the chunk that was created are not retrieved at the same time
+                if chunk_tobe_matched <= chunk and self.dm.creation_time(chunk) != time: #the second condition ensures that the chunk that was created are not retrieved at the same time
                     retrieved = chunk
                     extra_time = 0
 
+        if matching:
+            all_A_bll, defined, all_A_pm, sources = self._activation_components(time, chunk_tobe_matched, matching, buffers, model_parameters)
+            #noise for all matching chunks is drawn in one call
+            all_inst_noise = utilities.calculate_instantaneous_noise(model_parameters["instantaneous_noise"], self.rng, len(matching))
+        for i, chunk in enumerate(matching):
+            if not defined[i]:
+                continue
+            A_pm = all_A_pm[i]
+            A_bll = float(all_A_bll[i])
+            A_sa = utilities.spreading_activation_from_sources(chunk, sources, model_parameters["strength_of_association"], model_parameters["spreading_activation_restricted"], model_parameters["association_only_from_chunks"])
+            inst_noise = float(all_inst_noise[i])
+            A = A_bll + A_sa + A_pm + inst_noise #chunk.activation is the manually specified activation, potentially used by the modeller
+
+            if utilities.retrieval_success(A, model_parameters["retrieval_threshold"]) and max_A < A:
+                max_A = A
+                self.activation = max_A
+                retrieved = chunk
+                extra_time = utilities.retrieval_latency(A, model_parameters["latency_factor"],  model_parameters["latency_exponent"])
+
+                if model_parameters["activation_trace"]:
+                    print("(Partially) matching chunk:", chunk)
+                    print("Base level learning:", A_bll)
+                    print("Spreading activation", A_sa)
+                    print("Partial matching", A_pm)
+                    print("Noise:", inst_noise)
+                    print("Total activation", A)
+                    print("Time to retrieve", extra_time)
+
         if not retrieved:
             if model_parameters["subsymbolic"]:
                 extra_time = utilities.retrieval_latency(model_parameters["retrieval_threshold"], model_parameters["latency_factor"],  model_parameters["latency_exponent"])
@@ -257,4 +939,193 @@ class DecMemBuffer(buffers.Buffer):
             if self.__finst < len(self.recent):
                 self.recent.popleft()
         return retrieved, extra_time
+
+    def retrieval_probabilities(self, time, otherchunk, actrvariables, buffers, extra_tests, model_parameters):
+        """
+        Calculate analytically how likely the retrieval of otherchunk at time would succeed and how long it would take, without sampling noise. Arguments are as in retrieve (see also ACTRModel.retrieval_probabilities, which supplies buffers and parameters of the model).
+
+        Activations A_i are calculated without noise. Retrieval fails if no chunk reaches the threshold tau (retrieval_threshold); since noise of chunks is independent and logistic with the scale s (instantaneous_noise), the probability of failure is the product of 1/(1 + exp((A_i - tau)/s)). Which chunk is retrieved otherwise is given by the standard softmax approximation with the temperature t = sqrt(2)*s: the chunk i is retrieved with the probability (1 - failure) * exp(A_i/t) / sum_j exp(A_j/t). The expected latency is the sum of latencies at A_i (and at tau for failures) weighted by the probabilities; it ignores the effect of noise on latency, so it is somewhat higher than the mean latency of simulations. Without noise, the chunk with the highest activation is retrieved if it reaches the threshold.
+
+        Return RetrievalProbabilities(chunks, probabilities, failure, latency): the (partially) matching chunks, the array of the probabilities that they are retrieved, the probability of retrieval failure and the expected latency. Memory (finsts, activations) is not changed. This requires subsymbolic computation (in the symbolic mode, retrieval is deterministic).
+        """
+        model_parameters = model_parameters.copy()
+        model_parameters.update(self.model_parameters)
+        if not model_parameters["subsymbolic"]:
+            raise utilities.ACTRError("Retrieval probabilities can be calculated only if subsymbolic computation is switched on (subsymbolic=True)")
+
+        chunk_tobe_matched = self._request(otherchunk, actrvariables)
+        matching = list(self._candidates(chunk_tobe_matched, extra_tests, model_parameters))
+        threshold = model_parameters["retrieval_threshold"]
+        if matching:
+            all_A_bll, defined, all_A_pm, sources = self._activation_components(time, chunk_tobe_matched, matching, buffers, model_parameters)
+            matching = [chunk for i, chunk in enumerate(matching) if defined[i]]
+            activations = np.array([float(all_A_bll[i]) + all_A_pm[i] for i in np.flatnonzero(defined)]) + np.array([utilities.spreading_activation_from_sources(chunk, sources, model_parameters["strength_of_association"], model_parameters["spreading_activation_restricted"], model_parameters["association_only_from_chunks"]) for chunk in matching])
+        else:
+            activations = np.empty(0)
+
+        noise = model_parameters["instantaneous_noise"]
+        if noise > 0:
+            failure = float(np.prod(1 / (1 + np.exp((activations - threshold) / noise)))) #retrieval fails if no chunk reaches the threshold; noise is independent, so this is exact
+            if len(activations):
+                weights = np.exp((activations - activations.max()) / (math.sqrt(2) * noise))
+                probabilities = (1 - failure) * weights / weights.sum()
+            else:
+                probabilities = activations
+        else:
+            probabilities = np.zeros(len(activations))
+            if len(activations) and activations.max() >= threshold:
+                probabilities[np.argmax(activations)] = 1 #as in retrieve, the first chunk with the highest activation wins
+            failure = 1 - float(probabilities.sum())
+        latencies = model_parameters["latency_factor"] * np.exp(-model_parameters["latency_exponent"] * np.append(activations, threshold))
+        latency = float(np.dot(probabilities, latencies[:-1]) + failure * latencies[-1])
+        return RetrievalProbabilities(matching, probabilities, failure, latency)
+
+    def _request(self, otherchunk, actrvariables):
+        """
+        Create the chunk that is matched against memory: otherchunk with bound variables replaced by their values.
+        """
+        if actrvariables == None:
+            actrvariables = {}
+        try:
+            mod_attr_val = {x[0]: utilities.check_bound_vars(actrvariables, x[1], negative_impossible=False) for x in otherchunk.removeunused()}
+        except utilities.ACTRError as arg:
+            raise utilities.ACTRError(f"Retrieving the chunk '{otherchunk}' is impossible; {arg}")
+        return chunks.Chunk(otherchunk.typename, **mod_attr_val)
+
+    def _candidates(self, chunk_tobe_matched, extra_tests, model_parameters):
+        """
+        Yield chunks that are considered for retrieval of chunk_tobe_matched, respecting finsts (recently_retrieved). With partial matching, all chunks are considered; subsymbolic retrieval without partial matching yields only matching chunks.
+        """
+        partial_matching = model_parameters["subsymbolic"] and model_parameters["partial_matching"]
+        if self.dm.use_index and not partial_matching:
+            candidates = self.dm.find_candidates(chunk_tobe_matched) #only chunks carrying the values of the request can match
+        else:
+            candidates = self.dm
+        for chunk in candidates:
+            try:
+                if extra_tests["recently_retrieved"] == False or extra_tests["recently_retrieved"] == 'False':
+                    if self.__finst and chunk in self.recent:
+                        continue
+
+                else:
+                    if self.__finst and chunk not in self.recent:
+                        continue
+            except KeyError:
+                pass
+            if model_parameters["subsymbolic"] and not partial_matching and not chunk_tobe_matched <= chunk:
+                continue
+            yield chunk
+
+    def _activation_components(self, time, chunk_tobe_matched, matching, buffers, model_parameters):
+        """
+        Calculate components of activation of matching chunks that do not depend on noise. Return base-level activations, a boolean array saying for which chunks the base-level activation is defined, partial matching and the sources of spreading activation (spreading activation itself is calculated per chunk from these, see utilities.spreading_activation_from_sources).
+        """
+        if model_parameters["partial_matching"]:
+            #partial matching of all chunks is calculated in one pass, unless the request has variables or negations
+            all_A_pm = self.dm.partial_matching(matching, chunk_tobe_matched, model_parameters["mismatch_penalty"])
+            if all_A_pm is not None:
+                all_A_pm = all_A_pm.tolist()
+            else:
+                all_A_pm = [chunk_tobe_matched.match(chunk, partialmatching=True, mismatch_penalty=model_parameters["mismatch_penalty"]) for chunk in matching]
+        else:
+            all_A_pm = [0] * len(matching)
+        #base-level activations of all matching chunks are calculated in one pass
+        all_A_bll, defined = self.dm.baselevel_activations(matching, time, model_parameters["baselevel_learning"], model_parameters["decay"], optimized_learning=model_parameters["optimized_learning"]) #bll
+        for i in np.flatnonzero(defined):
+            if math.isnan(all_A_bll[i]):
+                raise utilities.ACTRError(f"The following chunk cannot receive base activation: {matching[i]}. The reason is that one of its traces did not appear in a past moment.")
+        #sources of spreading activation do not depend on the matching chunk; they are collected once
+        sources = utilities.spreading_activation_sources(buffers, self.dm, model_parameters["buffer_spreading_activation"], model_parameters["spreading_activation_restricted"], model_parameters["association_only_from_chunks"])
+        return all_A_bll, defined, all_A_pm, sources
         
+
+class BlendingBuffer(DecMemBuffer):
+    """
+    Blending buffer. Instead of retrieving one chunk, it creates a new chunk that blends slot values of all chunks matching the request, weighted by their activations.
+
+    The retrieval request works as in DecMemBuffer, but every matching chunk whose activation (with noise) reaches the retrieval threshold contributes to the result with the weight exp(A_i/t) / sum_j exp(A_j/t), where t is blending_temperature (by default sqrt(2)*s, s being instantaneous_noise). Slots given values in the request keep these values. Other slots, including slots with only variables or negations in the request, are blended: numeric values (strings that can be read as numbers) are averaged by the weights; other values (including chunks) are blended by choosing the value V among the values of matching chunks that minimizes sum_i w_i * Sim(V, V_i)**2, where Sim are similarities set in the model (0 for equal values, -mismatch_penalty if no similarity is set). Chunks with an empty slot do not contribute to that slot. The latency is calculated from the activation log(sum_i exp(A_i)).
+
+    Blending requires subsymbolic computation. The blended chunk is not added to declarative memory.
+    """
+
+    def retrieve(self, time, otherchunk, actrvariables, buffers, extra_tests, model_parameters):
+        """
+        Blend chunks in declarative memory that match otherchunk. Return the blended chunk (None if no chunk reaches the threshold) and the time it took.
+        """
+        model_parameters = model_parameters.copy()
+        model_parameters.update(self.model_parameters)
+        if not model_parameters["subsymbolic"]:
+            raise utilities.ACTRError("Blending requires subsymbolic computation (subsymbolic=True)")
+
+        chunk_tobe_matched = self._request(otherchunk, actrvariables)
+        matching = list(self._candidates(chunk_tobe_matched, extra_tests, model_parameters))
+        threshold = model_parameters["retrieval_threshold"]
+        failure = None, utilities.retrieval_latency(threshold, model_parameters["latency_factor"], model_parameters["latency_exponent"])
+        if not matching:
+            return failure
+
+        all_A_bll, defined, all_A_pm, sources = self._activation_components(time, chunk_tobe_matched, matching, buffers, model_parameters)
+        noise = utilities.calculate_instantaneous_noise(model_parameters["instantaneous_noise"], self.rng, len(matching))
+        activations = np.asarray(all_A_bll, dtype=float) + np.asarray(all_A_pm, dtype=float) + noise
+        if sources:
+            activations += [utilities.spreading_activation_from_sources(chunk, sources, model_parameters["strength_of_association"], model_parameters["spreading_activation_restricted"], model_parameters["association_only_from_chunks"]) for chunk in matching]
+        selected = defined & (activations >= threshold)
+        if not selected.any():
+            return failure
+
+        activations = activations[selected]
+        rows = np.array([self.dm.row(chunk) for chunk, chosen in zip(matching, selected) if chosen], dtype=np.int64)
+        temperature = model_parameters["blending_temperature"]
+        if temperature is None:
+            temperature = math.sqrt(2) * model_parameters["instantaneous_noise"]
+        if temperature > 0:
+            weights = np.exp((activations - activations.max()) / temperature)
+        else:
+            weights = (activations == activations.max()).astype(float) #no temperature: the chunks with the highest activation take all
+        weights /= weights.sum()
+
+        values = {}
+        for slot, value in chunk_tobe_matched:
+            requested = utilities.splitting(value).values
+            if requested is not None:
+                values[slot] = requested
+            else: #empty slots and slots with only variables or negations are blended
+                value = self.__blend(self.dm.value_ids(rows, slot), weights, model_parameters["mismatch_penalty"])
+                if value is not None:
+                    values[slot] = value
+
+        self.activation = float(np.log(np.sum(np.exp(activations - activations.max()))) + activations.max())
+        extra_time = utilities.retrieval_latency(self.activation, model_parameters["latency_factor"], model_parameters["latency_exponent"])
+        if model_parameters["activation_trace"]:
+            print("Blended chunks:", len(rows))
+            print("Blended activation", self.activation)
+            print("Time to retrieve", extra_time)
+        return chunks.Chunk(chunk_tobe_matched.typename, **values), extra_time
+
+    def __blend(self, ids, weights, mismatch_penalty):
+        """
+        Blend values with ids (as in DecMem.value_ids), weighted by weights. Return None if all values are empty.
+        """
+        carried = ids > 0
+        if not carried.any():
+            return None
+        weights = weights[carried] / weights[carried].sum()
+        distinct, positions = np.unique(ids[carried], return_inverse=True)
+        values = [self.dm.value(x) for x in distinct]
+        try:
+            numbers = np.array([float(x) for x in values])
+        except (TypeError, ValueError):
+            pass
+        else:
+            blended = float(np.dot(weights, numbers[positions]))
+            if blended.is_integer() and all(str(x).strip().lstrip("+-").isdigit() for x in values): #integers stay integers when the blend is whole, so that blending 3s gives 3, not 3.0
+                return str(int(blended))
+            return str(blended)
+        index = {value: i for i, value in enumerate(values)}
+        similarities = np.full((len(values), len(values)), -float(mismatch_penalty))
+        for (value, othervalue), similarity in chunks.Chunk._similarities.items():
+            if value in index and othervalue in index:
+                similarities[index[othervalue], index[value]] = similarity
+        np.fill_diagonal(similarities, 0)
+        costs = (similarities ** 2)[:, positions] @ weights #sum of weighted squared similarities to the values of chunks, for every candidate value
+        return values[int(np.argmin(costs))]
@@ -2,10 +2,17 @@
 ACT-R Model.
 """
 
+import collections
+import copy
+import warnings
+
+import numpy as np
 import pyparsing
 
 from pyactr import chunks, declarative, goals, motor, productions, simulation, utilities, vision
 
+ModelSnapshot = collections.namedtuple('ModelSnapshot', 'decmems buffers productions rng')
+
 class ACTRModel:
     """
     ACT-R model, running ACT-R simulations.
@@ -18,6 +25,7 @@ class ACTRModel:
     "decay": 0.5,
     "baselevel_learning": True,
     "optimized_learning": False,
+    "baselevel_traces": None,
     "instantaneous_noise" : 0,
     "retrieval_threshold" : 0,
     "buffer_spreading_activation" : {},
@@ -26,6 +34,7 @@ class ACTRModel:
     "association_only_from_chunks": True,
     "partial_matching": False,
     "mismatch_penalty": 1,
+    "blending_temperature": None,
     "activation_trace": False,
     "utility_noise": 0,
     "utility_learning": False,
@@ -41,7 +50,13 @@ class ACTRModel:
     "eye_mvt_scaling_parameter": 0.01
     }
 
+    baselevel_traces is the number of most recent presentations of each chunk that are kept exactly; older presentations are summarized by their number and the time of the first presentation, and their contribution to base-level learning is approximated as in Petrov (2006). This keeps memory bounded in long simulations. None (the default) keeps all presentations. See DecMem.recent_traces and utilities.baselevel_learning_vectorized for the error of the approximation.
+
+    blending_temperature is the temperature of blending (see set_blending); None stands for sqrt(2)*instantaneous_noise.
+
     environment has to be an instantiation of the class Environment.
+
+    rng (keyword only) is the random generator from which all noise in the model is drawn (instantaneous noise, utility noise, EMMA noise). It can be a numpy.random.Generator or a seed. If None, a generator is seeded from numpy's global random generator when noise is first drawn (or when rng is first read), so numpy.random.seed still makes models reproducible, and models that draw no noise leave the global random stream untouched. Buffers use the generator that the model has when a simulation is created, so assigning a new generator to rng (e.g., to reseed a model after restore) affects the next simulation; buffers whose rng was set explicitly keep their own generator.
     """
 
     MODEL_PARAMETERS = {"subsymbolic": False,
@@ -51,6 +66,7 @@ class ACTRModel:
                 "decay": 0.5,
                 "baselevel_learning": True,
                 "optimized_learning": False,
+                "baselevel_traces": None,
                 "instantaneous_noise" : 0,
                 "retrieval_threshold" : 0,
                 "buffer_spreading_activation" : {},
@@ -59,6 +75,7 @@ class ACTRModel:
                 "association_only_from_chunks": True,
                 "partial_matching": False,
                 "mismatch_penalty": 1,
+                "blending_temperature": None,
                 "activation_trace": False,
                 "utility_noise": 0,
                 "utility_learning": False,
@@ -74,7 +91,7 @@ class ACTRModel:
                 "eye_mvt_scaling_parameter": 0.01, #in LispACT-R: 0.01, but dft rule firing -- 0.01
                 }
 
-    def __init__(self, environment=None, **model_parameters):
+    def __init__(self, environment=None, *, rng=None, **model_parameters):
 
         self.chunktype = chunks.chunktype
         self.chunkstring = chunks.chunkstring
@@ -109,7 +126,23 @@ class ACTRModel:
             pass
 
         self.__env = environment
-    
+        self.__restored_modules = set() #modules restored from a snapshot; the next simulation keeps them instead of creating new ones
+
+        self.__rng = None if rng is None else np.random.default_rng(rng)
+
+    @property
+    def rng(self):
+        """
+        Random generator of the model (see ACTRModel). If the model was created without rng, the generator is seeded from numpy's global random generator on the first access.
+        """
+        if self.__rng is None:
+            self.__rng = np.random.default_rng(np.random.randint(2**32, dtype=np.uint64))
+        return self.__rng
+
+    @rng.setter
+    def rng(self, value):
+        self.__rng = value
+
     @property
     def retrieval(self):
         """
@@ -176,6 +209,18 @@ class ACTRModel:
         self.retrievals[name] = dmb
         return dmb
 
+    def set_blending(self, name):
+        """
+        Set blending buffer (see declarative.BlendingBuffer). Requests to the buffer blend all matching chunks in declarative memory into a new chunk instead of retrieving one of them.
+
+        name: the name by which the blending buffer is referred to in production rules.
+        """
+        if not isinstance(name, str):
+            raise ValueError("Blending buffer can be only set with a string, the name of the blending buffer.")
+        bb = declarative.BlendingBuffer()
+        self.__buffers[name] = bb
+        return bb
+
     def set_goal(self, name, delay=0):
         """
         Set goal buffer. delay specifies the delay of setting a chunk in the buffer.
@@ -219,6 +264,8 @@ class ACTRModel:
         utility: utility of the rule (default: 0)
         reward: reward of the rule (default: None)
 
+        The rule is created only once (see productions.compile_rule): names of chunks in the string are resolved when the rule is first used (LHS) and first fired (RHS), so named chunks defined or redefined later are not seen by the rule.
+
         The following example would be a rule that checks the buffer 'g' and if the buffer has value one, it will reset it to two:
         >>> ACTRModel().productionstring(name='example0', string='=g>\
                 isa example\
@@ -236,9 +283,8 @@ class ACTRModel:
             productions.Productions._undefinedrulecounter += 1
         temp_dictRHS = {v: k for k, v in utilities._RHSCONVENTIONS.items()}
         temp_dictLHS = {v: k for k, v in utilities._LHSCONVENTIONS.items()}
-        rule_reader = utilities.getrule()
         try:
-            rule = rule_reader.parse_string(string, parse_all=True)
+            rule = utilities.parse_rulestring(string)
         except pyparsing.ParseException as e:
             raise utilities.ACTRError(f"The rule '{name}' could not be parsed. The following error was observed: {e}")
         lhs, rhs = {}, {}
@@ -267,9 +313,69 @@ class ACTRModel:
                         raise utilities.ACTRError(f"The rule string {name} is not defined correctly; {e}")
                     rhs[each[0]+each[1]] = chunks.makechunk("", type_chunk, **chunk_dict)
             yield rhs
-        self.productions.update({name: {"rule": func, "utility": utility, "reward": reward}})
+        self.productions.update({name: {"rule": productions.static_rule(func), "utility": utility, "reward": reward}}) #the rule is created from a string, so its LHS and RHS never change
         return self.productions[name]
 
+    def snapshot(self):
+        """
+        Capture the current state of the model: contents of declarative memories (with presentation times), contents and states of buffers and modules (including the preparation, processor and execution states of the motor and visual modules), production rules (including compiled rules) with their utilities and rewards, and the state of the random generator of the model.
+
+        The snapshot can be restored by restore(snapshot), as many times as needed. This is much cheaper than building the model again, e.g., to start every trial from the state of a trained model.
+
+        Snapshots are valid only between trials. Events scheduled in a running simulation (e.g., a retrieval or a key press in progress) are not part of the model and cannot be captured, so a model restored from a snapshot is run by a new simulation (see simulation). A warning is issued if a buffer or a module is busy when the snapshot is taken.
+        """
+        buffers = {**self.__buffers, **self.visbuffers}
+        states = {name: buffers[name].get_state() for name in buffers}
+        busy = sorted(name for name, state in states.items() if any(state.get(x) == utilities._BUSY for x in ("state", "preparation", "processor", "execution")))
+        if busy:
+            warnings.warn(f"Snapshot taken while {', '.join(busy)} is busy; snapshots are valid only between trials, the work in progress is not captured")
+        return ModelSnapshot({name: dm.copy() for name, dm in self.decmems.items()},
+                states,
+                {name: self.__copy_production(self.productions[name]) for name in self.productions},
+                copy.deepcopy(self.rng))
+
+    @staticmethod
+    def __copy_production(production):
+        """
+        Copy the record of production (rule, utility, reward). Utilities and rewards change in learning, so they are copied deeply; the rule itself is shared.
+        """
+        return {"rule": production["rule"], "utility": copy.deepcopy(production["utility"]), "reward": copy.deepcopy(production["reward"])}
+
+    def restore(self, snapshot, rng=True):
+        """
+        Restore the state of the model captured in snapshot (see snapshot). Declarative memories and buffers are restored in place, so buffers keep their memories; rules added after the snapshot (e.g., by production compilation) are removed. The motor and visual modules are restored as well and the next simulation keeps them (other simulations start with new modules).
+
+        If rng is True, the random generator is restored as well, so a restored model draws the same noise every time; if False, the model keeps its current generator and draws fresh noise (alternatively, assign a new generator to self.rng after restoring). The generator is used by the next simulation.
+        """
+        if rng:
+            self.rng = copy.deepcopy(snapshot.rng)
+        for name, dm in snapshot.decmems.items():
+            if name in self.decmems:
+                self.decmems[name].restore(dm)
+            else:
+                self.decmems[name] = dm.copy()
+        buffers = {**self.__buffers, **self.visbuffers}
+        for name, state in snapshot.buffers.items():
+            buffers[name].set_state(state)
+        self.__restored_modules = set(snapshot.buffers)
+        for name in list(self.productions):
+            if name not in snapshot.productions:
+                del self.productions[name]
+        for name, rule in snapshot.productions.items():
+            self.productions[name] = self.__copy_production(rule)
+
+    def retrieval_probabilities(self, request, time=0, buffer="retrieval", actrvariables=None):
+        """
+        Calculate analytically the outcome of retrieving request (a chunk) at time through buffer, given the current state of the model (declarative memory, contents of buffers as sources of spreading activation, similarities and parameters), without running a simulation.
+
+        Return RetrievalProbabilities(chunks, probabilities, failure, latency): the (partially) matching chunks, the probabilities that they are retrieved, the probability of retrieval failure and the expected latency. See DecMemBuffer.retrieval_probabilities for the approximation used. One call replaces many Monte-Carlo runs, e.g., when a likelihood of data is calculated in model fitting.
+        """
+        retrieval = self.__buffers[buffer]
+        if retrieval.dm is None:
+            retrieval.dm = self.decmem
+        chunks.Chunk._similarities = self.__similarities
+        return retrieval.retrieval_probabilities(time, request, actrvariables, self.__buffers, {}, self.model_parameters)
+
     def set_similarities(self, chunk, otherchunk, value):
         """
         Set similarities between chunks. By default, different chunks have the value of -1.
@@ -281,7 +387,7 @@ class ACTRModel:
         self.__similarities[tuple((chunk, otherchunk))] = value
         self.__similarities[tuple((otherchunk, chunk))] = value
 
-    def simulation(self, realtime=False, trace=True, gui=True, initial_time=0, environment_process=None, **kwargs):
+    def simulation(self, realtime=False, trace=True, gui=True, initial_time=0, environment_process=None, recorder=None, **kwargs):
         """
         Prepare simulation of the model
 
@@ -293,6 +399,7 @@ class ACTRModel:
         initial_time: what is the starting time point of the simulation?
         environment_process: what environment process should the simulation use?
         The environment_process argument should be supplied with the method environment_process of the environment used in the model.
+        recorder: an EventRecorder in which all events of the simulation are recorded.
         kwargs are arguments that environment_process will be supplied with.
         """
 
@@ -307,21 +414,43 @@ class ACTRModel:
         decmem = {name: self.__buffers[name].dm for name in self.__buffers\
                 if self.__buffers[name].dm != None} #dict of declarative memories used; more than 1 decmem might appear here
 
-        self.__buffers["manual"] = motor.Motor() #adding motor buffer
+        for dm in decmem.values():
+            dm.recent_traces = self.model_parameters["baselevel_traces"]
+
+        if "manual" not in self.__restored_modules:
+            self.__buffers["manual"] = motor.Motor() #adding motor buffer
 
         if self.__env:
             self.__env.initial_time = initial_time #set the initial time of the environment to be the same as simulation
             if self.visbuffers:
                 self.__buffers.update(self.visbuffers)
-            else:
+            elif not {"visual", "visual_location"} <= self.__restored_modules:
                 dm = list(decmem.values())[0]
                 self.__buffers["visual"] = vision.Visual(self.__env, dm) #adding vision buffers
                 self.__buffers["visual_location"] = vision.VisualLocation(self.__env, dm) #adding vision buffers
+        self.__restored_modules = set()
         
         self.productions.used_rulenames = {} # remove any previously stored rules for utility learning
 
-        used_productions = productions.ProductionRules(self.productions, self.__buffers, decmem, self.model_parameters)
+        rng = self.__rng if self.__rng is not None else _ModelGenerator(self) #the generator is not seeded before noise is drawn
+        for key in self.__buffers:
+            self.__buffers[key].use_model_rng(rng) #buffers draw noise from the current generator of the model unless they have their own
+
+        used_productions = productions.ProductionRules(self.productions, self.__buffers, decmem, self.model_parameters, rng)
 
         chunks.Chunk._similarities = self.__similarities
 
-        return simulation.Simulation(self.__env, realtime, trace, gui, self.__buffers, used_productions, initial_time, environment_process, **kwargs)
+        return simulation.Simulation(self.__env, realtime, trace, gui, self.__buffers, used_productions, initial_time, environment_process, recorder, **kwargs)
+
+class _ModelGenerator:
+    """
+    Stand-in for the random generator of a model that was created without rng. The generator of the model is seeded (see ACTRModel.rng) only when noise is first drawn.
+    """
+
+    def __init__(self, model):
+        self.__model = model
+
+    def __getattr__(self, name):
+        if name.startswith("__") or name == "_ModelGenerator__model": #looked up when copying; the stand-in has none of these
+            raise AttributeError(name)
+        return getattr(self.__model.rng, name)
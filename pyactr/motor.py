@@ -27,6 +27,24 @@ class Motor(buffers.Buffer):
 
         self.last_key = [None, 0] #the number says what the last key was and when the last press will be finished, so that the preparation of the next move can speed up if it is a similar key, and execution waits for the previous mvt (two mvts cannot be carried out at the same time, according to ACT-R motor module)
 
+    def get_state(self):
+        """
+        Return the state of the buffer (its state, the states of preparation, processor and execution, and the last key), used in model snapshots.
+        """
+        state = super().get_state()
+        state.update({"preparation": self.preparation, "processor": self.processor, "execution": self.execution, "last_key": list(self.last_key)})
+        return state
+
+    def set_state(self, state):
+        """
+        Set the state of the buffer to state (see get_state).
+        """
+        super().set_state(state)
+        self.preparation = state["preparation"]
+        self.processor = state["processor"]
+        self.execution = state["execution"]
+        self.last_key = list(state["last_key"])
+
     def test(self, state, inquiry):
         """
         Is current state/preparation etc. busy or free?
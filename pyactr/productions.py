@@ -5,16 +5,54 @@ Production rules.
 import collections
 import collections.abc
 import inspect
+import types
 
 from pyactr import chunks, declarative, goals, motor, utilities, vision
 from pyactr.utilities import ACTRError
 
 Event = utilities.Event
+Action = utilities.Action
 
 roundtime = utilities.roundtime
 
 #TODO: production compilation -- in ProductionRules - currently slotvals ignore that maybe there was other modification to the buffer in the same RHS of the rule, this should be included
 
+def static_rule(rule):
+    """
+    Mark rule (a function creating a generator that yields LHS and RHS) as static: its LHS and RHS are the same every time the rule is called, so they can be created only once (see compile_rule). Rules created by ACTRModel.productionstring are static. Python functions are not, since their LHS and RHS might depend on the state of the model; mark them by this function (it can be used as a decorator) if they do not.
+    """
+    rule._static = True
+    return rule
+
+def compile_rule(rule):
+    """
+    Compile rule (a function creating a generator that yields LHS and RHS) so that LHS and RHS are created only once. Only static rules (see static_rule) are compiled; other rules are returned unchanged, so they create LHS and RHS on every use.
+
+    The returned function creates generators that yield the same read-only LHS and RHS every time. LHS is created on the first use of the rule, RHS on the first firing. This is also when names of chunks in the rule are resolved: a chunk name defined after the rule was first used (or fired) is not seen by the rule any more, unlike in the original rule, which resolved names on every use; define named chunks before running the model.
+    """
+    if getattr(rule, "_compiled", False) or not getattr(rule, "_static", False):
+        return rule
+    compiled = {}
+    def compiled_rule():
+        if "lhs" not in compiled:
+            compiled["production"] = rule()
+            compiled["lhs"] = types.MappingProxyType(dict(next(compiled["production"])))
+        yield compiled["lhs"]
+        if "rhs" not in compiled:
+            compiled["rhs"] = types.MappingProxyType(dict(next(compiled.pop("production"))))
+        yield compiled["rhs"]
+    compiled_rule._compiled = True
+    compiled_rule._static = True
+    return compiled_rule
+
+def _derived_rule(func, *rules):
+    """
+    Return func, a rule derived from rules in production compilation, marked as static if all rules are static.
+    """
+    if all(getattr(rule, "_static", False) for rule in rules):
+        static_rule(func)
+    return func
+
 class Production(collections.UserDict):
     """
     Production rule.
@@ -22,7 +60,7 @@ class Production(collections.UserDict):
 
     def __init__(self, rule, utility, reward):
         self.rule = {}
-        self.rule['rule'] = rule
+        self.rule['rule'] = compile_rule(rule)
         self.rule['utility'] = utility
         self.rule['reward'] = reward
 
@@ -59,6 +97,8 @@ class Production(collections.UserDict):
 
     def __setitem__(self, key, value):
         assert key in {"rule", "utility", "reward"}, f"The production can set only one of four values -- rule, utility, reward; you are using '{key}'"
+        if key == "rule":
+            value = compile_rule(value)
         self.rule[key] = value
 
 class Productions(collections.UserDict):
@@ -182,7 +222,7 @@ class Productions(collections.UserDict):
                         if utilities._RHSCONVENTIONS[temp_key[0]] != "modify" and utilities._RHSCONVENTIONS[temp_key[0]] != "extra_test" and temp_key[1:] == buff:
                             break
                     else:
-                        pro1.setdefault(key, {}).update(pro2[key])
+                        pro1[key] = {**pro1.get(key, {}), **pro2[key]}
                     continue
 
                 pro2buff = pro2[key]._asdict()
@@ -270,7 +310,7 @@ class Productions(collections.UserDict):
 
             yield pro2
 
-        return Production(rule=func, utility=self.__DFT_UTILITY, reward=self.__DFT_REWARD)
+        return Production(rule=_derived_rule(func, rule1['rule'], rule2['rule']), utility=self.__DFT_UTILITY, reward=self.__DFT_REWARD)
 
     def __rename__(self, name, variables):
         """
@@ -279,6 +319,7 @@ class Productions(collections.UserDict):
         def func():
             production = self[name]['rule']()
             for pro in production:
+                pro = dict(pro)
                 for key in pro:
                     code = key[0]
                     buff = key[1:]
@@ -297,7 +338,7 @@ class Productions(collections.UserDict):
 
                 yield pro
                 
-        return Production(rule=func, utility=self.__DFT_UTILITY, reward=self.__DFT_REWARD) #Reward and utility are set at dft right now, simplified
+        return Production(rule=_derived_rule(func, self[name]['rule']), utility=self.__DFT_UTILITY, reward=self.__DFT_REWARD) #Reward and utility are set at dft right now, simplified
 
     def __substitute__(self, rule, variable_dict, val_dict):
         """
@@ -306,6 +347,7 @@ class Productions(collections.UserDict):
         def func():
             production = rule['rule']()
             for pro in production:
+                pro = dict(pro)
                 for key in pro:
                     code = key[0]
                     buff = key[1:]
@@ -324,7 +366,7 @@ class Productions(collections.UserDict):
 
                 yield pro
 
-        return Production(rule=func, utility=rule['utility'], reward=rule['reward'])
+        return Production(rule=_derived_rule(func, rule['rule']), utility=rule['utility'], reward=rule['reward'])
 
     def __check_valid_compilation__(self, rule_name1, rule_name2, buffers):
         """
@@ -459,7 +501,7 @@ class ProductionRules:
     _LHSCONVENTIONS = utilities._LHSCONVENTIONS
     _INTERRUPTIBLE = utilities._INTERRUPTIBLE
 
-    def __init__(self, rules, buffers, dm, model_parameters):
+    def __init__(self, rules, buffers, dm, model_parameters, rng=None):
         self.__actrvariables = {} #variables in a fired rule
         self.rules = rules
         self.ordered_rulenames = sorted(rules.keys(), key=lambda x: rules[x]['utility'], reverse=True) #rulenames ordered by utilities -- this speeds up rule selection when utilities are used
@@ -479,6 +521,15 @@ class ProductionRules:
 
         self.model_parameters = model_parameters
 
+        self.rng = rng #random generator for utility noise
+
+        self.__network = {} #discrimination network; maps (buffer name, chunk type) to names of rules whose tests of the buffer can match a chunk of the type
+        self.__rule_tests = {} #maps rule names to (rule, patterns), patterns map names of tested buffers to (slot, value) pairs required by the rule
+        self.__buffer_rules = {} #maps buffer names to names of rules that test or query the buffer
+        self.__buffer_queries = {} #maps buffer names to queries of the buffer in rules (as keys of a dict, to keep their order)
+        self.__buffer_states = {} #maps buffer names to their states (see __buffer_state) in the last conflict resolution
+        self.__lhs_results = {} #results of LHS tests in conflict resolution; kept until a buffer tested or queried by the rule changes
+
     def procedural_process(self, start_time=0):
         """
         Process that is carrying a production. Proceeds in steps: conflict resolution -> rule selection -> rule firing; or conflict resolution -> no rule found. Start_time specifies when production starts in discrete event simulation.
@@ -497,17 +548,18 @@ class ProductionRules:
         
         self.last_rule_slotvals = self.current_slotvals.copy()
 
-        for rulename in self.ordered_rulenames:
+        self.__update_network()
+
+        if self.model_parameters["subsymbolic"]:
+            all_inst_noise = utilities.calculate_instantaneous_noise(self.model_parameters["utility_noise"], self.rng, len(self.ordered_rulenames)) #noise for all rules is drawn in one call
+
+        for i, rulename in enumerate(self.ordered_rulenames):
             self.used_rulename = rulename
-            production = self.rules[rulename]["rule"]()
             utility = self.rules[rulename]["utility"]
 
-            pro = next(production)
-
             if self.model_parameters["subsymbolic"]:
-                inst_noise = utilities.calculate_instantaneous_noise(self.model_parameters["utility_noise"])
-                utility += inst_noise
-            if max_utility <= utility and self.LHStest(pro, self.__actrvariables.copy()):
+                utility += float(all_inst_noise[i])
+            if max_utility <= utility and self.conflict_LHStest(rulename):
                 max_utility = utility
                 used_rulename = rulename
                 if not self.model_parameters["subsymbolic"] or not self.model_parameters["utility_noise"]:
@@ -517,14 +569,14 @@ class ProductionRules:
             production = self.rules[used_rulename]["rule"]()
             self.rules.used_rulenames.setdefault(used_rulename, []).append(time)
             
-            yield Event(roundtime(time), self._PROCEDURAL, f"RULE SELECTED: {used_rulename}")
+            yield Event(roundtime(time), self._PROCEDURAL, Action("RULE SELECTED: {}", used_rulename, rule=used_rulename))
             time = time + self.model_parameters["rule_firing"]
             yield Event(roundtime(time), self._PROCEDURAL, self._UNKNOWN)
 
             pro = next(production)
 
             if not self.LHStest(pro, self.__actrvariables.copy(), True):
-                yield Event(roundtime(time), self._PROCEDURAL, f"RULE STOPPED FROM FIRING: {used_rulename}")
+                yield Event(roundtime(time), self._PROCEDURAL, Action("RULE STOPPED FROM FIRING: {}", used_rulename, rule=used_rulename))
             else:
                 if self.model_parameters["utility_learning"] and self.rules[used_rulename]["reward"] != None:
                     utilities.modify_utilities(time, self.rules[used_rulename]["reward"], self.rules.used_rulenames, self.rules, self.model_parameters)
@@ -532,9 +584,9 @@ class ProductionRules:
                 compiled_rulename, re_created = self.compile_rules()
                 self.compile = []
                 if re_created:
-                    yield Event(roundtime(time), self._PROCEDURAL, f"RULE {re_created}: {compiled_rulename}")
+                    yield Event(roundtime(time), self._PROCEDURAL, Action("RULE {}: {}", re_created, compiled_rulename, rule=compiled_rulename))
                 self.current_slotvals = {key: None for key in self.buffers}
-                yield Event(roundtime(time), self._PROCEDURAL, f"RULE FIRED: {used_rulename}")
+                yield Event(roundtime(time), self._PROCEDURAL, Action("RULE FIRED: {}", used_rulename, rule=used_rulename))
                 try:
                     yield from self.update(next(production), time)
                 except utilities.ACTRError as e:
@@ -704,7 +756,7 @@ class ProductionRules:
 
         created_elem = list(updated)[0]
         updated.state = updated._FREE
-        yield Event(roundtime(time), name, f"WROTE A CHUNK: {str(created_elem)}")
+        yield Event(roundtime(time), name, Action("WROTE A CHUNK: {}", created_elem))
 
     def visualencode(self, name, visualbuffer, chunk, temp_actrvariables, time, extra_time, site):
         """
@@ -716,7 +768,7 @@ class ProductionRules:
         yield from self.clear(name, visualbuffer, None, temp_actrvariables, time, freeing=False)
         visualbuffer.add(chunk, time)
         visualbuffer.state = visualbuffer._FREE
-        yield Event(roundtime(time), name, f"ENCODED VIS OBJECT:'{str(chunk)}'")
+        yield Event(roundtime(time), name, Action("ENCODED VIS OBJECT:'{}'", chunk))
 
     def retrieveorset(self, name, updated, otherchunk, temp_actrvariables, time):
         """
@@ -736,7 +788,7 @@ class ProductionRules:
             updated.create(otherchunk, list(self.dm.values())[0], temp_actrvariables)
             created_elem = list(updated)[0]
             updated.state = updated._FREE
-            yield Event(roundtime(time), name, f"CREATED A CHUNK: {str(created_elem)}")
+            yield Event(roundtime(time), name, Action("CREATED A CHUNK: {}", created_elem))
         elif isinstance(updated, vision.VisualLocation):
             extra_time = utilities.calculate_setting_time(updated)
             time += extra_time #0 ms to create chunk in location (pop-up effect)
@@ -748,7 +800,7 @@ class ProductionRules:
                 updated.state = updated._FREE
             else:
                 updated.state = updated._ERROR
-            yield Event(roundtime(time), name, f"ENCODED LOCATION:'{str(chunk)}'")
+            yield Event(roundtime(time), name, Action("ENCODED LOCATION:'{}'", chunk))
         elif isinstance(updated, vision.Visual):
             mod_attr_val = {x[0]: utilities.check_bound_vars(temp_actrvariables, x[1]) for x in otherchunk.removeunused()}
             if (not mod_attr_val['cmd'].values) or mod_attr_val['cmd'].values not in utilities.CMDVISUAL:
@@ -787,7 +839,11 @@ class ProductionRules:
             RHSdict = {item[0]: item[1] for item in RHSdict.items() if item[1] != chunks.Chunk.EmptyValue()} #delete None values
             self.current_slotvals[name] = [RHSdict, retrieved_elem]
 
-        yield Event(roundtime(time), name, f"RETRIEVED: {str(retrieved_elem)}")
+        activation = None
+        if retrieved_elem and retrieval.model_parameters.get("subsymbolic", self.model_parameters["subsymbolic"]):
+            activation = retrieval.activation
+        chunk_id = retrieval.dm.row(retrieved_elem) if retrieved_elem else None
+        yield Event(roundtime(time), name, Action("RETRIEVED: {}", retrieved_elem, chunk=retrieved_elem, chunk_id=chunk_id, activation=activation, latency=extra_time))
 
     def automatic_search(self, name, visualbuffer, stim, time):
         """
@@ -802,7 +858,7 @@ class ProductionRules:
                 visualbuffer.modify(newchunk, stim)
             else:
                 visualbuffer.add(newchunk, stim, time)
-            yield Event(roundtime(time), name, f"ENCODED LOCATION: {newchunk}")
+            yield Event(roundtime(time), name, Action("ENCODED LOCATION: {}", newchunk))
         else:
             yield Event(roundtime(time), name, self._UNKNOWN)
 
@@ -829,7 +885,7 @@ class ProductionRules:
                 visualbuffer.modify(newchunk)
             else:
                 visualbuffer.add(newchunk, time)
-            yield Event(roundtime(time), name, f"AUTOMATIC BUFFERING: {str(newchunk)}")
+            yield Event(roundtime(time), name, Action("AUTOMATIC BUFFERING: {}", newchunk))
 
     def visualshift(self, name, visualbuffer, otherchunk, temp_actrvariables, time):
         """
@@ -918,7 +974,7 @@ class ProductionRules:
         motorbuffer.preparation = motorbuffer._BUSY
         motorbuffer.processor = motorbuffer._BUSY
 
-        yield Event(roundtime(time), name, f"COMMAND: {str(newchunk.cmd)}")
+        yield Event(roundtime(time), name, Action("COMMAND: {}", newchunk.cmd))
         time += preparation
         
         yield Event(roundtime(time), name, 'PREPARATION COMPLETE')
@@ -952,7 +1008,7 @@ class ProductionRules:
         
         self.env_interaction.add(otherchunk.key.values)
 
-        yield Event(roundtime(time), name, f"KEY PRESSED: {str(otherchunk.key)}")
+        yield Event(roundtime(time), name, Action("KEY PRESSED: {}", otherchunk.key))
         
         time += movement_finish
 
@@ -963,6 +1019,134 @@ class ProductionRules:
         motorbuffer.execution = motorbuffer._FREE
         motorbuffer.last_key[1] = 0
 
+    def conflict_LHStest(self, rulename):
+        """
+        Test LHS of the rule rulename in conflict resolution.
+
+        Rules are kept in a discrimination network that maps a buffer and a chunk type to the rules that can match a chunk of that type in the buffer. A rule is tested only if every buffer it tests carries a chunk of a type the rule hangs off and the values required by the rule; otherwise, it fails without creating its LHS. The result of the test is reused until a buffer tested or queried by the rule changes (see __update_network). This holds only for static rules (see static_rule), whose LHS stays the same as long as the rule is not replaced; other rules may depend on the state of the model, so they are kept out of the network and tested every time.
+        """
+        rule = self.rules[rulename]["rule"]
+        if not getattr(rule, "_static", False):
+            if rulename in self.__rule_tests:
+                self.__unregister(rulename)
+            return self.LHStest(next(rule()), self.__actrvariables.copy())
+        pro = None
+        try:
+            registered, patterns = self.__rule_tests[rulename]
+        except KeyError:
+            registered = None
+        if registered is not rule:
+            pro = self.__register(rulename, rule)
+            patterns = self.__rule_tests[rulename][1]
+        elif rulename in self.__lhs_results:
+            return self.__lhs_results[rulename]
+
+        for name, required_values in patterns.items():
+            chunk = self.__buffer_states[name][0]
+            if chunk is None or rulename not in self.__hanging_rules(name, type(chunk.actrchunk)) or not self.__carries(chunk, required_values):
+                result = False
+                break
+        else:
+            if pro is None:
+                pro = next(rule())
+            result = self.LHStest(pro, self.__actrvariables.copy())
+        self.__lhs_results[rulename] = result
+        return result
+
+    def __register(self, rulename, rule):
+        """
+        Add the rule rulename to the discrimination network, replacing its earlier version, if any, and return its LHS.
+
+        For every buffer tested by the rule, the values that the rule requires in slots are collected: a chunk of a type without these slots cannot match (missing slots have the value None).
+        """
+        self.__unregister(rulename)
+        pro = next(rule())
+        patterns = {}
+        for key in pro:
+            name = key[1:]
+            if key[0] not in self._LHSCONVENTIONS:
+                patterns = {} #the rule is always tested, so that LHStest reports the error
+                break
+            self.__buffer_rules.setdefault(name, set()).add(rulename)
+            if key[0] == "=":
+                required_values = []
+                for x in pro[key]:
+                    varval = utilities.splitting(x[1])
+                    if varval.values and varval.values != None: #None is the missing value of the attribute
+                        required_values.append((x[0], varval.values))
+                patterns[name] = tuple(required_values)
+            else:
+                self.__buffer_queries.setdefault(name, {}).update(dict.fromkeys(pro[key].items()))
+            self.__buffer_states[name] = self.__buffer_state(name) #buffers have not changed since __update_network; only new queries are added
+        self.__rule_tests[rulename] = rule, patterns
+
+        for (name, chunktype), rules in self.__network.items():
+            if name in patterns and {slot for slot, _ in patterns[name]} <= set(chunks._slotnames(chunktype)):
+                rules.add(rulename)
+        return pro
+
+    def __unregister(self, rulename):
+        """
+        Remove the rule rulename from the discrimination network and drop its cached LHS test.
+        """
+        for rules in self.__buffer_rules.values():
+            rules.discard(rulename)
+        for rules in self.__network.values():
+            rules.discard(rulename)
+        self.__rule_tests.pop(rulename, None)
+        self.__lhs_results.pop(rulename, None)
+
+    def __hanging_rules(self, name, chunktype):
+        """
+        Return names of rules that hang off the buffer name and chunk type chunktype in the discrimination network.
+        """
+        try:
+            return self.__network[(name, chunktype)]
+        except KeyError:
+            slots = set(chunks._slotnames(chunktype))
+            rules = {rulename for rulename in self.__buffer_rules.get(name, ()) if name in self.__rule_tests[rulename][1] and {slot for slot, _ in self.__rule_tests[rulename][1][name]} <= slots}
+            return self.__network.setdefault((name, chunktype), rules)
+
+    @staticmethod
+    def __carries(chunk, required_values):
+        """
+        Check that chunk carries the values required by a rule, given as (slot, value) pairs.
+        """
+        for slot, value in required_values:
+            matching_val = getattr(chunk.actrchunk, slot + "_")
+            if isinstance(matching_val, utilities.VarvalClass):
+                matching_val = matching_val.values
+            if value != matching_val:
+                return False
+        return True
+
+    def __update_network(self):
+        """
+        Find buffers that changed since the last conflict resolution and drop the results of LHS tests of the rules that test or query them. Results of other rules stay valid.
+        """
+        for name, rulenames in self.__buffer_rules.items():
+            state = self.__buffer_state(name)
+            old_state = self.__buffer_states.get(name)
+            if old_state is None or state[0] is not old_state[0] or state[1] != old_state[1]:
+                self.__buffer_states[name] = state
+                for rulename in rulenames:
+                    self.__lhs_results.pop(rulename, None)
+
+    def __buffer_state(self, name):
+        """
+        Return the state of the buffer name on which LHS tests depend: the chunk in the buffer (None if empty) and the results of all queries of the buffer in rules.
+        """
+        buffer = self.buffers.get(name)
+        if buffer is None:
+            return None, ()
+        results = []
+        for each, value in self.__buffer_queries.get(name, ()):
+            try:
+                results.append(bool(buffer.test_buffer(value) if each == 'buffer' else buffer.test(each, value)))
+            except AttributeError:
+                results.append(None) #the query is invalid; LHStest reports it when the rule is tested
+        return next(iter(buffer), None), tuple(results)
+
     def LHStest(self, dictionary, actrvariables, update=False):
         """
         Test rules in LHS of production rules. update specifies whether actrvariables should be updated (this does not happen when rules are tested, only when they are fired)
@@ -0,0 +1,125 @@
+"""
+Recording events of simulations into columns.
+"""
+
+import math
+
+import numpy as np
+
+from pyactr import utilities
+
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+class EventRecorder:
+    """
+    Event recorder. It collects events of a simulation into columns, without printing them.
+
+    Pass the recorder to a simulation (ACTRModel.simulation(recorder=...)); every event of the simulation is then recorded. The columns are:
+    time: the time of the event
+    proc: the module (buffer) in which the event happened
+    code: the code of the action (e.g., 'RETRIEVED: {}'; for actions that are plain strings, the action itself)
+    action: the description of the action, as printed in the trace
+    rule: the name of the rule (for events of the procedural module), otherwise None
+    chunk: the retrieved chunk (as a string), otherwise None
+    chunk_id: the row of the retrieved chunk in declarative memory, otherwise -1
+    activation: the activation of the retrieved chunk (only if subsymbolic), otherwise nan
+    latency: the time that the retrieval took, otherwise nan
+
+    Descriptions of actions and chunks are rendered only when the columns are exported.
+    """
+
+    COLUMNS = ("time", "proc", "code", "action", "rule", "chunk", "chunk_id", "activation", "latency")
+
+    def __init__(self):
+        self.clear()
+
+    def __len__(self):
+        return len(self.__time)
+
+    def clear(self):
+        """
+        Remove all recorded events.
+        """
+        self.__time = []
+        self.__proc = []
+        self.__action = []
+
+    def record(self, event):
+        """
+        Record event (an instance of utilities.Event).
+        """
+        self.__time.append(event.time)
+        self.__proc.append(event.proc)
+        self.__action.append(event.action)
+
+    def __field(self, name, default, render=None):
+        """
+        Collect the field name of all actions; actions without the field get default.
+        """
+        column = []
+        for action in self.__action:
+            try:
+                value = action.fields[name]
+            except (AttributeError, KeyError):
+                value = None
+            if value is None:
+                column.append(default)
+            else:
+                column.append(render(value) if render else value)
+        return column
+
+    def columns(self):
+        """
+        Return the recorded events as a dict of columns (numpy arrays). String columns are arrays of objects.
+        """
+        return {"time": np.array(self.__time, dtype=float),
+                "proc": np.array(self.__proc, dtype=object),
+                "code": np.array([action.template if isinstance(action, utilities.Action) else action for action in self.__action], dtype=object),
+                "action": np.array([str(action) for action in self.__action], dtype=object),
+                "rule": np.array(self.__field("rule", None), dtype=object),
+                "chunk": np.array(self.__field("chunk", None, str), dtype=object),
+                "chunk_id": np.array(self.__field("chunk_id", -1), dtype=np.int64),
+                "activation": np.array(self.__field("activation", math.nan), dtype=float),
+                "latency": np.array(self.__field("latency", math.nan), dtype=float)}
+
+    def save_npz(self, file):
+        """
+        Save the columns into a .npz file (see numpy.savez_compressed). String columns are stored as unicode arrays, so the file can be loaded without pickling.
+        """
+        columns = self.columns()
+        for name in ("proc", "code", "action", "rule", "chunk"):
+            columns[name] = columns[name].astype(str)
+        np.savez_compressed(file, **columns)
+
+    def to_pandas(self):
+        """
+        Return the recorded events as pandas.DataFrame. This requires pandas.
+        """
+        if pandas is None:
+            raise ImportError("Exporting events to pandas requires pandas; install pandas to use it.")
+        return pandas.DataFrame(self.columns(), columns=self.COLUMNS)
+
+    def to_arrow(self):
+        """
+        Return the recorded events as pyarrow.Table. This requires pyarrow.
+        """
+        if pyarrow is None:
+            raise ImportError("Exporting events to Arrow requires pyarrow; install pyarrow to use it.")
+        columns = self.columns()
+        return pyarrow.table({name: list(columns[name]) if columns[name].dtype == object else columns[name] for name in self.COLUMNS})
+
+    def save_parquet(self, file):
+        """
+        Save the recorded events into a Parquet file. This requires pyarrow.
+        """
+        table = self.to_arrow()
+        pyarrow.parquet.write_table(table, file)
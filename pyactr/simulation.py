@@ -21,14 +21,39 @@ if GUI:
 
 Event = utilities.Event
 
+class _PriorityTimeout(simpy.Timeout):
+    """
+    Timeout processed with the given priority; among events at the same time, events with lower priority values are processed first (simpy.Timeout always has the priority simpy.core.NORMAL). The priority is applied by environments with _PriorityScheduling.
+    """
+
+    def __init__(self, env, delay, priority):
+        self.priority = priority
+        super().__init__(env, delay)
+
+class _PriorityScheduling:
+    """
+    Mixin for simpy environments that schedule _PriorityTimeout events with their own priority.
+    """
+
+    def schedule(self, event, priority=simpy.core.NORMAL, delay=0):
+        super().schedule(event, getattr(event, "priority", priority), delay)
+
+class _Environment(_PriorityScheduling, simpy.Environment):
+    pass
+
+class _RealtimeEnvironment(_PriorityScheduling, simpy.RealtimeEnvironment):
+    pass
+
 class Simulation:
     """
     ACT-R simulations.
     """
 
     _UNKNOWN = utilities._UNKNOWN
-    
-    def __init__(self, environment, realtime, trace, gui, buffers, used_productions, initial_time=0, environment_process=None, **kwargs):
+
+    _LATE = simpy.core.NORMAL + 1 #priority of events processed after all other events scheduled at the same time
+
+    def __init__(self, environment, realtime, trace, gui, buffers, used_productions, initial_time=0, environment_process=None, recorder=None, **kwargs):
 
         if gui:
             if not environment:
@@ -42,7 +67,7 @@ class Simulation:
 
         self.gui = environment and gui and GUI
 
-        self.__simulation = simpy.Environment(initial_time=round(initial_time, 4))
+        self.__simulation = _Environment(initial_time=round(initial_time, 4))
 
         self.__env = environment
         if self.__env:
@@ -51,10 +76,16 @@ class Simulation:
         self.__realtime = realtime
 
         if not self.gui and realtime:
-            self.__simulation = simpy.RealtimeEnvironment()
+            self.__simulation = _RealtimeEnvironment()
 
         self.__trace = trace
 
+        self.__recorder = recorder #if present, all events are recorded in it
+
+        self.__stop = None #stop conditions of the running simulation (see run)
+        self.__stopped = None #event that met a stop condition
+        self.__stop_event = None #scheduler event triggered when a stop condition is met
+
         self.__dict_extra_proc = {key: None for key in buffers}
 
         self.__buffers = buffers
@@ -84,10 +115,35 @@ class Simulation:
 
         self.__last_event = None #used when stepping thru simulation
 
+        self.__current_event = None #the current event as yielded by modules; its action may not be rendered yet
+        self.__rendered_event = None #(event, event with its action rendered as a string)
+
         #here below -- simulation values, accessible by user
-        self.current_event = None
         self.now = self.__simulation.now
 
+    @property
+    def current_event(self):
+        """
+        The current event in the simulation. Its action is always a string; actions of events are only rendered as strings when asked for.
+        """
+        event = self.__current_event
+        if event is None or isinstance(event.action, str):
+            return event
+        if self.__rendered_event is None or self.__rendered_event[0] is not event:
+            self.__rendered_event = (event, event._replace(action=str(event.action)))
+        return self.__rendered_event[1]
+
+    @current_event.setter
+    def current_event(self, event):
+        self.__current_event = event
+
+    @property
+    def structured_event(self):
+        """
+        The current event in the simulation with its action as produced by the module. The action is either a string or a utilities.Action, which carries the code of the action (its template) and the objects (e.g., chunks) involved. This avoids building descriptions of events that are never read.
+        """
+        return self.__current_event
+
     def __activate__(self, event):
         """
         Triggers proc_activate, needed to activate procedural process.
@@ -212,16 +268,26 @@ class Simulation:
         Stores current event in self.current_event and prints event.
         """
         if event.action != self.__pr._UNKNOWN:
-            self.current_event = event
+            self.__current_event = event
+            if self.__recorder is not None:
+                self.__recorder.record(event)
+            if self.__stop and self.__stopped is None and any(condition(event) for condition in self.__stop):
+                self.__stopped = event
+                self.__stop_event.succeed(event)
             if self.__trace and not self.gui:
-                print(event[0:3])
+                print((event.time, event.proc, str(event.action)))
     
     def __printenv__(self, event):
         """
         Prints environment event.
         """
         if event.action != self.__pr._UNKNOWN:
-            self.current_event = event
+            self.__current_event = event
+            if self.__recorder is not None:
+                self.__recorder.record(event)
+            if self.__stop and self.__stopped is None and any(condition(event) for condition in self.__stop):
+                self.__stopped = event
+                self.__stop_event.succeed(event)
 
     def __procprocessGenerator__(self):
         """
@@ -245,22 +311,44 @@ class Simulation:
                         if name in self.__interruptibles and proc[1] != self.__interruptibles[name]:
                             self.__interruptibles[name] = proc[1]
                             self.__dict_extra_proc[name].interrupt() #otherwise, interrupt them
-            for _ in range(5):
-                yield self.__simulation.timeout(0) #move procedural process to the bottom; right now, this is a hack - it yields 0 timeout five times, so other processes get enough cycles to start etc.
+            yield _PriorityTimeout(self.__simulation, 0, self._LATE) #move procedural process to the bottom: it continues after all other events at this time, so other processes get enough cycles to start etc.
             pro = self.__simulation.process(self.__localprocess__(self.__pr._PROCEDURAL, self.__pr.procedural_process(self.__simulation.now)))
             self.__procs_started = yield pro
             self.__proc_activate = self.__simulation.event() #start the event
 
-    def run(self, max_time=1):
+    def run(self, max_time=1, until=None):
         """
         Run simulation for the number of seconds specified in max_time.
+
+        until is a stop condition or a list of stop conditions. A stop condition is a function that receives every event of the simulation (see structured_event) and returns True if the simulation should stop after the event. Conditions for common cases are created by rule_fired, key_pressed and buffer_contains. The simulation stops at max_time if no condition is met. The event that stopped the simulation is returned (None if no condition was met).
+
+        The simulation can be run further after it stopped.
         """
+        if until is not None and self.gui:
+            warnings.warn("Stop conditions cannot be used in simulations with GUI; they are ignored.")
         if not self.gui:
-            self.__simulation.run(max_time)
+            if until is None:
+                self.__simulation.run(max_time)
+            else:
+                self.__stop = [until] if callable(until) else list(until)
+                self.__stopped = None
+                if self.__simulation.now < max_time:
+                    self.__stop_event = self.__simulation.event() #succeeded when a condition is met (conditions are checked when events are stored, see __printevent__)
+                    limit = _PriorityTimeout(self.__simulation, max_time - self.__simulation.now, simpy.core.URGENT) #processed before all other events at max_time, just like the deadline in run(max_time)
+                    limit.callbacks.append(simpy.core.StopSimulation.callback) #the scheduler stops at whichever comes first
+                    try:
+                        self.__simulation.run(until=self.__stop_event)
+                    finally:
+                        if limit.callbacks is not None:
+                            limit.callbacks.clear() #the deadline was not reached; it must not stop later runs
+                        self.__stop = None
+                        self.__stop_event = None
         else:
             self.__runGUI__()
         if self.__simulation.peek() == float("inf"):
             self.__pr.compile_rules() #at the end of the simulation, run compilation (the last two rules are not yet compiled)
+        if until is not None and not self.gui:
+            return self.__stopped
     
     def show_time(self):
         """
@@ -279,8 +367,8 @@ class Simulation:
         """
         while True:
             self.__simulation.step()
-            if self.current_event and self.current_event.action != self._UNKNOWN and self.current_event != self.__last_event:
-                self.__last_event = self.current_event
+            if self.__current_event and self.__current_event.action != self._UNKNOWN and self.__current_event != self.__last_event:
+                self.__last_event = self.__current_event
                 break
             if self.__simulation.peek() == float("inf"):
                 self.__pr.compile_rules() #at the end of the simulation, run compilation (the last two rules are not yet compiled)
@@ -364,6 +452,36 @@ class Simulation:
         self.__running = False
 
 
+def rule_fired(rulename):
+    """
+    Stop condition (see Simulation.run): the rule rulename fired.
+    """
+    def condition(event):
+        return utilities.action_code(event.action) == "RULE FIRED: {}" and event.action.fields["rule"] == rulename
+    return condition
+
+def key_pressed(key=None):
+    """
+    Stop condition (see Simulation.run): the key was pressed; if key is None, any key.
+    """
+    def condition(event):
+        if utilities.action_code(event.action) != "KEY PRESSED: {}":
+            return False
+        return key is None or str(event.action.objects[0]) == str(key)
+    return condition
+
+def buffer_contains(buffer, chunk):
+    """
+    Stop condition (see Simulation.run): buffer carries a chunk that matches chunk. The condition is checked after every event of the simulation; variables in chunk are bound anew in every check.
+    """
+    def condition(event):
+        for x in buffer:
+            chunk.boundvars = {} #matching binds variables; bindings from earlier events must not carry over
+            if chunk <= x:
+                return True
+        return False
+    return condition
+
 class GuiPart:
     """
     GUI part is used to run GUI on top of ACT-R model. It is used for environment simulations.
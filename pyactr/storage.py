@@ -0,0 +1,580 @@
+"""
+Storage of declarative memory in arrays: files of declarative memory, rows loaded from them, the index of rows, values per row and presentation times.
+"""
+
+import itertools
+import json
+import mmap as mapping
+
+import numpy as np
+
+from pyactr import utilities
+
+_MAGIC = b"PYACTRDM" #start of files of declarative memory
+_FORMAT_VERSION = 2 #the version written by DecMem.save
+_ALIGNMENT = 64 #arrays in the files start at multiples of this, so they can be memory-mapped
+_ROWVALUES = ("time_offsets", "time_lengths", "older_counts", "first_times") #arrays mapped copy-on-write, since they change with presentations
+
+_STRINGVALUE = 0 #kinds of values in the files: plain strings, chunks (stored as positions in the table of chunks) and values with variables or negations (stored as json)
+_CHUNKVALUE = 1
+_VARVALVALUE = 2
+
+def write(file, header, arrays):
+    """
+    Write header (a dict) and arrays (a dict of named numpy arrays) into file (a path).
+
+    The file starts with _MAGIC, the length of the header and the header as json. The header gets the entry "arrays", which describes the type, size and position of every array. Arrays follow the header, aligned to _ALIGNMENT.
+    """
+    descriptors = {}
+    position = 0
+    for name, array in arrays.items():
+        descriptors[name] = [array.dtype.str, len(array), position]
+        position += -(-array.nbytes // _ALIGNMENT) * _ALIGNMENT
+    header = json.dumps(dict(header, arrays=descriptors)).encode("utf-8")
+    start = -(-(len(_MAGIC) + 8 + len(header)) // _ALIGNMENT) * _ALIGNMENT
+    with open(file, "wb") as f:
+        f.write(_MAGIC)
+        f.write(np.uint64(len(header)).tobytes())
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(start + descriptors[name][2])
+            f.write(array.tobytes())
+        f.truncate(start + position)
+
+def read(file, mmap=True):
+    """
+    Read the header and the arrays of file written by write. Return the header (a dict) and the arrays (a dict of named numpy arrays).
+
+    If mmap is True, arrays are memory-mapped rather than read into memory. Arrays in _ROWVALUES are mapped copy-on-write, so only their changed pages become private; other arrays are read-only.
+    """
+    with open(file, "rb") as f:
+        if f.read(len(_MAGIC)) != _MAGIC:
+            raise utilities.ACTRError(f"The file '{file}' is not a file of declarative memory")
+        length = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+        header = json.loads(f.read(length).decode("utf-8"))
+    start = -(-(len(_MAGIC) + 8 + length) // _ALIGNMENT) * _ALIGNMENT
+
+    arrays = {}
+    for name, (dtype, size, position) in header["arrays"].items():
+        if not size:
+            arrays[name] = np.empty(0, dtype=dtype)
+        elif mmap:
+            mode = "c" if name in _ROWVALUES else "r"
+            arrays[name] = np.asarray(np.memmap(file, dtype=dtype, mode=mode, offset=start + position, shape=(size,)))
+        else:
+            arrays[name] = np.fromfile(file, dtype=dtype, count=size, offset=start + position)
+    return header, arrays
+
+_EMPTY = np.empty(0, dtype=np.int64) #the posting of values that no row carries
+
+def _posting(postings, valueid):
+    """
+    Return the rows carrying the value with the id valueid in postings (sorted value ids, offsets of their postings and rows grouped by value ids).
+    """
+    values, offsets, rows = postings
+    position = int(values.searchsorted(values.dtype.type(valueid))) #with a value of another type, the whole array would be converted
+    if position < len(values) and values[position] == valueid:
+        return rows[offsets[position]:offsets[position+1]]
+    return _EMPTY
+
+class StoredRows:
+    """
+    Rows of declarative memory loaded from a file (see DecMem.load), used without creating their chunks.
+
+    Nothing is written into the arrays of the file, so they can be memory-mapped and shared by processes and by copies of the memory. Values have ids from 1 to self.values (0 stands for empty values).
+    """
+
+    def __init__(self, header, arrays):
+        self.rows = header["rows"] #number of rows; they are the first positions of the table of chunks
+        self.types = header["types"]
+        self.chunk_types = arrays["chunk_types"]
+        self.chunk_offsets = arrays["chunk_offsets"]
+        self.slot_values = arrays["slot_values"]
+        self.kinds = arrays["value_kinds"]
+        self.value_offsets = arrays["value_offsets"]
+        self.value_bytes = arrays["value_bytes"]
+        self.values = len(self.kinds) #number of values
+        self.columns = {} #maps slots to arrays of value ids, indexed by rows
+        self.postings = {} #maps slots to the index of their values: sorted value ids, offsets of their postings, and rows grouped by value ids
+        for number, slot in enumerate(header["slots"]):
+            self.columns[slot] = arrays[f"column_{number}"]
+            self.postings[slot] = (arrays[f"posting_values_{number}"], arrays[f"posting_offsets_{number}"], arrays[f"postings_{number}"])
+        self.chunks = {} #chunks created from positions of the table that are not rows (chunks that are only values of slots)
+        self.positions = {} #positions of these chunks and of chunks of rows removed from some memory
+        self.__kinds = {kind: (int(np.searchsorted(self.kinds, kind, side="left")), int(np.searchsorted(self.kinds, kind, side="right"))) for kind in (_STRINGVALUE, _CHUNKVALUE, _VARVALVALUE)} #values are sorted by kinds, so each kind is a range of positions
+
+    def chunk(self, position):
+        """
+        Return the chunk type, the slot names and the value ids of the chunk at position in the table of chunks.
+        """
+        typename, slotnames = self.types[self.chunk_types[position]]
+        return typename, slotnames, self.slot_values[self.chunk_offsets[position]:self.chunk_offsets[position+1]].tolist()
+
+    def value(self, valueid):
+        """
+        Return the kind and the text of the value with the id valueid.
+        """
+        return int(self.kinds[valueid-1]), self.__bytes(valueid-1).decode("utf-8")
+
+    def valueid(self, text, kind):
+        """
+        Return the id of the value of the kind with the text; None if there is no such value. Values are sorted by their kinds and texts, so they are found by bisection.
+        """
+        key = text.encode("utf-8")
+        low, high = self.__kinds[kind]
+        end = high
+        while low < high:
+            middle = (low + high) // 2
+            if self.__bytes(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < end and self.__bytes(low) == key:
+            return low + 1
+        return None
+
+    def __bytes(self, position):
+        """
+        Return the encoded text of the value at position.
+        """
+        return self.value_bytes[self.value_offsets[position]:self.value_offsets[position+1]].tobytes()
+
+    def posting(self, slot, valueid):
+        """
+        Return the rows carrying the value with the id valueid in slot (a sorted array, part of the stored index).
+        """
+        try:
+            return _posting(self.postings[slot], valueid)
+        except KeyError:
+            return _EMPTY
+
+    def filled(self, row):
+        """
+        Return the number of slots of row that carry values used in the index.
+        """
+        return sum(1 for column in self.columns.values() if column[row])
+
+class RowIndex:
+    """
+    Index of slot values of rows added to declarative memory: for every slot, the sorted rows carrying each value id (postings).
+
+    Postings are kept in arrays laid out as in files (see StoredRows.postings), so they take a few bytes per row. Rows added since the arrays were built go to a tail of small lists, which is merged into the arrays when it grows to a fraction of them; adding rows thus stays amortized cheap. Arrays are never changed in place, so copies of the index share them.
+    """
+
+    _TAIL = 4096 #the tail is merged when it has more rows than this and than an eighth of the arrays
+
+    def __init__(self):
+        self.postings = {} #maps slots to sorted value ids, offsets of their postings and rows grouped by value ids
+        self.tail = {} #maps slots to dicts mapping value ids to lists of rows added since the last merge
+        self.size = 0 #number of (slot, row) pairs in the arrays
+        self.tailsize = 0 #number of (slot, row) pairs in the tail
+
+    def add(self, row, pairs):
+        """
+        Add row carrying the (slot, value id) pairs. Rows must be added in increasing order, so postings stay sorted.
+        """
+        tail = self.tail
+        for slot, valueid in pairs:
+            try:
+                tail[slot][valueid].append(row)
+            except KeyError:
+                tail.setdefault(slot, {})[valueid] = [row]
+        self.tailsize += len(pairs)
+        if self.tailsize > max(self._TAIL, self.size // 8):
+            self.__merge()
+
+    def count(self, slot, valueid):
+        """
+        Return the number of rows carrying valueid in slot.
+        """
+        count = len(self.tail.get(slot, {}).get(valueid, ()))
+        if slot in self.postings:
+            count += len(_posting(self.postings[slot], valueid))
+        return count
+
+    def posting(self, slot, valueid):
+        """
+        Return the rows carrying valueid in slot (a sorted array).
+        """
+        rows = _posting(self.postings[slot], valueid) if slot in self.postings else _EMPTY
+        tail = self.tail.get(slot, {}).get(valueid)
+        if tail:
+            return np.concatenate((rows, tail)) #tail rows were added later, so they follow
+        return rows
+
+    def remove(self, row, slot, valueid):
+        """
+        Remove row carrying valueid in slot. Removing a row from the arrays copies them, but rows are rarely removed.
+        """
+        tail = self.tail.get(slot, {}).get(valueid)
+        if tail and row in tail:
+            tail.remove(row)
+            if not tail:
+                del self.tail[slot][valueid]
+            self.tailsize -= 1
+            return
+        values, offsets, rows = self.postings[slot]
+        position = int(np.searchsorted(values, valueid))
+        start = offsets[position]
+        rows = np.delete(rows, start + np.searchsorted(rows[start:offsets[position+1]], row))
+        offsets = offsets.copy()
+        offsets[position+1:] -= 1
+        if offsets[position+1] == start: #no row carries the value any more
+            values = np.delete(values, position)
+            offsets = np.delete(offsets, position+1)
+        self.postings[slot] = (values, offsets, rows)
+        self.size -= 1
+
+    def __merge(self):
+        """
+        Merge the tail into the arrays.
+        """
+        for slot, tail in self.tail.items():
+            tailvalues = np.repeat(np.fromiter(tail, dtype=np.int64, count=len(tail)), [len(x) for x in tail.values()])
+            tailrows = np.fromiter(itertools.chain.from_iterable(tail.values()), dtype=np.int64, count=len(tailvalues))
+            if slot in self.postings:
+                values, offsets, rows = self.postings[slot]
+                tailvalues = np.concatenate((np.repeat(values.astype(np.int64), np.diff(offsets)), tailvalues))
+                tailrows = np.concatenate((rows, tailrows))
+            order = np.argsort(tailvalues, kind="stable") #rows of the arrays come first within each value, and they precede rows of the tail
+            values, starts = np.unique(tailvalues[order], return_index=True)
+            self.postings[slot] = (values, np.append(starts, len(order)), tailrows[order])
+        self.size += self.tailsize
+        self.tail = {}
+        self.tailsize = 0
+
+    def copy(self):
+        """
+        Copy the index. Arrays are shared, the tail is copied.
+        """
+        index = RowIndex()
+        index.postings = self.postings.copy()
+        index.tail = {slot: {valueid: list(rows) for valueid, rows in tail.items()} for slot, tail in self.tail.items()}
+        index.size = self.size
+        index.tailsize = self.tailsize
+        return index
+
+class RowArray:
+    """
+    Array of one value per row: values of stored rows (an array of a file, used without copying) followed by a private part for rows added later.
+
+    The stored part is copied only if it is written into after it was shared with a copy. If it is a copy-on-write mapping of the file, writing into it makes only the touched pages private.
+    """
+
+    def __init__(self, stored=(), dtype=np.int64, size=16):
+        self.stored = np.asarray(stored, dtype=dtype)
+        self.split = len(self.stored) #first row of the private part
+        self.private = np.zeros(size, dtype=dtype)
+        self.shared = False #is the stored part shared with copies?
+
+    def __len__(self):
+        return self.split + len(self.private)
+
+    def __array__(self, dtype=None, copy=None):
+        return np.concatenate((self.stored, self.private)).astype(dtype or self.private.dtype, copy=False)
+
+    def __getitem__(self, rows):
+        stored = self.split
+        if isinstance(rows, (int, np.integer)):
+            if rows < stored:
+                return self.stored[rows]
+            return self.private[rows - stored]
+        rows = np.asarray(rows, dtype=np.int64)
+        if not stored:
+            return self.private[rows]
+        in_stored = rows < stored
+        values = np.empty(len(rows), dtype=self.private.dtype)
+        values[in_stored] = self.stored[rows[in_stored]]
+        values[~in_stored] = self.private[rows[~in_stored] - stored]
+        return values
+
+    def __setitem__(self, rows, values):
+        stored = self.split
+        if isinstance(rows, (int, np.integer)):
+            if rows < stored:
+                self.__own()
+                self.stored[rows] = values
+            else:
+                self.private[rows - stored] = values
+            return
+        rows = np.asarray(rows, dtype=np.int64)
+        values = np.broadcast_to(values, rows.shape)
+        in_stored = rows < stored
+        if in_stored.any():
+            self.__own()
+            self.stored[rows[in_stored]] = values[in_stored]
+        self.private[rows[~in_stored] - stored] = values[~in_stored]
+
+    def __own(self):
+        """
+        Copy the stored part if it is shared with copies.
+        """
+        if self.shared:
+            self.stored = self.stored.copy()
+            self.shared = False
+
+    @staticmethod
+    def zeros(size):
+        """
+        Return an array of size zeros (int64) in an anonymous mapping. Its pages take memory only when they are written into, unlike np.zeros, which may fill them.
+        """
+        if not size:
+            return np.zeros(0, dtype=np.int64)
+        return np.frombuffer(mapping.mmap(-1, 8*size), dtype=np.int64)
+
+    def grow(self, size):
+        """
+        Make space for size rows. Only the private part grows, by doubling.
+        """
+        if size > len(self):
+            extra = max(len(self.private), size - len(self))
+            self.private = np.concatenate((self.private, np.zeros(extra, dtype=self.private.dtype)))
+
+    def copy(self):
+        """
+        Copy the array. The stored part is shared until it changes in one of the copies.
+        """
+        rows = RowArray.__new__(RowArray)
+        rows.stored = self.stored
+        rows.split = self.split
+        rows.private = self.private.copy()
+        rows.shared = self.shared = True
+        return rows
+
+class PresentationTimes:
+    """
+    Presentation times of all chunks in declarative memory in one ragged array.
+
+    The times of row r are at offsets[r]:offsets[r]+lengths[r] in a read-only base (e.g., times mapped from a file) followed by a private array. Rows in the private array have a capacity, so appending times is amortized O(1); rows that outgrow it move to the end with their capacity doubled. Values per row are RowArrays, so values of stored rows are shared as well.
+
+    If limit is set (see DecMem.recent_traces), rows keep only the limit most recent times; older times are summarized by their number (older) and the first time (firsts).
+    """
+
+    def __init__(self):
+        self.base = np.empty(0)
+        self.flat = np.empty(16)
+        self.offsets = RowArray()
+        self.lengths = RowArray()
+        self.capacities = RowArray() #space reserved for rows in the private array; 0 for rows in the base
+        self.older = RowArray() #number of summarized (dropped) times per row
+        self.firsts = RowArray(dtype=float) #first presentation per row; only meaningful if older > 0
+        self.limit = None
+        self.used = 0 #how much of the private array is reserved
+        self.unused = 0 #how much of the reserved part belongs to moved, replaced or deleted rows
+
+    def __getitem__(self, row):
+        """
+        Return the times of row as a read-only view. The view is valid until times of the memory change.
+        """
+        start = self.offsets[row]
+        if start < len(self.base):
+            times = self.base[start:start+self.lengths[row]]
+        else:
+            start -= len(self.base)
+            times = self.flat[start:start+self.lengths[row]]
+        times.flags.writeable = False
+        return times
+
+    @classmethod
+    def from_arrays(cls, flat, lengths, offsets=None, older=None, firsts=None):
+        """
+        Create presentation times from a flat array of times and the number of times per row. flat becomes the base and is used without copying, so it can be a read-only (e.g., memory-mapped) array. offsets are the starts of rows in flat (by default, rows follow each other). older and firsts summarize dropped times per row (see bound).
+
+        lengths, offsets, older and firsts become the stored parts of the values per row (see RowArray) and are used without copying if they have the right types; they are written into when stored rows change, so they can be copy-on-write mappings, but not read-only arrays.
+        """
+        times = cls()
+        times.base = flat
+        lengths = np.asarray(lengths, dtype=np.int64)
+        times.lengths = RowArray(lengths)
+        times.offsets = RowArray(np.cumsum(lengths) - lengths if offsets is None else offsets)
+        times.capacities = RowArray(RowArray.zeros(len(lengths)))
+        times.older = RowArray(np.zeros(len(lengths), dtype=np.int64) if older is None else older)
+        times.firsts = RowArray(np.zeros(len(lengths)) if firsts is None else firsts, dtype=float)
+        return times
+
+    @property
+    def private(self):
+        """
+        Number of times stored in the private array (times presented after the base was created).
+        """
+        return int(np.asarray(self.lengths)[np.asarray(self.offsets) >= len(self.base)].sum())
+
+    def copy(self):
+        """
+        Copy presentation times. The base and the values of stored rows are shared, not copied (see RowArray.copy).
+        """
+        times = PresentationTimes()
+        times.base = self.base
+        times.flat = self.flat.copy()
+        times.offsets = self.offsets.copy()
+        times.lengths = self.lengths.copy()
+        times.capacities = self.capacities.copy()
+        times.older = self.older.copy()
+        times.firsts = self.firsts.copy()
+        times.limit = self.limit
+        times.used = self.used
+        times.unused = self.unused
+        return times
+
+    def bound(self, limit):
+        """
+        Keep at most limit most recent times per row (None keeps all times). Times of rows above the limit are summarized now; later presentations are summarized as they come. Bounded rows are kept in chronological order.
+        """
+        if limit == self.limit:
+            return
+        self.limit = limit
+        if limit is None:
+            return
+        for row in np.flatnonzero(np.asarray(self.lengths) > 1):
+            times = self[row]
+            if len(times) > limit or np.any(times[1:] < times[:-1]):
+                self.__rewrite(row, times)
+
+    def __summarize(self, row, times):
+        """
+        Return the limit most recent times in chronological order; the remaining times are added to the summary of row.
+        """
+        if self.limit is None:
+            return times
+        times = np.sort(times, kind="stable")
+        if len(times) <= self.limit:
+            return times
+        dropped = times[:-self.limit]
+        self.firsts[row] = min(self.firsts[row], dropped[0]) if self.older[row] else dropped[0]
+        self.older[row] += len(dropped)
+        return times[-self.limit:]
+
+    def __rewrite(self, row, times):
+        """
+        Replace the times of row by times (summarized if the row is bounded), keeping the summary of row.
+        """
+        times = self.__summarize(row, times)
+        if self.capacities[row] and len(times) <= self.capacities[row]: #fits into the space the row already has
+            start = self.offsets[row] - len(self.base)
+            self.flat[start:start+len(times)] = times
+            self.lengths[row] = len(times)
+            return
+        self.__release(row)
+        if len(times):
+            self.__place(row, times, len(times))
+
+    def __in_order(self, row, times):
+        """
+        Can times be appended to row without breaking the chronological order?
+        """
+        if len(times) > 1 and np.any(times[1:] < times[:-1]):
+            return False
+        length = self.lengths[row]
+        if not len(times) or not length:
+            return True
+        last = self.offsets[row] + length - 1
+        if last < len(self.base):
+            return times[0] >= self.base[last]
+        return times[0] >= self.flat[last - len(self.base)]
+
+    def __setitem__(self, row, times):
+        times = np.ravel(times)
+        if row >= len(self.offsets):
+            for values in (self.offsets, self.lengths, self.capacities, self.older, self.firsts):
+                values.grow(row+1)
+        self.older[row] = 0
+        self.__rewrite(row, times)
+
+    def append(self, row, times):
+        """
+        Add times to the end of the times of row. This is amortized O(1) per time (O(limit) if the times of row are bounded). Bounded rows stay in chronological order: times presented out of order are sorted in.
+        """
+        times = np.ravel(times)
+        length = self.lengths[row]
+        if self.limit is not None and not self.__in_order(row, times):
+            self.__rewrite(row, np.concatenate((self[row], times)))
+            return
+        if self.limit is not None and length + len(times) > self.limit:
+            drop = length + len(times) - self.limit
+            if drop <= length and self.capacities[row] >= self.limit: #only kept times are dropped; shift the row in place
+                start = self.offsets[row] - len(self.base)
+                if not self.older[row]:
+                    self.firsts[row] = self.flat[start]
+                self.older[row] += drop
+                self.flat[start:start+length-drop] = self.flat[start+drop:start+length]
+                self.flat[start+length-drop:start+self.limit] = times
+                self.lengths[row] = self.limit
+                return
+            self.__rewrite(row, np.concatenate((self[row], times)))
+            return
+        if length + len(times) <= self.capacities[row]:
+            start = self.offsets[row] - len(self.base) + length
+            self.flat[start:start+len(times)] = times
+            self.lengths[row] = length + len(times)
+            return
+        new = np.concatenate((self[row], times))
+        capacity = max(2*len(new), 4)
+        if self.limit is not None:
+            capacity = max(min(capacity, self.limit), len(new))
+        self.__release(row)
+        self.__place(row, new, capacity)
+
+    def __place(self, row, times, capacity):
+        """
+        Write times of row at the end of the private array, reserving capacity for the row. The row must not hold any space.
+        """
+        if self.used + capacity > len(self.flat):
+            self.__reallocate(capacity)
+        self.flat[self.used:self.used+len(times)] = times
+        self.offsets[row] = len(self.base) + self.used
+        self.lengths[row] = len(times)
+        self.capacities[row] = capacity
+        self.used += capacity
+
+    def __release(self, row):
+        """
+        Free the space of row; its summary is kept.
+        """
+        self.unused += self.capacities[row] #times in the base are left as they are
+        self.offsets[row] = 0
+        self.lengths[row] = 0
+        self.capacities[row] = 0
+
+    def __delitem__(self, row):
+        self.__release(row)
+        self.older[row] = 0
+
+    def summaries(self, rows):
+        """
+        Return the number of summarized times and the first presentation of rows (see bound).
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        return self.older[rows], self.firsts[rows]
+
+    def __reallocate(self, extra):
+        """
+        Make space for extra times; drop unused space from the private array and grow it if needed. Rows keep their capacities.
+        """
+        live = self.used - self.unused
+        rows = np.flatnonzero(np.asarray(self.capacities) > 0)
+        times, lengths = self.gather(rows)
+        capacities = self.capacities[rows]
+        starts = np.cumsum(capacities) - capacities
+        flat = np.empty(max(2*(live + extra), 16))
+        flat[np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(len(times))] = times
+        self.flat = flat
+        self.offsets[rows] = len(self.base) + starts
+        self.used = live
+        self.unused = 0
+
+    def gather(self, rows):
+        """
+        Collect times of rows. Return a flat array of the times and the number of times per row.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        lengths = self.lengths[rows]
+        starts = np.repeat(self.offsets[rows] - (np.cumsum(lengths) - lengths), lengths)
+        positions = starts + np.arange(len(starts))
+        base = len(self.base)
+        if not base:
+            return self.flat[positions], lengths
+        in_base = positions < base
+        times = np.empty(len(positions))
+        times[in_base] = self.base[positions[in_base]]
+        times[~in_base] = self.flat[positions[~in_base] - base]
+        return times, lengths
@@ -7,11 +7,16 @@ import unittest
 import re
 import warnings
 import math
+import collections
+import io
+import os
+import tempfile
+import time
 
 import simpy
 import numpy as np
 
-from pyactr import chunks, declarative, goals
+from pyactr import chunks, declarative, goals, motor, productions, storage, vision
 import pyactr.utilities as util
 import pyactr.tests.modeltests as modeltests
 
@@ -1921,5 +1926,1504 @@ class TestCompilation12(unittest.TestCase):
 
         self.assertEqual(g_noncompiled, g_compiled)
 
+class TestDecMemIndex(unittest.TestCase):
+    """
+    Testing the index of declarative memory. Retrievals using the index must give the same results as the full scan.
+    """
+
+    def setUp(self):
+        chunks.chunktype("indexed", "word, category, number")
+        chunks.chunktype("indexed2", "word, category")
+        self.dm = declarative.DecMem()
+        self.fullscan_dm = declarative.DecMem(use_index=False)
+        for i in range(60):
+            for dm in (self.dm, self.fullscan_dm):
+                dm.add(chunks.makechunk("", "indexed", word="w"+str(i % 7), category="cat"+str(i % 3), number=str(i % 5)), time=-i)
+                if i % 4 == 0:
+                    dm.add(chunks.makechunk("", "indexed2", word="w"+str(i % 7), category="cat"+str(i % 2)), time=-i)
+        self.requests = [chunks.chunkstring(string="isa indexed word w1"),
+                chunks.chunkstring(string="isa indexed word w1 category cat2"),
+                chunks.chunkstring(string="isa indexed2 word w3 category cat1"),
+                chunks.chunkstring(string="isa indexed word w4 category ~cat1"),
+                chunks.chunkstring(string="isa indexed word w4 number None"),
+                chunks.chunkstring(string="isa indexed category cat0 number ~3"),
+                chunks.chunkstring(string="isa indexed word w100"),
+                chunks.chunkstring(string="isa indexed")]
+
+    def test_index(self):
+        warnings.simplefilter("ignore")
+        for subsymbolic in (False, True):
+            model_parameters = actr.ACTRModel.MODEL_PARAMETERS.copy()
+            model_parameters.update({"subsymbolic": subsymbolic, "retrieval_threshold": -10})
+            for request in self.requests:
+                retrieval = declarative.DecMemBuffer(self.dm)
+                fullscan_retrieval = declarative.DecMemBuffer(self.fullscan_dm)
+                retrieved = retrieval.retrieve(1, request, {}, {}, {}, model_parameters)
+                fullscan_retrieved = fullscan_retrieval.retrieve(1, request, {}, {}, {}, model_parameters)
+                self.assertEqual(retrieved, fullscan_retrieved)
+        self.assertEqual(self.dm.find_candidates(self.requests[6]), [])
+        self.assertEqual(len(self.dm.find_candidates(self.requests[1])), 3)
+        candidates = self.dm.find_candidates(self.requests[0])
+        self.assertEqual(candidates, [x for x in self.dm if x in set(candidates)])
+        del self.dm[candidates[0]]
+        self.assertNotIn(candidates[0], self.dm.find_candidates(self.requests[0]))
+
+class TestCompactRows(unittest.TestCase):
+    """
+    Testing compact rows of declarative memory: chunks carrying only plain strings are not kept, and they are created from the columns when needed.
+    """
+
+    def setUp(self):
+        actr.chunktype("compactWord", "form meaning")
+        actr.chunktype("compactPair", "first second")
+        self.dm = declarative.DecMem()
+        for i in range(50):
+            self.dm.add(actr.makechunk("", "compactWord", form="f%s" % i, meaning="m%s" % (i % 4)), i)
+        self.word = actr.makechunk("", "compactWord", form="f7", meaning="m3")
+        self.pair = actr.makechunk("", "compactPair", first=self.word, second="x")
+        self.dm.add(self.pair, 60)
+
+    def test_compact(self):
+        self.assertEqual(len(self.dm), 51)
+        self.assertEqual(self.dm._unbuilt, 50)
+        self.assertEqual(list(self.dm._rows), [self.pair]) #the pair carries a chunk, so it is kept
+        self.assertEqual(list(self.dm[self.word]), [7])
+        self.assertNotIn(actr.makechunk("", "compactWord", form="f7"), self.dm)
+        self.assertNotIn(actr.makechunk("", "compactWord", form="f7", meaning="m2"), self.dm)
+        pattern = actr.chunkstring(string="isa compactWord form =x meaning m3")
+        self.assertNotIn(pattern, self.dm)
+        pattern.boundvars = {"=x": "f7"}
+        self.assertIn(pattern, self.dm) #chunks with bound variables equal chunks with the values
+        candidates = self.dm.find_candidates(actr.chunkstring(string="isa compactWord meaning m3"))
+        self.assertEqual(candidates, [actr.makechunk("", "compactWord", form="f%s" % i, meaning="m3") for i in range(3, 50, 4)])
+        self.assertIs(self.dm.find_candidates(actr.chunkstring(string="isa compactWord form f11"))[0], candidates[2]) #chunks still in use are returned
+        self.assertEqual(self.dm.fan("m3"), 12)
+        self.dm.add(candidates[0], 70)
+        self.assertEqual(list(self.dm[candidates[0]]), [3, 70])
+        self.assertEqual(len(self.dm), 51)
+
+    def test_removal(self):
+        copied = self.dm.copy()
+        del self.dm[self.word]
+        del self.dm[actr.makechunk("", "compactWord", form="f3", meaning="m3")]
+        self.assertNotIn(self.word, self.dm)
+        self.assertEqual(len(self.dm), 49)
+        self.assertEqual(self.dm.fan("m3"), 10)
+        self.assertEqual(self.dm.find_candidates(actr.chunkstring(string="isa compactWord form f7")), [])
+        self.dm.add(self.word, 80)
+        self.assertEqual(list(self.dm[self.word]), [80])
+        self.assertEqual(list(copied[self.word]), [7])
+        self.assertEqual(copied.fan("m3"), 12)
+        self.assertEqual(len(copied), 51)
+        self.assertIn(actr.makechunk("", "compactWord", form="f3", meaning="m3"), copied)
+
+class TestRowIndex(unittest.TestCase):
+    """
+    Testing the index of rows, whose tail is merged into arrays.
+    """
+
+    def test_index(self):
+        index = storage.RowIndex()
+        index._TAIL = 4
+        expected = {}
+        for row in range(40):
+            index.add(row, [("a", row % 3), ("b", row % 7)])
+            expected.setdefault(("a", row % 3), []).append(row)
+            expected.setdefault(("b", row % 7), []).append(row)
+        self.assertTrue(index.size) #the tail was merged
+        copied = index.copy()
+        for row in (0, 3, 39, 36):
+            index.remove(row, "a", row % 3)
+            expected["a", row % 3].remove(row)
+        for (slot, valueid), rows in expected.items():
+            self.assertEqual(index.posting(slot, valueid).tolist(), rows)
+            self.assertEqual(index.count(slot, valueid), len(rows))
+        self.assertEqual(copied.posting("a", 0).tolist(), list(range(0, 40, 3)))
+        self.assertEqual(index.count("c", 0), 0)
+        self.assertEqual(index.posting("a", 5).tolist(), [])
+
+class TestVectorizedBaselevel(unittest.TestCase):
+    """
+    Testing base-level activations calculated in one pass for all chunks. They must be the same as those of baselevel_learning.
+    """
+
+    def setUp(self):
+        chunks.chunktype("vectorized", "word, number")
+        self.dm = declarative.DecMem()
+        for i in range(40):
+            chunk = chunks.makechunk("", "vectorized", word="v"+str(i % 9), number=str(i % 4))
+            self.dm.add(chunk, time=[-i-1, -i/2-1, -i/3-1])
+            if i % 5 == 0:
+                self.dm.add(chunk, time=0) #stored at the current time; the most recent trace is dropped
+        self.dm.add(chunks.makechunk("", "vectorized", word="v0", number="10"), time=0) #no trace in the past
+        self.dm.add_activation(chunks.makechunk("", "vectorized", word="v1", number="1"), 1.5)
+        del self.dm[chunks.makechunk("", "vectorized", word="v3", number="3")]
+
+    def test_baselevel(self):
+        warnings.simplefilter("ignore")
+        elements = list(self.dm)
+        for optimized_learning in (False, True):
+            for bll in (True, False):
+                activations, defined = self.dm.baselevel_activations(elements, 0, bll, 0.5, optimized_learning=optimized_learning)
+                for i, chunk in enumerate(elements):
+                    if optimized_learning and self.dm[chunk].max() >= 0:
+                        continue #optimized baselevel_learning does not drop traces at the current time
+                    try:
+                        expected = util.baselevel_learning(0, self.dm[chunk], bll, 0.5, self.dm.activations.get(chunk), optimized_learning=optimized_learning)
+                    except UnboundLocalError:
+                        self.assertFalse(defined[i])
+                    else:
+                        self.assertTrue(defined[i])
+                        self.assertAlmostEqual(activations[i], expected)
+
+    def test_presentation_times(self):
+        for chunk in self.dm:
+            np.testing.assert_array_equal(self.dm._times[self.dm.row(chunk)], self.dm[chunk])
+
+class TestFanIndex(unittest.TestCase):
+    """
+    Testing fan counts, maintained by declarative memory.
+    """
+
+    def setUp(self):
+        actr.chunktype("fan_person", "name")
+        actr.chunktype("fan_fact", "person, location")
+        self.hippie = chunks.makechunk("", "fan_person", name="hippie")
+        self.dm = declarative.DecMem()
+        for location in ("park", "church", "bank"):
+            self.dm.add(chunks.makechunk("", "fan_fact", person=self.hippie, location=location))
+        self.dm.add(chunks.makechunk("", "fan_fact", person=self.hippie, location=self.hippie))
+
+    def test_fan(self):
+        self.assertEqual(self.dm.fan(self.hippie), 5)
+        self.assertEqual(self.dm.fan(self.hippie, "person"), 4)
+        self.assertEqual(self.dm.fan(self.hippie, "location"), 1)
+        self.assertEqual(self.dm.fan("park", "location"), 1)
+        del self.dm[chunks.makechunk("", "fan_fact", person=self.hippie, location="park")]
+        self.assertEqual(self.dm.fan(self.hippie), 4)
+        self.assertEqual(self.dm.fan("park"), 0)
+        self.dm.add(chunks.makechunk("", "fan_fact", person=self.hippie, location="park"))
+        self.assertEqual(self.dm.fan(self.hippie, "person"), 4)
+        self.assertEqual(self.dm.copy().fan(self.hippie), 5)
+
+    def test_spreading_activation(self):
+        g = goals.Goal()
+        g.add(chunks.makechunk("", "fan_fact", person=self.hippie, location="park"))
+        chunk = chunks.makechunk("", "fan_fact", person=self.hippie, location="church")
+        for restricted in (False, True):
+            sources = util.spreading_activation_sources({"g": g}, self.dm, {"g": 1}, restricted, only_chunks=False)
+            expected = 0.5*(util.calculate_strength_association(self.hippie, chunk, self.dm, 2, "person" if restricted else "", only_chunks=False) + util.calculate_strength_association("park", chunk, self.dm, 2, "location" if restricted else "", only_chunks=False))
+            self.assertAlmostEqual(util.spreading_activation_from_sources(chunk, sources, 2, restricted, only_chunks=False), expected)
+            self.assertAlmostEqual(util.spreading_activation(chunk, {"g": g}, self.dm, {"g": 1}, 2, restricted, only_chunks=False), expected)
+        self.assertAlmostEqual(util.spreading_activation(chunk, {"g": g}, self.dm, {"g": 1}, 2, only_chunks=False), 0.5*(2-math.log(6)))
+
+class TestCompiledMatching(unittest.TestCase):
+    """
+    Testing matching of chunks compiled into constraints, also against chunks of different types.
+    """
+
+    def setUp(self):
+        chunks.chunktype("compiled1", "a, b, c")
+        chunks.chunktype("compiled2", "b, c, z")
+        self.pattern = chunks.chunkstring(string="isa compiled1 a =x b ~=x c ~v")
+
+    def test_matching(self):
+        self.assertTrue(self.pattern <= chunks.makechunk("", "compiled1", a="p", b="q", c="w"))
+        self.assertEqual(self.pattern.boundvars["=x"], "p")
+        self.assertEqual(self.pattern.boundvars["~=x"], {"q"})
+        self.pattern.boundvars = {}
+        self.assertFalse(self.pattern <= chunks.makechunk("", "compiled1", a="p", b="p", c="w"))
+        self.pattern.boundvars = {}
+        self.assertFalse(self.pattern <= chunks.makechunk("", "compiled1", a="p", b="q", c="v"))
+        self.pattern.boundvars = {}
+        self.assertTrue(self.pattern <= chunks.makechunk("", "compiled2", b="q", c="w", z="p")) #a is missing in compiled2, so =x is bound to None
+        self.assertEqual(self.pattern.boundvars["=x"], None)
+        self.pattern.boundvars = {"=x": "q"}
+        self.assertFalse(self.pattern <= chunks.makechunk("", "compiled2", b="r", c="w"))
+        self.pattern.boundvars = {}
+        self.assertEqual(self.pattern.match(chunks.makechunk("", "compiled1", a="p", b="p", c="v"), partialmatching=True, mismatch_penalty=2), -4)
+        self.assertFalse(chunks.chunkstring(string="isa compiled1 a p") <= "p")
+        self.assertTrue(chunks.chunkstring(string="isa compiled1 a ~p") <= "p")
+
+    def test_equal_chunks(self):
+        other = chunks.chunkstring(string="isa compiled1 a =x b ~=x c ~v")
+        self.assertTrue(self.pattern <= other)
+        self.assertEqual(self.pattern.boundvars, {}) #equal chunks match without binding variables
+        self.assertEqual(self.pattern.match(other, partialmatching=True), 0)
+        self.assertEqual(self.pattern.boundvars, {})
+
+class TestCompactChunks(unittest.TestCase):
+    """
+    Testing compact representation of chunks.
+    """
+
+    def setUp(self):
+        chunks.chunktype("compact", "word, category")
+
+    def test_compact(self):
+        first = chunks.makechunk("", "compact", word="dog", category="noun")
+        second = chunks.chunkstring(string="isa compact word cat category noun")
+        self.assertFalse(hasattr(first, "__dict__"))
+        self.assertIs(first.category, second.category)
+        self.assertIsNot(first.word, second.word)
+        self.assertEqual(first.boundvars, {})
+        pattern = chunks.chunkstring(string="isa compact word =x category noun")
+        self.assertTrue(pattern <= first)
+        self.assertEqual(pattern.boundvars, {"=x": "dog"})
+        self.assertIs(chunks.chunkstring(string="isa compact word =x category noun").word, pattern.word)
+        self.assertEqual(list(first), [("category", first.category), ("word", first.word)])
+        self.assertEqual(first[1], ("word", first.word))
+
+class TestChunkHashes(unittest.TestCase):
+    """
+    Testing hashes of chunks and interning.
+    """
+
+    def setUp(self):
+        chunks.chunktype("hashed", "word, category")
+
+    def test_hashes(self):
+        ground = chunks.makechunk("", "hashed", word="dog", category="noun")
+        pattern = chunks.chunkstring(string="isa hashed word =x category noun")
+        self.assertNotEqual(ground, pattern)
+        ground_hash = hash(ground)
+        ground.boundvars = {"=x": "cat"}
+        self.assertEqual(hash(ground), ground_hash)
+        pattern.boundvars = {"=x": "dog"}
+        self.assertEqual(ground, pattern)
+        self.assertEqual(hash(pattern), ground_hash)
+        pattern.boundvars = {"=x": "cat"}
+        self.assertNotEqual(ground, pattern)
+        self.assertEqual(chunks.chunkstring(string="isa hashed category noun word dog"), ground)
+
+    def test_interning(self):
+        ground = chunks.makechunk("", "hashed", word="bird", category="noun")
+        dm = declarative.DecMem({ground: 0})
+        other = chunks.makechunk("", "hashed", word="bird", category="noun")
+        self.assertIsNot(other, ground)
+        self.assertIs(other.intern(), ground)
+        dm.add(other, 1)
+        self.assertEqual(len(dm), 1)
+        self.assertIs(list(dm)[0], ground)
+        pattern = chunks.chunkstring(string="isa hashed word =x")
+        self.assertIs(pattern.intern(), pattern)
+
+    def test_hash_collision(self):
+        first = chunks.makechunk("", "hashed", word="fish", category="noun").intern()
+        second = chunks.makechunk("", "hashed", word="swim", category="verb")
+        chunks.Chunk._interned[hash(second)] = first #pretend that the two chunks have the same hash
+        self.assertIs(second.intern(), second)
+        self.assertIs(chunks.makechunk("", "hashed", word="fish", category="noun").intern(), first)
+
+class TestIncrementalConflictResolution(unittest.TestCase):
+    """
+    Testing that results of LHS tests are reused in conflict resolution only while tested buffers do not change, and that rules are only tested when they hang off the chunk type in the buffer.
+    """
+
+    def setUp(self):
+        self.model = actr.ACTRModel()
+        actr.chunktype("incremental", "n, state")
+        self.model.goal.add(actr.makechunk("", "incremental", n="0", state="go"))
+        for i in range(20):
+            self.model.productionstring(name=f"step{i}", string=f"""
+            =g>
+            isa incremental
+            n {i}
+            ?retrieval>
+            state free
+            ==>
+            =g>
+            isa incremental
+            n {i+1}""")
+        self.model.productionstring(name="stop", string="""
+            =g>
+            isa incremental
+            n 20
+            ==>
+            ~g>""")
+        self.created = {rulename: 0 for rulename in self.model.productions}
+        for rulename in self.model.productions:
+            rule = self.model.productions[rulename]["rule"]
+            @productions.static_rule
+            def counted(rule=rule, rulename=rulename):
+                self.created[rulename] += 1
+                return rule()
+            self.model.productions[rulename]["rule"] = counted
+
+    def test_conflict_resolution(self):
+        sim = self.model.simulation(trace=False, gui=False)
+        fired = []
+        while True:
+            sim.step()
+            if sim.current_event.action.startswith("RULE FIRED"):
+                fired.append(sim.current_event.action[12:])
+            if sim.current_event.action == "NO RULE FOUND":
+                break
+        self.assertEqual(fired, [f"step{i}" for i in range(20)] + ["stop"])
+        self.assertEqual(len(self.model.goals["g"]), 0)
+        #rules are compiled, so their LHS and RHS are created only once
+        self.assertEqual(set(self.created.values()), {1})
+
+    def test_network(self):
+        actr.chunktype("unrelated", "m")
+        patterns = {"other_type": {"=g": actr.chunkstring(string="isa unrelated m 1")},
+                "same_type": {"=g": actr.chunkstring(string="isa incremental n =x state =x")},
+                "query": {"?retrieval": {"state": "busy"}}}
+        for rulename, lhs in patterns.items():
+            @productions.static_rule
+            def rule(lhs=lhs):
+                yield lhs
+                yield {}
+            self.model.productions.update({rulename: {"rule": rule, "utility": 1, "reward": None}}) #tested before other rules in every conflict resolution
+        tests = collections.Counter()
+        LHStest = productions.ProductionRules.LHStest
+        def counted(rules, dictionary, actrvariables, update=False):
+            for rulename, lhs in patterns.items():
+                if not update and dictionary == lhs:
+                    tests[rulename] += 1
+            return LHStest(rules, dictionary, actrvariables, update)
+        productions.ProductionRules.LHStest = counted
+        try:
+            sim = self.model.simulation(trace=False, gui=False)
+            sim.run(5)
+        finally:
+            productions.ProductionRules.LHStest = LHStest
+        #chunks in g never have the slot m, so the rule is never tested; retrieval stays free, so the query is tested only once
+        self.assertEqual(tests["other_type"], 0)
+        self.assertEqual(tests["query"], 1)
+        #the rule hangs off chunks in g, so it is tested again whenever g changes (20 modifications), but not once g is cleared
+        self.assertEqual(tests["same_type"], 21)
+
+    def test_closure_rule(self):
+        model = actr.ACTRModel()
+        actr.chunktype("flagged", "state")
+        model.goal.add(actr.makechunk("", "flagged", state="closure_on"))
+        model.set_goal("g2")
+        model.goals["g2"].add(actr.makechunk("", "flagged", state="closure_start"))
+        flag = {"v": "closure_off"}
+        def r():
+            yield {"=g": actr.chunkstring(string="isa flagged state " + flag["v"])}
+            yield {"=g": actr.chunkstring(string="isa flagged state closure_done")}
+        def r2():
+            yield {"=g2": actr.chunkstring(string="isa flagged state closure_start")}
+            flag["v"] = "closure_on"
+            yield {"=g2": actr.chunkstring(string="isa flagged state closure_end")}
+        model.productions.update({"r": {"rule": r, "utility": 0, "reward": None}, "r2": {"rule": r2, "utility": 0, "reward": None}})
+        sim = model.simulation(trace=False, gui=False)
+        fired = []
+        while True:
+            sim.step()
+            if sim.current_event.action.startswith("RULE FIRED"):
+                fired.append(sim.current_event.action[12:])
+            if sim.current_event.action == "NO RULE FOUND":
+                break
+        #r is not static, so it is tested again although g did not change
+        self.assertEqual(fired, ["r2", "r"])
+
+class TestCompiledProductions(unittest.TestCase):
+    """
+    Testing that LHS and RHS of productions are created only once.
+    """
+
+    def setUp(self):
+        self.model = actr.ACTRModel()
+        actr.chunktype("compiledrule", "value")
+        self.created = []
+        @productions.static_rule
+        def rule():
+            self.created.append("lhs")
+            yield {"=g": actr.makechunk("", "compiledrule", value="one")}
+            self.created.append("rhs")
+            yield {"=g": actr.makechunk("", "compiledrule", value="two")}
+        self.model.productions.update({"rule": {"rule": rule, "utility": 0, "reward": None}})
+
+    def test_compiled(self):
+        production = self.model.productions["rule"]["rule"]()
+        lhs = next(production)
+        self.assertEqual(self.created, ["lhs"])
+        self.assertIs(next(self.model.productions["rule"]["rule"]()), lhs)
+        with self.assertRaises(TypeError):
+            lhs["=g"] = None
+        rhs = next(production)
+        production = self.model.productions["rule"]["rule"]()
+        self.assertIs(next(production), lhs)
+        self.assertIs(next(production), rhs)
+        self.assertEqual(self.created, ["lhs", "rhs"])
+        self.assertEqual(str(rhs["=g"]), "compiledrule(value= two)")
+
+    def test_dynamic(self):
+        state = {"value": "one"}
+        def rule():
+            yield {"=g": actr.makechunk("", "compiledrule", value=state["value"])}
+            yield {"=g": actr.makechunk("", "compiledrule", value="done")}
+        self.model.productions.update({"dynamic": {"rule": rule, "utility": 0, "reward": None}})
+        self.model.goal.add(actr.makechunk("", "compiledrule", value="two"))
+        self.assertEqual(str(next(self.model.productions["dynamic"]["rule"]())["=g"]), "compiledrule(value= one)")
+        state["value"] = "two" #the LHS of rules that are Python functions is created anew on every use
+        sim = self.model.simulation(trace=False)
+        sim.run(1)
+        self.assertEqual(str(self.model.goal.pop()), "compiledrule(value= done)")
+
+    def test_binding_time(self):
+        self.model.productionstring(name="bound", string="""
+        =g>
+        isa compiledrule
+        value boundtarget
+        ==>
+        =g>
+        isa compiledrule
+        value bounddone
+        """)
+        target = actr.makechunk("boundtarget", "compiledrule", value="old") #defined after the rule, before its first use
+        self.model.goal.add(actr.makechunk("", "compiledrule", value=target))
+        sim = self.model.simulation(trace=False)
+        sim.run(1)
+        self.assertEqual(str(self.model.goal.pop()), "compiledrule(value= bounddone)")
+        actr.makechunk("boundtarget", "compiledrule", value="new") #redefined after the first use, the rule keeps the old binding
+        self.assertEqual(str(next(self.model.productions["bound"]["rule"]())["=g"].value), "compiledrule(value= old)")
+
+def counting_factory(noise=0.3, rng=None):
+    """
+    Counting model with noisy retrievals, used to test batch runs.
+    """
+    actr.chunktype("countOrder", ("first", "second"))
+    actr.chunktype("countFrom", ("start", "end", "count"))
+    m = actr.ACTRModel(rng=rng, subsymbolic=True, instantaneous_noise=noise, retrieval_threshold=-2)
+    for i in range(1, 6):
+        m.decmem.add(actr.makechunk("", "countOrder", first=i, second=i+1))
+    m.goal.add(actr.makechunk("", "countFrom", start=2, end=4))
+    m.productionstring(name="start", string="""
+    =g>
+    isa countFrom
+    start =x
+    count None
+    ==>
+    =g>
+    isa countFrom
+    count =x
+    +retrieval>
+    isa countOrder
+    first =x""")
+    m.productionstring(name="increment", string="""
+    =g>
+    isa countFrom
+    count =x
+    end ~=x
+    =retrieval>
+    isa countOrder
+    first =x
+    second =y
+    ==>
+    =g>
+    isa countFrom
+    count =y
+    +retrieval>
+    isa countOrder
+    first =y""")
+    return m
+
+def plain_counting_factory(noise=0.3):
+    """
+    Counting model created without a random generator, used to test batch runs.
+    """
+    return counting_factory(noise)
+
+def slow_counting_factory(noise=0.3, rng=None):
+    """
+    Counting model that takes a while to create, used to test that batch runs can be stopped early.
+    """
+    time.sleep(0.2)
+    return counting_factory(noise, rng)
+
+class TestBatch(unittest.TestCase):
+    """
+    Testing batch runs of models.
+    """
+
+    def test_inprocess(self):
+        warnings.simplefilter("ignore")
+        results = list(actr.run_batch(counting_factory, params={"noise": [0.1, 0.5]}, seeds=3, outputs=("retrievals", "events"), workers=0, seed=7))
+        self.assertEqual([x.index for x in results], list(range(6)))
+        self.assertEqual([x.params["noise"] for x in results], [0.1]*3 + [0.5]*3)
+        self.assertEqual(len(set(x.seed for x in results)), 6)
+        for result in results:
+            self.assertIsNone(result.rts)
+            self.assertEqual(result.retrievals[0][1], "retrieval")
+            self.assertIn("countOrder", result.retrievals[0][2])
+        again = list(actr.run_batch(counting_factory, params={"noise": [0.1, 0.5]}, seeds=3, outputs=("retrievals", "events"), workers=0, seed=7))
+        self.assertEqual(results, again)
+
+    def test_workers(self):
+        warnings.simplefilter("ignore")
+        inprocess = list(actr.run_batch(counting_factory, seeds=[1, 2, 3], outputs=("events",), workers=0))
+        pooled = sorted(actr.run_batch(counting_factory, seeds=[1, 2, 3], outputs=("events",), workers=2), key=lambda x: x.index)
+        self.assertEqual(inprocess, pooled)
+        self.assertNotEqual(inprocess[0].events, inprocess[1].events)
+
+    def test_close(self):
+        warnings.simplefilter("ignore")
+        start = time.perf_counter()
+        results = actr.run_batch(slow_counting_factory, seeds=40, workers=1)
+        first = next(results)
+        results.close() #the remaining runs (8 s in total) are cancelled, not waited for
+        self.assertIn(first.index, range(40))
+        self.assertLess(time.perf_counter() - start, 4)
+
+    def test_model_rng(self):
+        warnings.simplefilter("ignore")
+        passed = list(actr.run_batch(counting_factory, seeds=[1, 2], workers=0))
+        np.random.seed(0)
+        assigned = list(actr.run_batch(plain_counting_factory, seeds=[1, 2], workers=0)) #the generator is assigned to the model, the global generator is not used
+        self.assertEqual([x.events for x in passed], [x.events for x in assigned])
+
+    def test_unknown_output(self):
+        with self.assertRaises(util.ACTRError):
+            list(actr.run_batch(counting_factory, outputs=("latencies",), workers=0))
+
+class TestModelRng(unittest.TestCase):
+    """
+    Testing the random generator of models.
+    """
+
+    def run_model(self, rng):
+        m = counting_factory(noise=0.5, rng=rng)
+        sim = m.simulation(trace=False)
+        sim.run(1)
+        return m.retrieval.activation
+
+    def test_seeded(self):
+        warnings.simplefilter("ignore")
+        np.random.seed(1)
+        first = self.run_model(5)
+        np.random.seed(2)
+        second = self.run_model(np.random.default_rng(5))
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, self.run_model(6))
+
+    def test_global_seed(self):
+        warnings.simplefilter("ignore")
+        np.random.seed(3)
+        first = self.run_model(None)
+        np.random.seed(3)
+        self.assertEqual(first, self.run_model(None))
+
+    def test_global_stream(self):
+        warnings.simplefilter("ignore")
+        np.random.seed(4)
+        expected = np.random.random()
+        np.random.seed(4)
+        m = counting_factory(noise=0)
+        m.simulation(trace=False).run(1)
+        self.assertEqual(np.random.random(), expected) #models without noise do not draw from the global generator
+        with self.assertRaises(TypeError):
+            actr.ACTRModel(None, 5)
+
+    def test_batched_noise(self):
+        rng = np.random.default_rng(0)
+        noise = util.calculate_instantaneous_noise(0.5, rng, 1000)
+        self.assertEqual(noise.shape, (1000,))
+        self.assertAlmostEqual(np.var(noise), math.pi**2/3*0.25, delta=0.1)
+        self.assertTrue(np.array_equal(util.calculate_instantaneous_noise(0, rng, 3), np.zeros(3)))
+        self.assertEqual(util.calculate_instantaneous_noise(0), 0)
+
+    def test_reseeding(self):
+        warnings.simplefilter("ignore")
+        m = counting_factory(noise=0.5, rng=0)
+        snapshot = m.snapshot()
+        activations = []
+        for _ in range(2):
+            m.restore(snapshot)
+            m.rng = np.random.default_rng(1)
+            m.simulation(trace=False).run(0.06)
+            activations.append(m.retrieval.activation)
+        self.assertEqual(activations[0], activations[1])
+        own = np.random.default_rng(2)
+        m.retrieval.rng = own
+        m.simulation(trace=False)
+        self.assertIs(m.retrieval.rng, own)
+        self.assertIs(m.goal.rng, m.rng)
+
+class TestStructuredEvents(unittest.TestCase):
+    """
+    Testing that actions of events are only rendered when asked for.
+    """
+
+    def test_retrieved(self):
+        warnings.simplefilter("ignore")
+        m = counting_factory(noise=0, rng=0)
+        sim = m.simulation(trace=False)
+        while True:
+            sim.step()
+            if sim.structured_event.proc == "retrieval" and isinstance(sim.structured_event.action, util.Action):
+                break
+        action = sim.structured_event.action
+        self.assertEqual(action.template, "RETRIEVED: {}")
+        self.assertIsInstance(action.objects[0], chunks.Chunk)
+        self.assertEqual(sim.current_event.action, "RETRIEVED: " + str(action.objects[0]))
+        self.assertIs(sim.current_event, sim.current_event)
+        self.assertEqual(sim.current_event.time, sim.structured_event.time)
+
+    def test_action(self):
+        self.assertEqual(str(util.Action("KEY PRESSED: {}", "J")), "KEY PRESSED: J")
+        self.assertEqual(util.Action("KEY PRESSED: {}", "J"), util.Action("KEY PRESSED: {}", "J"))
+        self.assertNotEqual(util.Action("KEY PRESSED: {}", "J"), "KEY PRESSED: J")
+
+class TestEventRecorder(unittest.TestCase):
+    """
+    Testing recording events into columns.
+    """
+
+    def setUp(self):
+        warnings.simplefilter("ignore")
+        self.recorder = actr.EventRecorder()
+        m = counting_factory(noise=0, rng=0)
+        self.dm = m.decmem
+        sim = m.simulation(trace=False, recorder=self.recorder)
+        sim.run(1)
+
+    def test_columns(self):
+        columns = self.recorder.columns()
+        self.assertEqual(set(columns), set(actr.EventRecorder.COLUMNS))
+        self.assertEqual(len(columns["time"]), len(self.recorder))
+        self.assertTrue(np.all(np.diff(columns["time"]) >= 0))
+        fired = columns["action"] == "RULE FIRED: increment"
+        self.assertTrue(np.any(fired))
+        self.assertTrue(np.all(columns["rule"][fired] == "increment"))
+        retrieved = columns["code"] == "RETRIEVED: {}"
+        self.assertEqual(len(columns["chunk"][retrieved]), 3)
+        for chunk_id, chunk, activation, latency in zip(columns["chunk_id"][retrieved], columns["chunk"][retrieved], columns["activation"][retrieved], columns["latency"][retrieved]):
+            self.assertEqual(str(list(self.dm)[chunk_id]), chunk)
+            self.assertAlmostEqual(latency, 0.1*math.exp(-activation))
+        self.assertTrue(np.all(columns["chunk_id"][~retrieved] == -1))
+        self.assertTrue(np.all(np.isnan(columns["latency"][~retrieved])))
+
+    def test_npz(self):
+        f = io.BytesIO()
+        self.recorder.save_npz(f)
+        f.seek(0)
+        loaded = np.load(f)
+        columns = self.recorder.columns()
+        self.assertTrue(np.array_equal(loaded["time"], columns["time"]))
+        self.assertEqual(list(loaded["action"]), list(columns["action"]))
+
+class TestRunUntil(unittest.TestCase):
+    """
+    Testing running simulations until a stop condition is met.
+    """
+
+    def simulation(self, recorder=None):
+        used_stim = {"bank": "0"}
+        text = []
+        for x in zip(used_stim.keys(), used_stim.values()):
+            text.append({1: {'text': x[0], 'position': (1366, 0), "vis_delay": 1}})
+            text.append({1: {'text': x[1], 'position': (1366, 0), "vis_delay": 1}})
+        trigger = list(used_stim.values())
+        environ = actr.Environment(size=(1366,768), focus_position=(0,0))
+        m = modeltests.Paired(environ, subsymbolic=True, baselevel_learning=True, latency_factor=0.4, decay=0.5, retrieval_threshold=-2, instantaneous_noise=0, strict_harvesting=True, emma_noise=False, automatic_visual_search=False, eye_mvt_angle_parameter=1, eye_mvt_scaling_parameter=0.05)
+        self.model = m.m
+        return m.m.simulation(trace=False, gui=False, environment_process=environ.environment_process, stimuli=2*text, triggers=4*trigger, times=5, start_time=0, recorder=recorder)
+
+    def test_key_pressed(self):
+        warnings.simplefilter("ignore")
+        sim = self.simulation()
+        while True:
+            sim.step()
+            if sim.current_event.action.startswith("KEY PRESSED"):
+                break
+        pressed = sim.current_event
+        sim = self.simulation()
+        event = sim.run(20, until=actr.simulation.key_pressed("0"))
+        self.assertEqual(str(event.action), "KEY PRESSED: 0")
+        self.assertEqual(event.time, pressed.time)
+        self.assertEqual(sim.show_time(), pressed.time)
+        self.assertIsNone(self.simulation().run(20, until=actr.simulation.key_pressed("J")))
+
+    def test_rule_and_buffer(self):
+        warnings.simplefilter("ignore")
+        sim = self.simulation()
+        event = sim.run(20, until=[actr.simulation.rule_fired("no_such_rule"), actr.simulation.rule_fired("attend_probe")])
+        self.assertEqual(str(event.action), "RULE FIRED: attend_probe")
+        self.assertEqual(event.time, 0.1)
+        sim = self.simulation()
+        event = sim.run(20, until=actr.simulation.buffer_contains(self.model.retrieval, actr.makechunk("", "pair", probe="bank")))
+        self.assertEqual(event.proc, "retrieval")
+        self.assertTrue(str(event.action).startswith("RETRIEVED"))
+
+    def test_deadlines(self):
+        warnings.simplefilter("ignore")
+        whole = actr.EventRecorder()
+        self.simulation(whole).run(20)
+        parts = actr.EventRecorder()
+        sim = self.simulation(parts)
+        event = sim.run(15, until=actr.simulation.key_pressed())
+        self.assertEqual(str(event.action), "KEY PRESSED: 0")
+        self.assertIsNone(sim.run(event.time + 0.5, until=actr.simulation.rule_fired("no_such_rule")))
+        self.assertEqual(sim.show_time(), event.time + 0.5)
+        sim.run(20) #the deadlines of earlier runs do not stop this one
+        self.assertEqual(sim.show_time(), 20)
+        self.assertEqual(list(whole.columns()["action"]), list(parts.columns()["action"]))
+
+    def test_buffer_variables(self):
+        warnings.simplefilter("ignore")
+        actr.chunktype("stopPair", "probe answer")
+        buffer = goals.Goal()
+        condition = actr.simulation.buffer_contains(buffer, actr.chunkstring(string="isa stopPair probe =x answer =x"))
+        results = []
+        for probe, answer in (("a", "b"), ("c", "c"), ("d", "e"), ("f", "f")):
+            buffer.discard(next(iter(buffer), None))
+            buffer.add(actr.makechunk("", "stopPair", probe=probe, answer=answer))
+            results.append(condition(None))
+        self.assertEqual(results, [False, True, False, True])
+
+    def test_continue(self):
+        warnings.simplefilter("ignore")
+        whole = actr.EventRecorder()
+        self.simulation(whole).run(20)
+        parts = actr.EventRecorder()
+        sim = self.simulation(parts)
+        self.assertIsNotNone(sim.run(20, until=actr.simulation.key_pressed()))
+        self.assertLess(sim.show_time(), 20)
+        sim.run(20)
+        self.assertEqual(list(whole.columns()["action"]), list(parts.columns()["action"]))
+        self.assertEqual(sim.show_time(), 20)
+
+class TestSnapshot(unittest.TestCase):
+    """
+    Testing snapshots of models.
+    """
+
+    def setUp(self):
+        warnings.simplefilter("ignore")
+        self.model = counting_factory(noise=0, rng=0)
+        self.model.simulation(trace=False).run(0.12)
+        self.snapshot = self.model.snapshot()
+        self.dm = {chunk: list(times) for chunk, times in self.model.decmem.items()}
+        self.goal = set(self.model.goal)
+
+    def continuation(self):
+        recorder = actr.EventRecorder()
+        self.model.simulation(trace=False, recorder=recorder, initial_time=0.12).run(1)
+        return list(recorder.columns()["action"])
+
+    def test_restore(self):
+        first = self.continuation()
+        self.assertNotEqual(set(self.model.goal), self.goal)
+        self.model.productions["increment"]["utility"] = 5
+        self.model.productionstring(name="extra", string="=g>\nisa countFrom\n==>\n~g>")
+        self.model.restore(self.snapshot)
+        self.assertEqual(self.model.productions["increment"]["utility"], 0)
+        self.assertEqual({chunk: list(times) for chunk, times in self.model.decmem.items()}, self.dm)
+        self.assertEqual(set(self.model.goal), self.goal)
+        self.assertEqual(set(self.model.productions), {"start", "increment"})
+        self.assertEqual(first, self.continuation())
+        self.model.restore(self.snapshot)
+        self.assertEqual(first, self.continuation())
+
+    def test_generator(self):
+        model = counting_factory(noise=0.5, rng=4)
+        snapshot = model.snapshot()
+        activations = []
+        for _ in range(2):
+            model.restore(snapshot)
+            model.simulation(trace=False).run(0.06)
+            activations.append(model.retrieval.activation)
+        self.assertEqual(activations[0], activations[1])
+        model.restore(snapshot, rng=False)
+        model.simulation(trace=False).run(0.06)
+        self.assertNotEqual(model.retrieval.activation, activations[0])
+
+    def test_module_states(self):
+        manual = motor.Motor()
+        manual.preparation = manual._BUSY
+        manual.last_key = ["J", 0.5]
+        state = manual.get_state()
+        manual.preparation = manual._FREE
+        manual.last_key = [None, 0]
+        manual.set_state(state)
+        self.assertEqual((manual.preparation, manual.last_key), (manual._BUSY, ["J", 0.5]))
+        visual = vision.Visual(actr.Environment(focus_position=(0, 0)))
+        visual.attend_automatic = False
+        visual.last_mvt = 0.3
+        state = visual.get_state()
+        visual.attend_automatic = True
+        visual.current_focus = [10, 10]
+        visual.set_state(state)
+        self.assertEqual((visual.attend_automatic, visual.last_mvt, visual.current_focus), (False, 0.3, [0, 0]))
+
+    def test_restored_motor(self):
+        buffers = self.model._ACTRModel__buffers
+        buffers["manual"].last_key = ["J", 0.1]
+        snapshot = self.model.snapshot()
+        self.model.simulation(trace=False)
+        self.assertEqual(buffers["manual"].last_key, [None, 0]) #simulations start with a new motor module
+        self.model.restore(snapshot)
+        self.model.simulation(trace=False)
+        self.assertEqual(buffers["manual"].last_key, ["J", 0.1]) #unless the module was restored from a snapshot
+        self.model.simulation(trace=False)
+        self.assertEqual(buffers["manual"].last_key, [None, 0])
+
+    def test_production_records(self):
+        self.model.productions["increment"]["reward"] = [1]
+        snapshot = self.model.snapshot()
+        self.model.productions["increment"]["reward"].append(2)
+        self.model.restore(snapshot)
+        self.assertEqual(self.model.productions["increment"]["reward"], [1])
+        self.model.productions["increment"]["reward"].append(3)
+        self.model.restore(snapshot)
+        self.assertEqual(self.model.productions["increment"]["reward"], [1])
+
+    def test_busy_warning(self):
+        self.model.retrieval.state = self.model.retrieval._BUSY
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            self.model.snapshot()
+        self.assertTrue(any("retrieval" in str(x.message) for x in caught))
+
+    def test_dm_copy(self):
+        dm = self.model.decmem
+        copy = dm.copy()
+        self.assertEqual(dict(copy), dict(dm))
+        chunk = actr.makechunk("", "countOrder", first=7, second=8)
+        copy.add(chunk, 0.5)
+        self.assertNotIn(chunk, dm)
+        self.assertEqual(copy.find_candidates(actr.makechunk("", "countOrder", first=7)), [chunk])
+        self.assertEqual(dm.find_candidates(actr.makechunk("", "countOrder", first=7)), [])
+        self.assertEqual(list(copy[chunk]), [0.5])
+
+class TestDecMemFile(unittest.TestCase):
+    """
+    Testing saving and loading of declarative memory.
+    """
+
+    def setUp(self):
+        warnings.simplefilter("ignore")
+        actr.chunktype("fileWord", "form meaning category")
+        actr.chunktype("filePair", "first second")
+        self.word = actr.makechunk("", "fileWord", form="dog", meaning="DOG", category="noun")
+        self.other = actr.makechunk("", "fileWord", form="run", category="verb")
+        self.pair = actr.makechunk("", "filePair", first=self.word, second="x~y")
+        self.dm = declarative.DecMem()
+        self.dm.add(self.word, [0, 1.5])
+        self.dm.add(self.other, 2)
+        self.dm.add(self.pair, 3)
+        self.dm.add_activation(self.other, 0.7)
+        self.directory = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.directory.name, "dm.bin")
+        self.dm.save(self.file)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_roundtrip(self):
+        for mmap in (True, False):
+            dm = declarative.DecMem.load(self.file, mmap=mmap)
+            self.assertEqual(list(dm), list(self.dm))
+            self.assertEqual({chunk: list(times) for chunk, times in dm.items()}, {chunk: list(times) for chunk, times in self.dm.items()})
+            self.assertEqual(dm.activations, {self.other: 0.7})
+            self.assertEqual(dm.fan("dog"), 1)
+            self.assertEqual(dm.find_candidates(actr.makechunk("", "fileWord", category="noun")), [self.word])
+            times, lengths = dm._times.gather([0, 1, 2])
+            self.assertEqual(list(times), [0, 1.5, 2, 3])
+
+    def test_add_after_mmap(self):
+        dm = declarative.DecMem.load(self.file)
+        dm.add(self.word, 5)
+        dm.add(actr.makechunk("", "fileWord", form="cat"), 6)
+        self.assertEqual(list(dm[self.word]), [0, 1.5, 5])
+        self.assertEqual(list(dm._times.gather([0, 3])[0]), [0, 1.5, 5, 6])
+        self.assertEqual(list(declarative.DecMem.load(self.file)[self.word]), [0, 1.5])
+
+    def test_not_dm_file(self):
+        with open(self.file, "wb") as f:
+            f.write(b"something else")
+        self.assertRaises(util.ACTRError, declarative.DecMem.load, self.file)
+
+    def test_version1(self):
+        #the memory of setUp in the version 1 of the format: chunks as rows of value ids, without index and summaries of times
+        arrays = {"chunk_types": np.array([0, 0, 1], dtype=np.int32),
+                  "slot_values": np.array([0, 1, 2, 3, -1, 4, 5, 6], dtype=np.int64),
+                  "value_kinds": np.array([0, 0, 0, 0, 0, 1, 0], dtype=np.int8),
+                  "value_offsets": np.array([0, 3, 6, 10, 13, 17, 18, 21], dtype=np.int64),
+                  "value_bytes": np.frombuffer(b"dogDOGnounrunverb0x~y", dtype=np.uint8),
+                  "dm_chunks": np.array([0, 1, 2], dtype=np.int64),
+                  "time_offsets": np.array([0, 2, 3, 4], dtype=np.int64),
+                  "times": np.array([0, 1.5, 2, 3]),
+                  "activations": np.array([np.nan, 0.7, np.nan])}
+        storage.write(self.file, {"version": 1, "use_index": True, "types": [["fileWord", ["form", "meaning", "category"]], ["filePair", ["first", "second"]]]}, arrays)
+        for mmap in (True, False):
+            dm = declarative.DecMem.load(self.file, mmap=mmap)
+            self.assertEqual(list(dm), list(self.dm))
+            self.assertEqual({chunk: list(times) for chunk, times in dm.items()}, {chunk: list(times) for chunk, times in self.dm.items()})
+            self.assertEqual(dm.activations, {self.other: 0.7})
+            self.assertEqual(dm.find_candidates(actr.makechunk("", "fileWord", category="noun")), [self.word])
+            dm.add(self.word, 5)
+            self.assertEqual(list(dm[self.word]), [0, 1.5, 5])
+        dm.save(self.file)
+        self.assertEqual(list(declarative.DecMem.load(self.file)), list(self.dm))
+
+    def test_unknown_version(self):
+        storage.write(self.file, {"version": 3}, {})
+        self.assertRaises(util.ACTRError, declarative.DecMem.load, self.file)
+
+class TestSharedPresentationTimes(unittest.TestCase):
+    """
+    Testing presentation times shared from a file with private overlays.
+    """
+
+    def setUp(self):
+        warnings.simplefilter("ignore")
+        actr.chunktype("sharedWord", "form")
+        self.words = [actr.makechunk("", "sharedWord", form=str(i)) for i in range(4)]
+        dm = declarative.DecMem()
+        for i, word in enumerate(self.words):
+            dm.add(word, [i, i+0.5])
+        self.directory = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.directory.name, "dm.bin")
+        dm.save(self.file)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_overlay(self):
+        first = declarative.DecMem.load(self.file)
+        second = declarative.DecMem.load(self.file)
+        self.assertEqual(first._times.private, 0)
+        first.add(self.words[1], 7)
+        first.add(actr.makechunk("", "sharedWord", form="new"), 8)
+        self.assertEqual(first._times.private, 4)
+        self.assertFalse(first._times.base.flags.writeable)
+        self.assertEqual(list(first._times.gather([0, 1, 4])[0]), [0, 0.5, 1, 1.5, 7, 8])
+        self.assertEqual(list(second._times.gather([0, 1])[0]), [0, 0.5, 1, 1.5])
+        self.assertEqual(list(second[self.words[1]]), [1, 1.5])
+
+    def test_copy_shares_base(self):
+        dm = declarative.DecMem.load(self.file)
+        copy = dm.copy()
+        self.assertIs(copy._times.base, dm._times.base)
+        copy.add(self.words[0], 9)
+        self.assertEqual(list(dm._times[0]), [0, 0.5])
+        self.assertEqual(list(copy._times[0]), [0, 0.5, 9])
+
+    def test_shared_rows(self):
+        dm = declarative.DecMem.load(self.file)
+        self.assertEqual(dm._times.lengths.split, 4)
+        self.assertFalse(dm._times.lengths.stored.flags.owndata)
+        copy = dm.copy()
+        self.assertIs(copy._times.offsets.stored, dm._times.offsets.stored)
+        copy.add(self.words[2], 9)
+        self.assertIsNot(copy._times.offsets.stored, dm._times.offsets.stored)
+        self.assertEqual(list(dm[self.words[2]]), [2, 2.5])
+        self.assertEqual(list(copy[self.words[2]]), [2, 2.5, 9])
+        self.assertEqual(list(declarative.DecMem.load(self.file)[self.words[2]]), [2, 2.5])
+
+    def test_reallocation(self):
+        dm = declarative.DecMem.load(self.file)
+        for time in range(10, 50):
+            dm.add(self.words[time % 4], time)
+        for i, word in enumerate(self.words):
+            self.assertEqual(list(dm._times[i]), list(dm[word]))
+        self.assertEqual(dm._times.private, 48)
+
+class TestFastChunks(unittest.TestCase):
+    """
+    Testing chunks created from plain values.
+    """
+
+    def setUp(self):
+        warnings.simplefilter("ignore")
+        actr.chunktype("fastWord", "form meaning category")
+
+    def test_from_values(self):
+        chunk = actr.makechunk("", "fastWord", form="dog", category="noun")
+        self.assertEqual(chunks.Chunk.from_values("fastWord", {"form": "dog", "category": "noun"}), chunk)
+        fast = chunks.Chunk.from_values("fastWord", ("noun", "dog", None))
+        self.assertEqual(hash(fast), hash(chunk))
+        self.assertEqual(str(fast), str(chunk))
+        self.assertTrue(chunk <= fast and fast <= chunk)
+        nested = actr.makechunk("", "fastWord", form=chunk, meaning=2)
+        self.assertEqual(chunks.Chunk.from_values("fastWord", {"form": fast, "meaning": 2}), nested)
+
+    def test_from_values_errors(self):
+        self.assertRaises(util.ACTRError, chunks.Chunk.from_values, "fastWord", ("dog",))
+        self.assertRaises(util.ACTRError, chunks.Chunk.from_values, "fastUndefined", ("dog",))
+
+    def test_load_rows(self):
+        dm = declarative.DecMem()
+        dm.load_rows("fastWord", [("noun", "dog", "DOG"), {"form": "run", "category": "verb"}, ("noun", "dog", "DOG")], time=[0, 1, 2])
+        self.assertEqual(len(dm), 2)
+        dog = actr.makechunk("", "fastWord", form="dog", meaning="DOG", category="noun")
+        self.assertEqual(list(dm[dog]), [0, 2])
+        self.assertEqual(dm.find_candidates(actr.makechunk("", "fastWord", category="verb")), [actr.makechunk("", "fastWord", form="run", category="verb")])
+        self.assertEqual(dm.fan("dog"), 1)
+
+class TestVarvalSplitting(unittest.TestCase):
+    """
+    Testing splitting of strings into values and variables.
+    """
+
+    def test_splitting(self):
+        self.assertEqual(util.varvalsplitting("=x~=y!2~!3~!4"), util.VarvalClass(values="2", variables="x", negvalues=("3", "4"), negvariables=("y",)))
+        self.assertEqual(util.varvalsplitting("word"), util.VarvalClass(values="word", variables=None, negvalues=(), negvariables=()))
+        self.assertEqual(util.varvalsplitting("~x"), util.VarvalClass(values="~x", variables=None, negvalues=(), negvariables=()))
+        self.assertEqual(util.varvalsplitting("=x~!y"), util.VarvalClass(values=None, variables="x", negvalues=("y",), negvariables=()))
+        self.assertIs(util.varvalsplitting("=x~!y"), util.varvalsplitting("=x~!y"))
+
+    def test_stringsplitting(self):
+        self.assertEqual(util.stringsplitting("=x~=y!2"), {"variables": {"x"}, "values": {"2"}, "negvariables": {"y"}, "negvalues": set()})
+
+    def test_errors(self):
+        self.assertRaises(util.ACTRError, util.varvalsplitting, "!a!b")
+        self.assertRaises(util.ACTRError, util.varvalsplitting, "=a=b")
+        self.assertEqual(util.varvalsplitting("!a!a").values, "a")
+
+    def test_malformed(self):
+        for malformed in ("==", "a=!", "!!", "!=", "=a=b"):
+            self.assertRaises(util.ACTRError, util.varvalsplitting, malformed)
+        self.assertRaises(util.ACTRError, actr.makechunk, "", "malformedChunk", slot="a=!")
+
+    def test_punctuation(self):
+        self.assertEqual(util.varvalsplitting("!"), util.VarvalClass(values="", variables=None, negvalues=(), negvariables=()))
+        self.assertEqual(util.varvalsplitting("="), util.VarvalClass(values=None, variables="", negvalues=(), negvariables=()))
+        self.assertEqual(util.varvalsplitting("=x!"), util.VarvalClass(values="", variables="x", negvalues=(), negvariables=()))
+        self.assertEqual(util.varvalsplitting("x~!"), util.VarvalClass(values=None, variables=None, negvalues=("",), negvariables=()))
+        self.assertEqual(util.varvalsplitting("~"), util.VarvalClass(values="~", variables=None, negvalues=(), negvariables=()))
+        self.assertEqual(str(actr.makechunk("", "punctuationWord", form="!")), "punctuationWord(form= )")
+
+class TestParseCache(unittest.TestCase):
+    """
+    Testing reuse of grammars and parsed strings.
+    """
+
+    def setUp(self):
+        warnings.simplefilter("ignore")
+        actr.chunktype("parsedGoal", "state count")
+        self.rule = "=g>\nisa parsedGoal\nstate start\ncount =x\n==>\n=g>\nisa parsedGoal\nstate =x"
+
+    def test_grammars_built_once(self):
+        self.assertIs(util.getchunk(), util.getchunk())
+        self.assertIs(util.getrule(), util.getrule())
+
+    def test_cached_parse(self):
+        self.assertIs(util.parse_rulestring(self.rule), util.parse_rulestring(self.rule))
+        first = actr.chunkstring(string="isa parsedGoal state start count 1")
+        second = actr.chunkstring(string="isa parsedGoal state start count 1")
+        self.assertEqual(first, second)
+
+    def test_models_share_rules(self):
+        models = [actr.ACTRModel() for _ in range(2)]
+        for model in models:
+            model.productionstring(name="r", string=self.rule)
+        lhs = [next(model.productions["r"]["rule"]()) for model in models]
+        self.assertEqual(lhs[0], lhs[1])
+        self.assertIsNot(lhs[0]["=g"], lhs[1]["=g"])
+
+    def test_parse_error(self):
+        self.assertRaises(util.ACTRError, actr.ACTRModel().productionstring, name="bad", string="=g> isa parsedGoal")
+
+class TestVectorizedPartialMatching(unittest.TestCase):
+    """
+    Testing partial matching of all chunks in one pass.
+    """
+
+    def setUp(self):
+        warnings.simplefilter("ignore")
+        actr.chunktype("pmItem", "form category")
+        actr.chunktype("pmOther", "form")
+        self.dm = declarative.DecMem()
+        self.items = [actr.makechunk("", "pmItem", form="a", category="x"),
+                      actr.makechunk("", "pmItem", form="b", category="x"),
+                      actr.makechunk("", "pmItem", form="c"),
+                      actr.makechunk("", "pmOther", form="b")]
+        self.items.append(actr.makechunk("", "pmItem", form=self.items[0], category="y"))
+        for item in self.items:
+            self.dm.add(item, 0)
+        self.similarities = chunks.Chunk._similarities
+        chunks.Chunk._similarities = {("b", "a"): -0.3, ("a", "b"): -0.3, (None, "x"): -0.1}
+
+    def tearDown(self):
+        chunks.Chunk._similarities = self.similarities
+
+    def test_against_match(self):
+        for request in (actr.makechunk("", "pmItem", form="a", category="x"),
+                        actr.makechunk("", "pmItem", form=self.items[0]),
+                        actr.makechunk("", "pmItem", form="d", category="y")):
+            expected = [request.match(item, partialmatching=True, mismatch_penalty=2) for item in self.items]
+            self.assertEqual(list(self.dm.partial_matching(self.items, request, mismatch_penalty=2)), expected)
+
+    def test_variables(self):
+        request = actr.makechunk("", "pmItem", form="=x", category="=x")
+        self.assertIsNone(self.dm.partial_matching(self.items, request))
+
+    def test_copy(self):
+        copy = self.dm.copy()
+        new = actr.makechunk("", "pmItem", form="a", category="z")
+        copy.add(new, 0)
+        request = actr.makechunk("", "pmItem", form="a", category="z")
+        self.assertEqual(list(copy.partial_matching([self.items[0], new], request)), [-1, 0])
+
+class TestRetrievalProbabilities(unittest.TestCase):
+    """
+    Testing analytic retrieval probabilities.
+    """
+
+    def setUp(self):
+        warnings.simplefilter("ignore")
+        actr.chunktype("probFact", "item value")
+        self.model = actr.ACTRModel(subsymbolic=True, instantaneous_noise=0.4, retrieval_threshold=-0.5, rng=3)
+        self.strong = actr.makechunk("", "probFact", item="x", value="1")
+        self.weak = actr.makechunk("", "probFact", item="x", value="2")
+        self.model.decmem.add(self.strong, [0, 2, 4])
+        self.model.decmem.add(self.weak, [1])
+        self.model.decmem.add(actr.makechunk("", "probFact", item="y", value="3"), [0])
+        self.request = actr.makechunk("", "probFact", item="x")
+
+    def test_probabilities(self):
+        result = self.model.retrieval_probabilities(self.request, time=5)
+        self.assertEqual(result.chunks, [self.strong, self.weak])
+        self.assertAlmostEqual(sum(result.probabilities) + result.failure, 1)
+        self.assertAlmostEqual(result.failure, 0.02896, places=4)
+        self.assertAlmostEqual(result.probabilities[0], 0.89547, places=4)
+
+    def test_against_simulation(self):
+        result = self.model.retrieval_probabilities(self.request, time=5)
+        retrieval = self.model.retrieval
+        counts = collections.Counter(retrieval.retrieve(5, self.request, {}, {}, {}, self.model.model_parameters)[0] for _ in range(4000))
+        self.assertAlmostEqual(counts[self.strong] / 4000, result.probabilities[0], delta=0.03)
+        self.assertAlmostEqual(counts[None] / 4000, result.failure, delta=0.02)
+
+    def test_no_noise(self):
+        self.model.model_parameters["instantaneous_noise"] = 0
+        result = self.model.retrieval_probabilities(self.request, time=5)
+        self.assertEqual(list(result.probabilities), [1, 0])
+        self.assertEqual(result.failure, 0)
+        self.assertAlmostEqual(result.latency, 0.1 * math.exp(-float(self.model.decmem.baselevel_activations([self.strong], 5, True, 0.5)[0][0])))
+        self.model.model_parameters["retrieval_threshold"] = 2
+        self.assertEqual(self.model.retrieval_probabilities(self.request, time=5).failure, 1)
+
+    def test_symbolic(self):
+        self.model.model_parameters["subsymbolic"] = False
+        self.assertRaises(util.ACTRError, self.model.retrieval_probabilities, self.request)
+
+class TestBlending(unittest.TestCase):
+    """
+    Testing blended retrievals.
+    """
+
+    def setUp(self):
+        warnings.simplefilter("ignore")
+        actr.chunktype("blendInstance", "situation outcome size")
+        self.model = actr.ACTRModel(subsymbolic=True, instantaneous_noise=0, blending_temperature=0.5, retrieval_threshold=-5, rng=1)
+        self.blending = self.model.set_blending("blend")
+        for outcome, size, times in (("10", "small", [0]), ("20", "large", [0, 1, 2]), ("30", "medium", [1])):
+            self.model.decmem.add(actr.makechunk("", "blendInstance", situation="s", outcome=outcome, size=size), times)
+        self.model.decmem.add(actr.makechunk("", "blendInstance", situation="t", outcome="100"), [0])
+        self.model.set_similarities("small", "medium", -0.2)
+        self.model.set_similarities("medium", "large", -0.2)
+        self.request = actr.makechunk("", "blendInstance", situation="s")
+        activations = np.log([sum((3.05 - t)**-0.5 for t in times) for times in ([0], [0, 1, 2], [1])]) #base-level activations when the rule fires
+        self.weights = np.exp(activations / 0.5) / np.exp(activations / 0.5).sum()
+
+    def run_model(self):
+        self.model.productionstring(name="ask", string="=g>\nisa blendInstance\nsituation s\n==>\n+blend>\nisa blendInstance\nsituation s\n~g>")
+        self.model.goal.add(actr.makechunk("", "blendInstance", situation="s"))
+        recorder = actr.EventRecorder()
+        self.model.simulation(trace=False, recorder=recorder, initial_time=3).run(4)
+        return recorder.columns()
+
+    def test_blend(self):
+        columns = self.run_model()
+        self.assertEqual(len([chunk for chunk in columns["chunk"] if chunk]), 1)
+        blended = list(self.blending)[0]
+        self.assertEqual(blended.situation.values, "s")
+        self.assertAlmostEqual(float(blended.outcome.values), float(self.weights @ [10, 20, 30]))
+        self.assertEqual(blended.size.values, "medium")
+
+    def test_blend_integers(self):
+        self.blending.dm = self.model.decmem
+        for outcome, times in (("3", [0]), (3, [1])):
+            self.model.decmem.add(actr.makechunk("", "blendInstance", situation="u", outcome=outcome), times)
+        blended, _ = self.blending.retrieve(3, actr.makechunk("", "blendInstance", situation="u"), {}, {}, {}, self.model.model_parameters)
+        self.assertEqual(blended.outcome.values, "3")
+        self.model.decmem.add(actr.makechunk("", "blendInstance", situation="v", outcome="3.0"), [0])
+        blended, _ = self.blending.retrieve(3, actr.makechunk("", "blendInstance", situation="v"), {}, {}, {}, self.model.model_parameters)
+        self.assertEqual(blended.outcome.values, "3.0")
+
+    def test_no_match(self):
+        self.model.model_parameters["retrieval_threshold"] = 5
+        self.blending.dm = self.model.decmem
+        chunk, latency = self.blending.retrieve(3, self.request, {}, {}, {}, self.model.model_parameters)
+        self.assertIsNone(chunk)
+        self.assertAlmostEqual(latency, 0.1 * math.exp(-5))
+
+    def test_negated_request(self):
+        self.blending.dm = self.model.decmem
+        request = actr.chunkstring(string="isa blendInstance situation s size ~small")
+        blended, _ = self.blending.retrieve(3.05, request, {}, {}, {}, self.model.model_parameters)
+        weights = self.weights[1:] / self.weights[1:].sum()
+        self.assertAlmostEqual(float(blended.outcome.values), float(weights @ [20, 30]))
+        self.assertIn(blended.size.values, ("large", "medium"))
+        self.assertEqual(blended.size.negvalues, ())
+        self.assertEqual(blended.situation.values, "s")
+
+    def test_symbolic(self):
+        self.model.model_parameters["subsymbolic"] = False
+        self.blending.dm = self.model.decmem
+        self.assertRaises(util.ACTRError, self.blending.retrieve, 3, self.request, {}, {}, {}, self.model.model_parameters)
+
+class TestGrowingPresentationTimes(unittest.TestCase):
+    """
+    Testing presentation times appended in place.
+    """
+
+    def setUp(self):
+        warnings.simplefilter("ignore")
+        actr.chunktype("growingWord", "form")
+        self.words = [actr.makechunk("", "growingWord", form=str(i)) for i in range(3)]
+        self.dm = declarative.DecMem()
+
+    def test_appending(self):
+        expected = {word: [] for word in self.words}
+        for time in range(300):
+            word = self.words[time % 3]
+            self.dm.add(word, time)
+            expected[word].append(time)
+        for word in self.words:
+            self.assertEqual(list(self.dm[word]), expected[word])
+        self.assertEqual(self.dm._times.private, 300)
+        self.assertLess(len(self.dm._times.flat), 2000)
+
+    def test_in_place(self):
+        self.dm.add(self.words[0], [0, 1])
+        self.dm.add(self.words[0], 2)
+        offset = self.dm._times.offsets[0]
+        self.dm.add(self.words[0], 3)
+        self.assertEqual(self.dm._times.offsets[0], offset)
+        self.assertEqual(list(self.dm[self.words[0]]), [0, 1, 2, 3])
+
+    def test_read_only(self):
+        self.dm.add(self.words[0], 1)
+        self.assertRaises(ValueError, self.dm[self.words[0]].__setitem__, 0, 5)
+        self.assertEqual(util.baselevel_learning(2, self.dm[self.words[0]], True, 0.5), 0)
+
+    def test_replace_and_copy(self):
+        self.dm.add(self.words[0], [0, 1, 2])
+        copy = self.dm.copy()
+        self.dm[self.words[0]] = 4
+        copy.add(self.words[0], 5)
+        self.assertEqual(list(self.dm[self.words[0]]), [4])
+        self.assertEqual(list(copy[self.words[0]]), [0, 1, 2, 5])
+        del self.dm[self.words[0]]
+        self.assertEqual(self.dm._times.private, 0)
+
+class TestRecentTraces(unittest.TestCase):
+    """
+    Testing bounded presentation times with the hybrid approximation of base-level learning.
+    """
+
+    def setUp(self):
+        warnings.simplefilter("ignore")
+        actr.chunktype("tracedWord", "form")
+        self.word = actr.makechunk("", "tracedWord", form="dog")
+        self.other = actr.makechunk("", "tracedWord", form="cat")
+
+    def test_summaries(self):
+        dm = declarative.DecMem()
+        dm.recent_traces = 3
+        for time in range(1, 101):
+            dm.add(self.word, time)
+        dm.add(self.other, 50)
+        self.assertEqual(list(dm[self.word]), [98, 99, 100])
+        self.assertEqual(list(dm[self.other]), [50])
+        self.assertEqual([list(x) for x in dm._times.summaries([0, 1])], [[97, 0], [1, 0]])
+        self.assertLess(len(dm._times.flat), 100)
+        self.assertRaises(util.ACTRError, setattr, dm, "recent_traces", 0)
+
+    def test_approximation(self):
+        times = np.arange(1, 101, dtype=float)
+        exact = declarative.DecMem()
+        exact.add(self.word, times)
+        bounded = exact.copy()
+        bounded.recent_traces = 1
+        self.assertEqual(list(exact[self.word]), list(times))
+        self.assertEqual(list(bounded[self.word]), [100])
+        B_exact = exact.baselevel_activations([self.word], 102, True, 0.5)[0][0]
+        B_bounded = bounded.baselevel_activations([self.word], 102, True, 0.5)[0][0]
+        t_n, t_k = 101, 2
+        self.assertAlmostEqual(B_bounded, math.log(t_k**-0.5 + 99*(t_n**0.5 - t_k**0.5)/(0.5*(t_n-t_k))))
+        self.assertAlmostEqual(B_bounded, B_exact, delta=0.02)
+        self.assertAlmostEqual(bounded.baselevel_activations([self.word], 102, True, 0.5, optimized_learning=True)[0][0], exact.baselevel_activations([self.word], 102, True, 0.5, optimized_learning=True)[0][0])
+
+    def test_save_and_load(self):
+        dm = declarative.DecMem()
+        dm.recent_traces = 2
+        dm.add(self.word, [1, 2, 3, 4])
+        with tempfile.TemporaryDirectory() as directory:
+            file = os.path.join(directory, "dm.bin")
+            dm.save(file)
+            loaded = declarative.DecMem.load(file)
+        self.assertEqual(loaded.recent_traces, 2)
+        self.assertEqual(list(loaded[self.word]), [3, 4])
+        self.assertEqual(loaded.baselevel_activations([self.word], 6, True, 0.5)[0][0], dm.baselevel_activations([self.word], 6, True, 0.5)[0][0])
+        loaded.add(self.word, 5)
+        self.assertEqual(list(loaded[self.word]), [4, 5])
+        self.assertEqual(list(loaded._times.summaries([0])[0]), [3])
+
+    def test_order(self):
+        dm = declarative.DecMem()
+        dm.recent_traces = 2
+        dm.add(self.word, [5, 3])
+        self.assertEqual(list(dm[self.word]), [3, 5])
+        dm.add(self.word, 4)
+        self.assertEqual(list(dm[self.word]), [4, 5])
+        dm.add(self.word, 1)
+        self.assertEqual(list(dm[self.word]), [4, 5])
+        self.assertEqual([list(x) for x in dm._times.summaries([0])], [[2], [1]])
+        self.assertEqual(dm.creation_time(self.word), 1)
+        unsorted = declarative.DecMem()
+        unsorted.add(self.other, [2, 1])
+        self.assertEqual(list(unsorted[self.other]), [2, 1])
+        unsorted.recent_traces = 3
+        self.assertEqual(list(unsorted[self.other]), [1, 2])
+
+    def test_symbolic_retrieval(self):
+        dm = declarative.DecMem()
+        dm.recent_traces = 1
+        for time in (0, 1, 2):
+            dm.add(self.word, time)
+        retrieval = declarative.DecMemBuffer(dm)
+        retrieved = retrieval.retrieve(2, actr.makechunk("", "tracedWord", form="dog"), {}, {}, {}, actr.ACTRModel.MODEL_PARAMETERS)[0]
+        self.assertEqual(retrieved, self.word)
+        dm.add(self.other, 2)
+        self.assertIsNone(retrieval.retrieve(2, actr.makechunk("", "tracedWord", form="cat"), {}, {}, {}, actr.ACTRModel.MODEL_PARAMETERS)[0])
+
+    def test_model_parameter(self):
+        m = actr.ACTRModel(subsymbolic=True, baselevel_traces=2)
+        m.decmem.add(self.word, [0, 0.1, 0.2])
+        m.simulation(trace=False, gui=False)
+        self.assertEqual(m.decmem.recent_traces, 2)
+        self.assertEqual(list(m.decmem[self.word]), [0.1, 0.2])
+
+class TestSharedValues(unittest.TestCase):
+    """
+    Test that values shared across chunks are kept in bounded tables.
+    """
+
+    def setUp(self):
+        actr.chunktype("sharedWord", "form meaning")
+
+    def test_equal_values(self):
+        chunk1 = actr.makechunk("", "sharedWord", form="dog", meaning="animal")
+        chunk2 = actr.chunkstring(string="isa sharedWord form dog meaning animal")
+        self.assertEqual(chunk1, chunk2)
+        self.assertIs(chunk1.actrchunk.form_, chunk2.actrchunk.form_)
+
+    def test_bounded(self):
+        n = chunks._shared.cache_info().maxsize + 100
+        dm = declarative.DecMem()
+        for i in range(n):
+            dm.add(actr.makechunk("", "sharedWord", form="form%s" % i, meaning="meaning%s" % i))
+        self.assertEqual(len(dm), n)
+        self.assertLessEqual(chunks._shared.cache_info().currsize, chunks._shared.cache_info().maxsize)
+        self.assertLessEqual(util.varvalsplitting.cache_info().currsize, util.varvalsplitting.cache_info().maxsize)
+
+    def test_slotnames(self):
+        chunk = actr.makechunk("", "sharedWord", form="dog")
+        self.assertEqual(type(chunk.actrchunk)._slotnames, ("form", "meaning"))
+        self.assertEqual([slot for slot, _ in chunk], ["form", "meaning"])
+
+class TestLargePostings(unittest.TestCase):
+    """
+    Test the index of declarative memory when many chunks carry the same value.
+    """
+
+    def setUp(self):
+        chunks.chunktype("posted", "word, category")
+        self.dm = declarative.DecMem()
+        self.words = [chunks.makechunk("", "posted", word="w%s" % i, category="noun" if i % 2 else "verb") for i in range(40)]
+        for word in self.words:
+            self.dm.add(word, 0)
+
+    def test_candidates(self):
+        request = chunks.chunkstring(string="isa posted category noun")
+        self.assertEqual(self.dm.find_candidates(request), self.words[1::2])
+        request = chunks.chunkstring(string="isa posted category noun word w7")
+        self.assertEqual(self.dm.find_candidates(request), [self.words[7]])
+        request = chunks.chunkstring(string="isa posted category verb word w7")
+        self.assertEqual(self.dm.find_candidates(request), [])
+
+    def test_removal(self):
+        copied = self.dm.copy()
+        del self.dm[self.words[3]]
+        del self.dm[self.words[4]]
+        request = chunks.chunkstring(string="isa posted category noun")
+        self.assertEqual(self.dm.find_candidates(request), self.words[1:3:2] + self.words[5::2])
+        self.assertEqual(self.dm.fan("noun"), 19)
+        self.assertEqual(self.dm.fan("w3"), 0)
+        self.assertEqual(copied.fan("noun", "category"), 20)
+        self.assertEqual(copied.find_candidates(request), self.words[1::2])
+        self.dm.add(self.words[3], 1)
+        self.assertEqual(self.dm.find_candidates(request)[-1], self.words[3])
+
+class TestStoredRows(unittest.TestCase):
+    """
+    Testing memories loaded from files, whose chunks are created only when needed.
+    """
+
+    def setUp(self):
+        warnings.simplefilter("ignore")
+        actr.chunktype("storedWord", "form meaning category")
+        actr.chunktype("storedPair", "first second")
+        self.words = [actr.makechunk("", "storedWord", form="w%s" % i, meaning="m%s" % (i % 5), category="noun" if i % 2 else "verb") for i in range(30)]
+        self.pair = actr.makechunk("", "storedPair", first=self.words[3], second="x~y")
+        self.dm = declarative.DecMem()
+        for i, word in enumerate(self.words):
+            self.dm.add(word, i)
+        self.dm.add(self.pair, 1)
+        self.directory = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.directory.name, "dm.bin")
+        self.dm.save(self.file)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_lazy(self):
+        dm = declarative.DecMem.load(self.file)
+        self.assertEqual(len(dm), 31)
+        self.assertEqual(dm._unbuilt, 30) #the pair carries a chunk, so it is kept as an object on loading
+        word = actr.makechunk("", "storedWord", form="w7", meaning="m2", category="noun")
+        self.assertIn(word, dm)
+        self.assertEqual(list(dm[word]), [7])
+        self.assertNotIn(actr.makechunk("", "storedWord", form="w7", meaning="m2"), dm)
+        self.assertNotIn(actr.makechunk("", "storedWord", form="w7", meaning="m3", category="noun"), dm)
+        self.assertEqual(list(dm), list(self.dm))
+        self.assertEqual(dm._unbuilt, 30) #created chunks are not kept
+
+    def test_index(self):
+        dm = declarative.DecMem.load(self.file)
+        for request in ("isa storedWord category noun meaning m2", "isa storedWord form w4", "isa storedWord meaning m9", "isa storedPair second x"):
+            request = actr.chunkstring(string=request)
+            self.assertEqual(dm.find_candidates(request), self.dm.find_candidates(request))
+        request = actr.makechunk("", "storedPair", first=self.words[3])
+        self.assertEqual(dm.find_candidates(request), [self.pair])
+        for value in ("noun", "m2", "w4", self.words[3], "x"):
+            self.assertEqual(dm.fan(value), self.dm.fan(value))
+        rows = np.arange(len(dm))
+        self.assertEqual([dm.value(x) for x in dm.value_ids(rows, "meaning")], [self.dm.value(x) for x in self.dm.value_ids(rows, "meaning")])
+
+    def test_overlay(self):
+        dm = declarative.DecMem.load(self.file)
+        copied = dm.copy()
+        del dm[self.words[1]]
+        new = actr.makechunk("", "storedWord", form="new", meaning="m1", category="noun")
+        dm.add(new, 40)
+        request = actr.chunkstring(string="isa storedWord category noun meaning m1")
+        self.assertEqual(dm.find_candidates(request), [self.words[11], self.words[21], new])
+        self.assertEqual(dm.fan("m1"), 6)
+        self.assertEqual(dm.fan("noun", "category"), 15)
+        self.assertEqual(len(dm), 31)
+        self.assertIs(copied._stored, dm._stored)
+        self.assertEqual(copied.find_candidates(request), [self.words[1], self.words[11], self.words[21]])
+        self.assertEqual(len(copied), 31)
+
 if __name__ == '__main__':
     unittest.main()
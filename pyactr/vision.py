@@ -50,6 +50,21 @@ class VisualLocation(buffers.Buffer):
         except ValueError:
             raise ACTRError('The default harvest set in the visuallocation buffer is not a possible declarative memory')
 
+    def get_state(self):
+        """
+        Return the state of the buffer (its content, state and recently found stimuli), used in model snapshots.
+        """
+        state = super().get_state()
+        state["recent"] = self.recent.copy()
+        return state
+
+    def set_state(self, state):
+        """
+        Set the state of the buffer to state (see get_state).
+        """
+        super().set_state(state)
+        self.recent = state["recent"].copy()
+
     def add(self, elem, found_stim, time=0, harvest=None):
         """
         Clear current buffer (into a memory) and adds a new chunk. Decl. memory is either specified as default_harvest, when Visual is initialized, or it can be specified as the argument of harvest.
@@ -257,6 +272,25 @@ class Visual(buffers.Buffer):
         #parameters
         self.model_parameters = {}
 
+    def get_state(self):
+        """
+        Return the state of the buffer (its content, state, the states of preparation, processor, execution and automatic attending, and the current focus), used in model snapshots.
+        """
+        state = super().get_state()
+        state.update({"preparation": self.preparation, "processor": self.processor, "execution": self.execution,
+                      "autoattending": self.autoattending, "attend_automatic": self.attend_automatic, "last_mvt": self.last_mvt,
+                      "current_focus": list(self.current_focus)})
+        return state
+
+    def set_state(self, state):
+        """
+        Set the state of the buffer to state (see get_state).
+        """
+        super().set_state(state)
+        for name in ("preparation", "processor", "execution", "autoattending", "attend_automatic", "last_mvt"):
+            setattr(self, name, state[name])
+        self.current_focus = list(state["current_focus"])
+
     @property
     def default_harvest(self):
         """
@@ -301,7 +335,7 @@ class Visual(buffers.Buffer):
         
         if new_chunk:
             angle_distance = 2*utilities.calculate_visual_angle(self.environment.current_focus, (stim['position'][0], stim['position'][1]), self.environment.size, self.environment.simulated_screen_size, self.environment.viewing_distance) #the stimulus has to be within 2 degrees from the focus (foveal region)
-            encoding_time = utilities.calculate_delay_visual_attention(angle_distance=angle_distance, K=model_parameters["eye_mvt_scaling_parameter"], k=model_parameters['eye_mvt_angle_parameter'], emma_noise=model_parameters['emma_noise'], vis_delay=stim.get('vis_delay'))
+            encoding_time = utilities.calculate_delay_visual_attention(angle_distance=angle_distance, K=model_parameters["eye_mvt_scaling_parameter"], k=model_parameters['eye_mvt_angle_parameter'], emma_noise=model_parameters['emma_noise'], vis_delay=stim.get('vis_delay'), rng=self.rng)
         return new_chunk, encoding_time
 
     def modify(self, otherchunk, actrvariables=None):
@@ -347,10 +381,10 @@ class Visual(buffers.Buffer):
 
         if model_parameters['emma']:
             angle_distance = utilities.calculate_visual_angle(self.environment.current_focus, [float(new_chunk.screen_pos.values.screen_x.values), float(new_chunk.screen_pos.values.screen_y.values)], self.environment.size, self.environment.simulated_screen_size, self.environment.viewing_distance)
-            encoding_time = utilities.calculate_delay_visual_attention(angle_distance=angle_distance, K=model_parameters["eye_mvt_scaling_parameter"], k=model_parameters['eye_mvt_angle_parameter'], emma_noise=model_parameters['emma_noise'], vis_delay=vis_delay)
-            preparation_time = utilities.calculate_preparation_time(emma_noise=model_parameters['emma_noise'])
-            execution_time = utilities.calculate_execution_time(angle_distance, emma_noise=model_parameters['emma_noise'])
-            landing_site = utilities.calculate_landing_site([float(new_chunk.screen_pos.values.screen_x.values), float(new_chunk.screen_pos.values.screen_y.values)], angle_distance, emma_landing_site_noise=model_parameters['emma_landing_site_noise'])
+            encoding_time = utilities.calculate_delay_visual_attention(angle_distance=angle_distance, K=model_parameters["eye_mvt_scaling_parameter"], k=model_parameters['eye_mvt_angle_parameter'], emma_noise=model_parameters['emma_noise'], vis_delay=vis_delay, rng=self.rng)
+            preparation_time = utilities.calculate_preparation_time(emma_noise=model_parameters['emma_noise'], rng=self.rng)
+            execution_time = utilities.calculate_execution_time(angle_distance, emma_noise=model_parameters['emma_noise'], rng=self.rng)
+            landing_site = utilities.calculate_landing_site([float(new_chunk.screen_pos.values.screen_x.values), float(new_chunk.screen_pos.values.screen_y.values)], angle_distance, emma_landing_site_noise=model_parameters['emma_landing_site_noise'], rng=self.rng)
         elif not model_parameters['emma']:
             encoding_time = 0.085
             preparation_time = 0